@@ -1,7 +1,23 @@
 from .asynchronous import *
 from .caching import *
-from .cli import *
+from .cli.base import *
 from .git import *
 from .reflection import *
-from .rest import *
-from .utils import *
\ No newline at end of file
+from .utils.base import *
+from .utils.daemons import *
+from .utils import pipes
+
+# The names of `cli` and `utils` are imported from their eager submodules, as their `__all__` includes lazy names
+_submodule_attrs = {
+    'rest': ['async_get', 'async_put', 'async_post', 'async_delete', 'get', 'post', 'put', 'delete', 'AsyncAPIHandler'],
+    'utils.wrangle': ['df_to_tsv', 'df_to_clipboard', 'flatten_dict', 'flatten_records_to_df'],
+    'cli.data_questionnaire': ['data_questionnaire'],
+    'llm': [],
+    'algos': [],
+}
+__getattr__, __dir__ = lazy_module_attrs(__name__, _submodule_attrs)
+__all__ = [
+    *asynchronous.__all__, *caching.__all__, *cli.base.__all__, *git.__all__, *reflection.__all__,
+    *utils.base.__all__, *utils.daemons.__all__, 'pipes',
+    *[attr for attrs in _submodule_attrs.values() for attr in attrs],
+]
@@ -1,2 +1,8 @@
-from .str_matching import *
-from ._smart_dedup import smart_dedup as smart_dedup
\ No newline at end of file
+from adulib.reflection import lazy_module_attrs as _lazy_module_attrs
+
+_submodule_attrs = {
+    'str_matching': ['fuzzy_match', 'get_vector_dist_matrix', 'embedding_match'],
+    '_smart_dedup': ['smart_dedup'],
+}
+__getattr__, __dir__ = _lazy_module_attrs(__name__, _submodule_attrs)
+__all__ = [attr for attrs in _submodule_attrs.values() for attr in attrs]
@@ -0,0 +1,290 @@
+# AUTOGENERATED! DO NOT EDIT! File to edit: ../../pts/api/caching.pct.py.
+
+# %% auto #0
+__all__ = ['set_default_cache_path', 'get_default_cache_path', 'CompressedDisk', 'set_cache_compression', 'get_default_cache',
+           'get_cache', 'clear_cache_key', 'is_in_cache', 'memoize']
+
+# %% ../../pts/api/caching.pct.py #d8bb47b0
+import diskcache
+from pathlib import Path
+from diskcache.core import ENOVAL, UNKNOWN, MODE_RAW, MODE_BINARY, args_to_key, full_name
+import functools as ft
+import asyncio
+import pickle
+import warnings
+from typing import Literal, Union
+from .utils import check_mutual_exclusivity
+
+# %% ../../pts/api/caching.pct.py #f71a7c0f
+_caches = {}
+_default_cache = None
+_default_cache_path = None
+
+# %% ../../pts/api/caching.pct.py #b3b78775
+def set_default_cache_path(cache_path:Path):
+    """
+    Set the path for the temporary cache.
+    """
+    global _default_cache_path
+    _default_cache_path = cache_path
+
+# %% ../../pts/api/caching.pct.py #a0bdbff2
+def get_default_cache_path() -> Path|None:
+    """
+    Set the path for the temporary cache.
+    """
+    return _default_cache_path
+
+# %% ../../pts/api/caching.pct.py #1fdcd872
+def _create_cache(cache_path:Union[Path,None]=None, temp:bool=False):
+    """
+    Creates a new cache with the right policies. This ensures that no data is lost as the cache grows.
+    """
+    if temp and cache_path is not None:
+        raise ValueError("'temp' cannot be set to True if a 'cache_path' is provided.")
+
+    if cache_path is None and not temp:
+        if _default_cache_path is None:
+            raise ValueError("The default cache path is not set. Please set it using `set_default_cache_path`.")
+        cache_path = _default_cache_path
+    
+    return diskcache.Cache(cache_path, eviction_policy="none", size_limit=2**40, disk=CompressedDisk)
+
+# %% ../../pts/api/caching.pct.py #be36db37
+_COMPRESSED_MAGIC = b'\x00adulib-z'
+_CODEC_IDS = {'zlib': 1, 'zstd': 2, 'lz4': 3}
+_CODEC_NAMES = {codec_id: name for name, codec_id in _CODEC_IDS.items()}
+
+@ft.lru_cache(maxsize=None)
+def _load_codec(name: str):
+    "Returns the functions `(compress(data, level), decompress(data))` of a codec. Raises `ImportError` if the codec is not installed."
+    if name == 'zlib':
+        import zlib
+        return (lambda data, level: zlib.compress(data, 6 if level is None else level)), zlib.decompress
+    elif name == 'zstd':
+        import zstandard
+        return (
+            (lambda data, level: zstandard.ZstdCompressor(level=3 if level is None else level).compress(data)),
+            (lambda data: zstandard.ZstdDecompressor().decompress(data)),
+        )
+    elif name == 'lz4':
+        import lz4.frame
+        return (lambda data, level: lz4.frame.compress(data, compression_level=0 if level is None else level)), lz4.frame.decompress
+    raise ValueError(f"Unknown compression '{name}'. Must be one of {list(_CODEC_IDS)}.")
+
+# %% ../../pts/api/caching.pct.py #3bd908b2
+class CompressedDisk(diskcache.Disk):
+    """
+    A `diskcache.Disk` that compresses pickled values with `zstd`, `lz4` or `zlib`.
+
+    Values whose pickle is smaller than `min_compress_size` bytes are stored as usual. If the `zstandard` or `lz4`
+    package is not installed, `zlib` is used instead. Compressed values are always decompressed on read, regardless
+    of the current `compression`.
+    """
+    def __init__(
+        self,
+        directory,
+        compression: Literal['zstd', 'lz4', 'zlib', None] = None,
+        compression_level: Union[int, None] = None,
+        min_compress_size: int = 1024,
+        **kwargs,
+    ):
+        super().__init__(directory, **kwargs)
+        self.compression = compression
+        self.compression_level = compression_level
+        self.min_compress_size = min_compress_size
+
+    @property
+    def compression(self) -> Union[str, None]:
+        return self._compression
+
+    @compression.setter
+    def compression(self, compression: Union[str, None]):
+        if compression is not None and compression not in _CODEC_IDS:
+            raise ValueError(f"Unknown compression '{compression}'. Must be one of {list(_CODEC_IDS)} or None.")
+        self._compression = compression
+        self._codec_name = compression
+        if compression is not None:
+            try:
+                _load_codec(compression)
+            except ImportError:
+                warnings.warn(f"The package for '{compression}' compression is not installed. Using 'zlib' instead.")
+                self._codec_name = 'zlib'
+
+    def store(self, value, read, key=UNKNOWN):
+        if self._codec_name is None or read:
+            return super().store(value, read, key)
+        data = pickle.dumps(value, protocol=self.pickle_protocol)
+        if len(data) < self.min_compress_size:
+            return super().store(value, read, key)
+        compress, _ = _load_codec(self._codec_name)
+        header = _COMPRESSED_MAGIC + bytes([_CODEC_IDS[self._codec_name]])
+        return super().store(header + compress(data, self.compression_level), read, key)
+
+    def fetch(self, mode, filename, value, read):
+        value = super().fetch(mode, filename, value, read)
+        if mode in (MODE_RAW, MODE_BINARY) and type(value) is bytes and value.startswith(_COMPRESSED_MAGIC):
+            codec_name = _CODEC_NAMES[value[len(_COMPRESSED_MAGIC)]]
+            _, decompress = _load_codec(codec_name)
+            return pickle.loads(decompress(value[len(_COMPRESSED_MAGIC)+1:]))
+        return value
+
+# %% ../../pts/api/caching.pct.py #906741f1
+def set_cache_compression(
+    compression: Literal['zstd', 'lz4', 'zlib', None],
+    level: Union[int, None] = None,
+    cache: Union[Path, diskcache.Cache, None] = None,
+):
+    """
+    Set the compression of the values written to a cache (the default cache if `cache` is `None`).
+    Pass `None` to turn compression off.
+
+    The setting is stored in the cache directory, so it persists across sessions. Values that are already in
+    the cache are not recompressed.
+    """
+    if cache is None:
+        cache = get_default_cache()
+    elif isinstance(cache, diskcache.Cache):
+        pass # do nothing
+    else:
+        cache_path = cache
+        cache = get_cache(cache_path)
+    if not isinstance(cache.disk, CompressedDisk):
+        raise ValueError("The cache does not use `CompressedDisk`.")
+    cache.disk.compression = compression # Validates the compression before it is persisted
+    for key, value in [('disk_compression', compression), ('disk_compression_level', level)]:
+        # `Cache.reset` only updates settings that already exist in the Settings table
+        cache._sql_retry('INSERT OR REPLACE INTO Settings VALUES (?, ?)', (key, value))
+        cache.reset(key, value, update=False)
+
+# %% ../../pts/api/caching.pct.py #fc814ff6
+def get_default_cache():
+    """
+    Retrieve the default cache.
+    """
+    global _default_cache
+    if _default_cache_path is None:
+        raise ValueError("The default cache path is not set. Please set it using `set_default_cache_path`.")
+    if _default_cache is None:
+        _default_cache = _create_cache(_default_cache_path)
+    return _default_cache
+
+# %% ../../pts/api/caching.pct.py #aa308ff3
+def get_cache(cache_path:Path):
+    """
+    Retrieve a cache instance for the given path. If no path is provided, 
+    the default cache is used. If the cache does not exist, it is created 
+    using the specified cache path or the default cache path.
+    """
+    cache_path = Path(cache_path).as_posix()
+    if cache_path in _caches:
+        cache = _caches[cache_path]
+    else:
+        cache = _create_cache(cache_path)
+        _caches[cache_path] = cache
+    return cache
+
+# %% ../../pts/api/caching.pct.py #b93ec35a
+def clear_cache_key(cache_key, cache:Union[Path,diskcache.Cache,None]=None, allow_non_existent:bool=False):
+    if cache is None:
+        cache = get_default_cache()
+    elif isinstance(cache, diskcache.Cache):
+        pass # do nothing
+    else:
+        cache_path = cache
+        cache = get_cache(cache_path)
+    if allow_non_existent and cache_key not in cache: return
+    del cache[cache_key]
+
+# %% ../../pts/api/caching.pct.py #0be39b75
+def is_in_cache(key: tuple, cache:Union[Path,diskcache.Cache,None]=None):
+    if cache is None:
+        cache = get_default_cache()
+    elif isinstance(cache, diskcache.Cache):
+        pass # do nothing
+    else:
+        cache_path = cache
+        cache = get_cache(cache_path)
+    return cache.get(key, default=ENOVAL) is not ENOVAL
+
+# %% ../../pts/api/caching.pct.py #cc10f68f
+__memoized_function_names = set()
+
+# %% ../../pts/api/caching.pct.py #0b183787
+def memoize(cache:Union[Path,diskcache.Cache,None]=None,
+            temp=False,
+            typed=True,
+            expire=None,
+            tag=None,
+            return_cache_key=False,
+):
+    """
+    Decorator for memoizing function results to improve performance.
+
+    This decorator stores the results of function calls, allowing subsequent
+    calls with the same arguments to retrieve the result from the cache instead
+    of recomputing it. You can specify a cache object or use a temporary cache
+    if none is provided.
+
+    Parameters:
+    - cache (Union[Path, diskcache.Cache, None], optional): A cache object or a
+      path to the cache directory. Defaults to a temporary cache if None.
+    - temp (bool, optional): If True, use a temporary cache. Cannot be True if
+      a cache is provided. Defaults to False.
+    - typed (bool, optional): If True, cache function arguments of different
+      types separately. Defaults to True.
+    - expire (int, optional): Cache expiration time in seconds. If None, cache
+      entries do not expire.
+    - tag (str, optional): A tag to associate with cache entries.
+    - return_cache_key (bool, optional): If True, return the cache key along
+      with the result, in the order `(cache_key, result)`. Defaults to False.
+
+    Returns:
+    - function: A decorator that applies memoization to the target function.
+    """
+
+    if temp and cache is not None:
+        raise ValueError("'temp' cannot be set to True if a cache is provided.")
+    
+    if not temp:
+        if cache is None:
+            cache = get_default_cache()
+        elif isinstance(cache, diskcache.Cache):
+            pass # do nothing
+        else:
+            cache_path = cache
+            cache = get_cache(cache_path)
+    else:
+        cache = _create_cache(temp=True)
+                            
+    def decorator(func):
+        func_name = full_name(func)
+        if func_name in __memoized_function_names:
+            print(f"Warning: A function with the name '{func_name}' is already memoized.")
+        __memoized_function_names.add(func_name)
+        if asyncio.iscoroutinefunction(func):
+            @ft.wraps(func)
+            async def wrapper(*args, **kwargs):
+                key = args_to_key((func_name,), args, kwargs, typed, ())
+                result = cache.get(key, default=ENOVAL, retry=True)
+                if result is ENOVAL:
+                    result = await func(*args, **kwargs)
+                    if expire is None or expire > 0:
+                        cache.set(key, result, expire, tag=tag, retry=True)
+                if return_cache_key:
+                    return key, result
+                return result
+        else:
+            def wrapper(*args, **kwargs):
+                key = args_to_key((func_name,), args, kwargs, typed, ())
+                result = cache.get(key, default=ENOVAL, retry=True)
+                if result is ENOVAL:
+                    result = func(*args, **kwargs)
+                    if expire is None or expire > 0:
+                        cache.set(key, result, expire, tag=tag, retry=True)
+                if return_cache_key:
+                    return key, result
+                return result
+        return wrapper
+                                
+    return decorator
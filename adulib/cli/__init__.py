@@ -1,2 +1,8 @@
 from .base import *
-from .data_questionnaire import data_questionnaire
\ No newline at end of file
+from adulib.reflection import lazy_module_attrs as _lazy_module_attrs
+
+_submodule_attrs = {
+    'data_questionnaire': ['data_questionnaire'],
+}
+__getattr__, __dir__ = _lazy_module_attrs(__name__, _submodule_attrs)
+__all__ = [*base.__all__, *[attr for attrs in _submodule_attrs.values() for attr in attrs]]
@@ -0,0 +1,23 @@
+# AUTOGENERATED! DO NOT EDIT! File to edit: ../../pts/api/git.pct.py.
+
+# %% auto #0
+__all__ = ['find_root_repo_path']
+
+# %% ../../pts/api/git.pct.py #9dbb5c44
+from pathlib import Path
+import os
+
+# %% ../../pts/api/git.pct.py #b2a2c8dd
+def find_root_repo_path(path=None):
+    current_path = Path(path or '.').expanduser().resolve()
+    home_path = Path.home()
+    
+    while current_path != home_path:
+        if (current_path / '.git').exists():
+            return str(current_path)
+        parent_path = current_path.parent
+        if parent_path == current_path:  # Reached the root directory
+            break
+        current_path = parent_path
+    
+    return None
@@ -1,9 +1,37 @@
-from .base import *
-from .rate_limits import *
-from .call_logging import *
-from .caching import *
-from ._utils import *
-from .tokens import *
-from .completions import *
-from .text_completions import *
-from .embeddings import *
\ No newline at end of file
+from adulib.reflection import lazy_module_attrs as _lazy_module_attrs
+
+_submodule_attrs = {
+    'base': ['available_models', 'search_models'],
+    'rate_limits': [
+        'default_rpm', 'default_retry_on_exception', 'default_max_retries', 'default_retry_delay', 'default_timeout',
+        'set_default_request_rate_limit', 'set_request_rate_limit', 'get_request_rate_limit', 'RequestRateLimiter',
+        'RateLimitBackend', 'LocalRateLimitBackend', 'DiskRateLimitBackend', 'set_default_rate_limit_backend', 'AdaptiveLimiter',
+        'TokenRateLimiter', 'set_token_rate_limit', 'ConcurrencyLimiter', 'set_max_concurrency', 'get_max_concurrency',
+        'RetryPolicy', 'default_retry_policy', 'set_default_retry_policy',
+    ],
+    'call_logging': [
+        'CostTracker', 'start_tracking', 'stop_tracking', 'get_tracked_logs', 'print_tracking_stats', 'CallLog',
+        'set_call_log_save_path', 'get_cached_call_log', 'get_call_logs', 'get_total_costs', 'get_total_input_tokens',
+        'get_total_output_tokens', 'get_total_tokens', 'save_call_log', 'load_call_log_file',
+    ],
+    '_utils': ['LLMStream', 'AsyncLLMStream'],
+    'caching': [
+        'get_cache_key', 'default_cache_key_format', 'default_legacy_cache_key_lookup', 'set_cache_key_format', 'migrate_cache_records',
+        'default_cache_io_max_workers', 'set_cache_io_max_workers', 'default_cache_key_params', 'set_default_cache_key_params',
+        'default_cache_key_exclude_params', 'set_default_cache_key_exclude_params',
+        'rekey_cache_records', 'default_embedding_cache_dtype', 'set_embedding_cache_dtype',
+    ],
+    'tokens': ['token_counter', 'default_token_count_cache_size', 'set_token_count_cache_size', 'count_tokens', 'count_message_tokens'],
+    'completions': ['completion', 'async_completion', 'stream_completion', 'async_stream_completion', 'single', 'async_single'],
+    'text_completions': ['text_completion', 'async_text_completion'],
+    'embeddings': [
+        'embedding', 'async_embedding', 'batch_embeddings', 'default_embedding_max_concurrency', 'async_iter_batch_embeddings',
+        'async_batch_embeddings',
+    ],
+    'batch_api': [
+        'BatchProvider', 'LiteLLMBatchProvider', 'FakeBatchProvider', 'BatchJob', 'async_submit_batch', 'async_collect_batch',
+        'async_run_batch',
+    ],
+}
+__getattr__, __dir__ = _lazy_module_attrs(__name__, _submodule_attrs)
+__all__ = [attr for attrs in _submodule_attrs.values() for attr in attrs]
@@ -0,0 +1,696 @@
+# AUTOGENERATED! DO NOT EDIT! File to edit: ../../../pts/api/llm/04_internal_utils.pct.py.
+
+# %% auto #0
+__all__ = ['LLMStream', 'AsyncLLMStream']
+
+# %% ../../../pts/api/llm/04_internal_utils.pct.py #0259fcbb
+try:
+    import litellm
+    import inspect
+    import functools
+    import time
+    import asyncio
+    import warnings
+    from typing import Any, AsyncIterable, Callable, Iterable, Optional, Union
+    from pathlib import Path
+    from adulib.caching import get_default_cache_path
+    from diskcache import ENOVAL
+    from adulib.llm.caching import _get_cache_record, _set_cache_record, _async_get_cache_record, _async_set_cache_record, _single_flight, _get_legacy_cache_key_func, _get_cache_key_content, _register_cache_key_content_args, get_cache_key
+    from adulib.llm.call_logging import _log_call, _async_log_call, _add_log_to_tracker, CallLog
+    from adulib.llm.rate_limits import _get_limiter, _get_token_limiter, _get_concurrency_limiter, _unlimited_concurrency, _record_call_outcome, _resolve_retry_policy, RetryPolicy, default_retry_on_exception, default_timeout
+except ImportError as e:
+    raise ImportError(f"Install adulib[llm] to use this API.") from e
+
+# %% ../../../pts/api/llm/04_internal_utils.pct.py #c14eb449
+class MaximumRetriesException(Exception):
+    def __init__(self, retry_exceptions: list[Exception]):
+        self.retry_exceptions = retry_exceptions
+        self.retry_exceptions_str = "\n".join([f"{i}: ({type(e).__name__}) {e}" for i, e in enumerate(retry_exceptions)])
+        super().__init__(f"Maximum retries ({len(retry_exceptions)}) reached. Exceptions:\n{self.retry_exceptions_str}")
+
+# %% ../../../pts/api/llm/04_internal_utils.pct.py #aa068de8
+def _bind_func_args(func_sig: inspect.Signature, args: tuple, kwargs: dict) -> dict:
+    "Binds the arguments of a call to `func_sig`, with the variadic keyword arguments merged into the others."
+    func_args_and_kwargs = dict(func_sig.bind(*args, **kwargs).arguments)
+    for name, param in func_sig.parameters.items():
+        if param.kind == inspect.Parameter.VAR_KEYWORD and name in func_args_and_kwargs:
+            func_args_and_kwargs.update(func_args_and_kwargs.pop(name))
+    return func_args_and_kwargs
+
+# %% ../../../pts/api/llm/04_internal_utils.pct.py #05e0973e
+def _derive_cache_key(
+    func_sig: inspect.Signature,
+    func_cache_name: str,
+    cache_key_content_args: list[str],
+    args: tuple,
+    kwargs: dict,
+    cache_key_params: Optional[list[str]],
+    cache_key_prefix: Optional[str],
+    include_model_in_cache_key: bool,
+):
+    """
+    Derives the cache key of a call. The sync and async factories share this function, so that e.g. `completion` and
+    `async_completion` use the same cache key for the same inputs.
+
+    Returns the tuple `(func_args_and_kwargs, model, cache_key_content, cache_key)`.
+    """
+    if not all(arg in func_sig.parameters for arg in cache_key_content_args):
+        raise ValueError(f"Invalid cache_key_content_args: {cache_key_content_args}.")
+    func_args_and_kwargs = _bind_func_args(func_sig, args, kwargs)
+    model = func_args_and_kwargs['model']
+    cache_key_content = _get_cache_key_content(func_args_and_kwargs, cache_key_content_args, cache_key_params)
+    cache_key = get_cache_key(model, func_cache_name, cache_key_content, cache_key_prefix, include_model_in_cache_key)
+    return func_args_and_kwargs, model, cache_key_content, cache_key
+
+# %% ../../../pts/api/llm/04_internal_utils.pct.py #2402e2f0
+def _llm_func_factory(
+    func: Callable,
+    func_name: str,
+    func_cache_name: str,
+    module_name: str,
+    cache_key_content_args: list[str],
+    retrieve_log_data: Optional[Callable] = None,
+    default_return_info: bool = True,
+    estimate_input_tokens: Optional[Callable] = None,
+    rate_limited: bool = True,
+):
+    func_sig = inspect.signature(func)
+    _register_cache_key_content_args(func_cache_name, cache_key_content_args)
+    def llm_func(
+        *args,
+        # Cache settings
+        cache_enabled: bool=True,
+        cache_path: Optional[Union[str, Path]]=None,
+        cache_key_prefix: Optional[str]=None,
+        include_model_in_cache_key: bool=True,
+        cache_key_params: Optional[list[str]]=None,
+        return_cache_key: bool=False,
+        return_info: bool=default_return_info,
+        # Retry settings
+        enable_retries: bool=True,
+        retry_on_exceptions: Optional[list[Exception]]=None,
+        retry_on_all_exceptions: bool=False,
+        retry_policy: Optional[RetryPolicy]=None,
+        max_retries: Optional[int]=None,
+        retry_delay: Optional[float]=None,
+        **kwargs,
+    ):
+        if retry_on_exceptions is None: retry_on_exceptions = default_retry_on_exception
+        retry_policy = _resolve_retry_policy(retry_policy, max_retries, retry_delay)
+        
+        func_args_and_kwargs, model, cache_key_content, cache_key = _derive_cache_key(
+            func_sig, func_cache_name, cache_key_content_args, args, kwargs, cache_key_params, cache_key_prefix, include_model_in_cache_key,
+        )
+        if return_cache_key: return cache_key
+        
+        if cache_path is None:
+            cache_path = get_default_cache_path()
+        
+        # Cache lookup. The result and its call log are retrieved with a single cache read.
+        legacy_cache_key_func = _get_legacy_cache_key_func(model, func_cache_name, cache_key_content, cache_key_prefix, include_model_in_cache_key)
+        record = _get_cache_record(cache_key, cache_path, legacy_cache_key_func) if cache_enabled else ENOVAL
+        cache_hit = record is not ENOVAL
+        if cache_hit:
+            result, call_info = record
+        else:
+            # Execute with rate limiting and retries. The rate limiters are shared with the async functions, and are thread-safe.
+            api_key = kwargs.get("api_key", None)
+            limiter = _get_limiter(model, api_key) if rate_limited else None
+            token_limiter = _get_token_limiter(model, api_key) if rate_limited else None
+            estimated_tokens = 0
+            if token_limiter is not None and estimate_input_tokens is not None:
+                estimated_tokens = estimate_input_tokens(model, func_args_and_kwargs)
+            success = False
+            exceptions = []
+            delay = None
+            retries_start = time.monotonic()
+            for attempt in range(retry_policy.max_retries):
+                if limiter is not None: limiter.wait_sync()
+                if token_limiter is not None: token_limiter.acquire_sync(estimated_tokens)
+                try:
+                    result = func(*args, **kwargs)
+                    if limiter is not None: _record_call_outcome(limiter)
+                    success = True
+                    break
+                except BaseException as e:
+                    if limiter is not None: _record_call_outcome(limiter, e)
+                    if token_limiter is not None: token_limiter.reconcile(estimated_tokens, 0) # Failed calls are refunded
+                    if not enable_retries: raise e
+                    if not (retry_on_all_exceptions or any([isinstance(e, exc) for exc in retry_on_exceptions])): raise e
+                    exceptions.append(e)
+                    delay = retry_policy.get_retry_delay(attempt, delay, e, time.monotonic() - retries_start)
+                    if delay is None: break
+                    time.sleep(delay)
+                        
+            if not success:
+                raise MaximumRetriesException(exceptions)
+            
+            # Call logging
+            call_info = None
+            if retrieve_log_data is not None:
+                cache_args = {
+                    "cache_path": cache_path,
+                    "cache_key_prefix": cache_key_prefix,
+                    "include_model_in_cache_key": include_model_in_cache_key,
+                }
+                log_data = retrieve_log_data(model, func_args_and_kwargs, result, cache_args)
+                call_info = _log_call(cache_key, cache_path, model=model, **log_data)
+                if token_limiter is not None:
+                    token_limiter.reconcile(estimated_tokens, (log_data['input_tokens'] or 0) + (log_data['output_tokens'] or 0))
+            
+            if cache_enabled:
+                _set_cache_record(cache_key, result, call_info, cache_path)
+        
+        if retrieve_log_data is not None:
+            if call_info is None:
+                warnings.warn(f"Call log for cache key '{cache_key}' not found in cache at '{cache_path}'. This may indicate a caching issue.")
+            else:
+                _add_log_to_tracker(CallLog(**call_info), cache_hit) # Track the call log if a tracker is set up
+        
+        if return_info:
+            if retrieve_log_data is not None:
+                return result, cache_hit, call_info
+            else:
+                return result, cache_hit
+        else:
+            return result
+    
+    llm_func.__name__ = func_name
+    llm_func.__module__ = module_name
+    llm_func.__qualname__ = func_name
+    return llm_func
+
+# %% ../../../pts/api/llm/04_internal_utils.pct.py #67e727e5
+def _llm_async_func_factory(
+    func: Callable,
+    func_name: str,
+    func_cache_name: str,
+    module_name: str,
+    cache_key_content_args: list[str],
+    retrieve_log_data: Optional[Callable] = None,
+    default_return_info: bool = True,
+    estimate_input_tokens: Optional[Callable] = None,
+    limit_concurrency: bool = True, # Disabled by callers that hold the concurrency slot themselves (e.g. streams)
+):
+    func_sig = inspect.signature(func)
+    _register_cache_key_content_args(func_cache_name, cache_key_content_args)
+    async def llm_func(
+        *args,
+        # Cache settings
+        cache_enabled: bool=True,
+        cache_path: Optional[Union[str, Path]]=None,
+        cache_key_prefix: Optional[str]=None,
+        include_model_in_cache_key: bool=True,
+        cache_key_params: Optional[list[str]]=None,
+        return_cache_key: bool=False,
+        return_info: bool=default_return_info,
+        # Retry settings
+        enable_retries: bool=True,
+        retry_on_exceptions: Optional[list[Exception]]=None,
+        retry_on_all_exceptions: bool=False,
+        retry_policy: Optional[RetryPolicy]=None,
+        max_retries: Optional[int]=None,
+        retry_delay: Optional[float]=None,
+        timeout: Optional[int]=None,
+        **kwargs,
+    ):
+        if retry_on_exceptions is None: retry_on_exceptions = default_retry_on_exception
+        retry_policy = _resolve_retry_policy(retry_policy, max_retries, retry_delay)
+        if timeout is None: timeout = default_timeout
+        
+        func_args_and_kwargs, model, cache_key_content, cache_key = _derive_cache_key(
+            func_sig, func_cache_name, cache_key_content_args, args, kwargs, cache_key_params, cache_key_prefix, include_model_in_cache_key,
+        )
+        if return_cache_key: return cache_key
+        
+        if cache_path is None:
+            cache_path = get_default_cache_path()
+        
+        async def execute_and_log():
+            # Cache lookup. The result and its call log are retrieved with a single cache read.
+            legacy_cache_key_func = _get_legacy_cache_key_func(model, func_cache_name, cache_key_content, cache_key_prefix, include_model_in_cache_key)
+            record = await _async_get_cache_record(cache_key, cache_path, legacy_cache_key_func) if cache_enabled else ENOVAL
+            if record is not ENOVAL:
+                result, call_info = record
+                return True, result, call_info
+            
+            # Execute with rate limiting and retries. Every attempt waits for the rate limiter, and adaptive
+            # rate limiters are informed of the outcome of every attempt. Every attempt also holds a slot of the
+            # concurrency limiter, which is released while waiting to retry.
+            api_key = kwargs.get("api_key", None)
+            limiter = _get_limiter(model, api_key)
+            token_limiter = _get_token_limiter(model, api_key)
+            concurrency_limiter = _get_concurrency_limiter(model, api_key) if limit_concurrency else _unlimited_concurrency
+            estimated_tokens = 0
+            if token_limiter is not None and estimate_input_tokens is not None:
+                estimated_tokens = estimate_input_tokens(model, func_args_and_kwargs)
+            success = False
+            exceptions = []
+            delay = None
+            retries_start = time.monotonic()
+            for attempt in range(retry_policy.max_retries):
+                async with concurrency_limiter:
+                    await limiter.wait()
+                    if token_limiter is not None: await token_limiter.acquire(estimated_tokens)
+                    try:
+                        if timeout is not None:
+                            result = await asyncio.wait_for(func(*args, **kwargs), timeout)
+                        else:
+                            result = await func(*args, **kwargs)
+                        _record_call_outcome(limiter)
+                        success = True
+                    except BaseException as e:
+                        _record_call_outcome(limiter, e)
+                        if token_limiter is not None: token_limiter.reconcile(estimated_tokens, 0) # Failed calls are refunded
+                        if not enable_retries: raise e
+                        if not (retry_on_all_exceptions or any([isinstance(e, exc) for exc in retry_on_exceptions])): raise e
+                        exceptions.append(e)
+                        delay = retry_policy.get_retry_delay(attempt, delay, e, time.monotonic() - retries_start)
+                if success or delay is None: break
+                await asyncio.sleep(delay)
+                        
+            if not success:
+                raise MaximumRetriesException(exceptions)
+            
+            # Call logging
+            call_info = None
+            if retrieve_log_data is not None:
+                cache_args = {
+                    "cache_path": cache_path,
+                    "cache_key_prefix": cache_key_prefix,
+                    "include_model_in_cache_key": include_model_in_cache_key,
+                }
+                log_data = retrieve_log_data(model, func_args_and_kwargs, result, cache_args)
+                call_info = await _async_log_call(cache_key, cache_path, model=model, **log_data)
+                if token_limiter is not None:
+                    token_limiter.reconcile(estimated_tokens, (log_data['input_tokens'] or 0) + (log_data['output_tokens'] or 0))
+            
+            if cache_enabled:
+                await _async_set_cache_record(cache_key, result, call_info, cache_path)
+            
+            return False, result, call_info
+        
+        # Concurrent calls with the same cache key are coalesced into a single call. The followers are reported as cache hits.
+        if cache_enabled:
+            flight_key = (Path(cache_path).as_posix() if cache_path is not None else None, cache_key)
+            is_follower, (cache_hit, result, call_info) = await _single_flight(flight_key, execute_and_log)
+            cache_hit = cache_hit or is_follower
+        else:
+            cache_hit, result, call_info = await execute_and_log()
+        
+        if retrieve_log_data is not None:
+            if call_info is None:
+                warnings.warn(f"Call log for cache key '{cache_key}' not found in cache at '{cache_path}'. This may indicate a caching issue.")
+            else:
+                _add_log_to_tracker(CallLog(**call_info), cache_hit) # Track the call log if a tracker is set up
+        
+        if return_info:
+            if retrieve_log_data is not None:
+                return result, cache_hit, call_info
+            else:
+                return result, cache_hit
+        else:
+            return result
+    
+    llm_func.__name__ = func_name
+    llm_func.__module__ = module_name
+    llm_func.__qualname__ = func_name
+    return llm_func
+
+# %% ../../../pts/api/llm/04_internal_utils.pct.py #11033f94
+class LLMStream:
+    """
+    An iterator over the chunks of a streamed LLM call. Once it is exhausted, `response` holds the assembled response
+    and `call_log` the call log. Streams that are not consumed to the end are not cached.
+    """
+    def __init__(
+        self,
+        chunks: Iterable,
+        cache_key: Any,
+        cache_hit: bool,
+        on_complete: Optional[Callable] = None,
+        response: Any = None,
+        call_log: Optional[dict] = None,
+        on_close: Optional[Callable] = None,
+    ):
+        self.cache_key = cache_key
+        self.cache_hit = cache_hit
+        self.response = response
+        self.call_log = call_log
+        self._chunks = chunks
+        self._on_complete = on_complete
+        self._on_close = on_close
+        self._iterator = self._iterate()
+
+    def _iterate(self):
+        chunks = []
+        try:
+            for chunk in self._chunks:
+                chunks.append(chunk)
+                yield chunk
+            if self._on_complete is not None:
+                self.response, self.call_log = self._on_complete(chunks)
+        finally:
+            self._close(chunks)
+
+    def _close(self, chunks: list):
+        "Called with the chunks received so far once the stream is exhausted or closed."
+        if self._on_close is not None:
+            on_close, self._on_close = self._on_close, None
+            on_close(chunks)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._iterator)
+
+    def close(self):
+        "Closes the stream without consuming the remaining chunks."
+        self._iterator.close()
+        if hasattr(self._chunks, 'close'):
+            self._chunks.close()
+        self._close([])
+
+# %% ../../../pts/api/llm/04_internal_utils.pct.py #636c5fc5
+class AsyncLLMStream:
+    """
+    The asynchronous counterpart of `LLMStream`. A stream that is not replayed from the cache holds a slot of the
+    model's concurrency limiter until it is exhausted or closed, so streams that are abandoned early should be closed
+    with `aclose` (or used as an async context manager).
+    """
+    def __init__(
+        self,
+        chunks: Union[Iterable, AsyncIterable],
+        cache_key: Any,
+        cache_hit: bool,
+        on_complete: Optional[Callable] = None,
+        response: Any = None,
+        call_log: Optional[dict] = None,
+        on_close: Optional[Callable] = None,
+    ):
+        self.cache_key = cache_key
+        self.cache_hit = cache_hit
+        self.response = response
+        self.call_log = call_log
+        self._chunks = chunks
+        self._on_complete = on_complete
+        self._on_close = on_close
+        self._iterator = self._iterate()
+
+    async def _iterate(self):
+        chunks = []
+        try:
+            if hasattr(self._chunks, '__aiter__'):
+                async for chunk in self._chunks:
+                    chunks.append(chunk)
+                    yield chunk
+            else: # Replayed from the cache
+                for chunk in self._chunks:
+                    chunks.append(chunk)
+                    yield chunk
+            if self._on_complete is not None:
+                self.response, self.call_log = await self._on_complete(chunks)
+        finally:
+            await self._close(chunks)
+
+    async def _close(self, chunks: list):
+        if self._on_close is not None:
+            on_close, self._on_close = self._on_close, None
+            await on_close(chunks)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self._iterator.__anext__()
+
+    async def aclose(self):
+        "Closes the stream without consuming the remaining chunks."
+        await self._iterator.aclose()
+        if hasattr(self._chunks, 'aclose'):
+            await self._chunks.aclose()
+        await self._close([])
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+# %% ../../../pts/api/llm/04_internal_utils.pct.py #661a29a1
+def _get_used_tokens(log_data: dict) -> int:
+    return (log_data['input_tokens'] or 0) + (log_data['output_tokens'] or 0)
+
+def _get_partial_stream_tokens(
+    model: str, func_args_and_kwargs: dict, chunks: list, build_response: Callable, retrieve_log_data: Optional[Callable],
+) -> Optional[int]:
+    "Returns the tokens used by a stream that was closed early, from the chunks received so far, or None if unknown."
+    if retrieve_log_data is None or not chunks: return None
+    try:
+        return _get_used_tokens(retrieve_log_data(model, func_args_and_kwargs, build_response(chunks, func_args_and_kwargs), {}))
+    except Exception: # e.g. if the chunks can not be assembled
+        return None
+
+# %% ../../../pts/api/llm/04_internal_utils.pct.py #cbdca816
+def _llm_stream_func_factory(
+    func: Callable,
+    func_name: str,
+    func_cache_name: str,
+    module_name: str,
+    cache_key_content_args: list[str],
+    build_response: Callable,
+    retrieve_log_data: Optional[Callable] = None,
+    estimate_input_tokens: Optional[Callable] = None,
+):
+    @functools.wraps(func)
+    def _open_stream(*args, **kwargs):
+        return func(*args, stream=True, **kwargs)
+    
+    open_stream = _llm_func_factory(
+        func=_open_stream,
+        func_name=func_name,
+        func_cache_name=func_cache_name,
+        module_name=module_name,
+        cache_key_content_args=cache_key_content_args,
+        default_return_info=False,
+        estimate_input_tokens=estimate_input_tokens,
+    )
+    
+    func_sig = inspect.signature(func)
+    def llm_func(
+        *args,
+        # Cache settings
+        cache_enabled: bool=True,
+        cache_path: Optional[Union[str, Path]]=None,
+        cache_key_prefix: Optional[str]=None,
+        include_model_in_cache_key: bool=True,
+        cache_key_params: Optional[list[str]]=None,
+        return_cache_key: bool=False,
+        # Retry settings
+        enable_retries: bool=True,
+        retry_on_exceptions: Optional[list[Exception]]=None,
+        retry_on_all_exceptions: bool=False,
+        retry_policy: Optional[RetryPolicy]=None,
+        max_retries: Optional[int]=None,
+        retry_delay: Optional[float]=None,
+        **kwargs,
+    ):
+        cache_key = open_stream(
+            *args, cache_key_prefix=cache_key_prefix, include_model_in_cache_key=include_model_in_cache_key, cache_key_params=cache_key_params,
+            return_cache_key=True, **kwargs,
+        )
+        if return_cache_key: return cache_key
+        
+        if cache_path is None:
+            cache_path = get_default_cache_path()
+        func_args_and_kwargs = _bind_func_args(func_sig, args, kwargs)
+        model = func_args_and_kwargs['model']
+        
+        # Cached streams are replayed
+        record = _get_cache_record(cache_key, cache_path) if cache_enabled else ENOVAL
+        if record is not ENOVAL:
+            chunks, call_info = record
+            if call_info is not None:
+                _add_log_to_tracker(CallLog(**call_info), True)
+            return LLMStream(chunks, cache_key, cache_hit=True, response=build_response(chunks, func_args_and_kwargs), call_log=call_info)
+        
+        stream = open_stream(
+            *args,
+            cache_enabled=False,
+            enable_retries=enable_retries,
+            retry_on_exceptions=retry_on_exceptions,
+            retry_on_all_exceptions=retry_on_all_exceptions,
+            retry_policy=retry_policy,
+            max_retries=max_retries,
+            retry_delay=retry_delay,
+            **kwargs,
+        )
+        
+        # Opening the stream charged the estimated input tokens to the token rate limiter. The charge is reconciled
+        # with the actual usage once the stream is exhausted, or from the chunks received so far if it is closed early.
+        token_limiter = _get_token_limiter(model, kwargs.get("api_key", None))
+        estimated_tokens = 0
+        if token_limiter is not None and estimate_input_tokens is not None:
+            estimated_tokens = estimate_input_tokens(model, func_args_and_kwargs)
+        tokens_reconciled = False
+        
+        def on_complete(chunks):
+            nonlocal tokens_reconciled
+            response = build_response(chunks, func_args_and_kwargs)
+            call_info = None
+            if retrieve_log_data is not None:
+                cache_args = {
+                    "cache_path": cache_path,
+                    "cache_key_prefix": cache_key_prefix,
+                    "include_model_in_cache_key": include_model_in_cache_key,
+                }
+                log_data = retrieve_log_data(model, func_args_and_kwargs, response, cache_args)
+                if token_limiter is not None:
+                    token_limiter.reconcile(estimated_tokens, _get_used_tokens(log_data))
+                    tokens_reconciled = True
+                call_info = _log_call(cache_key, cache_path, model=model, **log_data)
+                _add_log_to_tracker(CallLog(**call_info), False)
+            if cache_enabled:
+                _set_cache_record(cache_key, chunks, call_info, cache_path)
+            return response, call_info
+        
+        def on_close(chunks):
+            if token_limiter is None or tokens_reconciled: return
+            used_tokens = _get_partial_stream_tokens(model, func_args_and_kwargs, chunks, build_response, retrieve_log_data)
+            if used_tokens is not None:
+                token_limiter.reconcile(estimated_tokens, used_tokens)
+        
+        return LLMStream(stream, cache_key, cache_hit=False, on_complete=on_complete, on_close=on_close)
+    
+    llm_func.__name__ = func_name
+    llm_func.__module__ = module_name
+    llm_func.__qualname__ = func_name
+    return llm_func
+
+# %% ../../../pts/api/llm/04_internal_utils.pct.py #4e8778a0
+def _llm_async_stream_func_factory(
+    func: Callable,
+    func_name: str,
+    func_cache_name: str,
+    module_name: str,
+    cache_key_content_args: list[str],
+    build_response: Callable,
+    retrieve_log_data: Optional[Callable] = None,
+    estimate_input_tokens: Optional[Callable] = None,
+):
+    @functools.wraps(func)
+    async def _open_stream(*args, **kwargs):
+        return await func(*args, stream=True, **kwargs)
+    
+    open_stream = _llm_async_func_factory(
+        func=_open_stream,
+        func_name=func_name,
+        func_cache_name=func_cache_name,
+        module_name=module_name,
+        cache_key_content_args=cache_key_content_args,
+        default_return_info=False,
+        estimate_input_tokens=estimate_input_tokens,
+        limit_concurrency=False,
+    )
+    
+    func_sig = inspect.signature(func)
+    async def llm_func(
+        *args,
+        # Cache settings
+        cache_enabled: bool=True,
+        cache_path: Optional[Union[str, Path]]=None,
+        cache_key_prefix: Optional[str]=None,
+        include_model_in_cache_key: bool=True,
+        cache_key_params: Optional[list[str]]=None,
+        return_cache_key: bool=False,
+        # Retry settings
+        enable_retries: bool=True,
+        retry_on_exceptions: Optional[list[Exception]]=None,
+        retry_on_all_exceptions: bool=False,
+        retry_policy: Optional[RetryPolicy]=None,
+        max_retries: Optional[int]=None,
+        retry_delay: Optional[float]=None,
+        timeout: Optional[int]=None,
+        **kwargs,
+    ):
+        cache_key = await open_stream(
+            *args, cache_key_prefix=cache_key_prefix, include_model_in_cache_key=include_model_in_cache_key, cache_key_params=cache_key_params,
+            return_cache_key=True, **kwargs,
+        )
+        if return_cache_key: return cache_key
+        
+        if cache_path is None:
+            cache_path = get_default_cache_path()
+        func_args_and_kwargs = _bind_func_args(func_sig, args, kwargs)
+        model = func_args_and_kwargs['model']
+        
+        # Cached streams are replayed
+        record = await _async_get_cache_record(cache_key, cache_path) if cache_enabled else ENOVAL
+        if record is not ENOVAL:
+            chunks, call_info = record
+            if call_info is not None:
+                _add_log_to_tracker(CallLog(**call_info), True)
+            return AsyncLLMStream(chunks, cache_key, cache_hit=True, response=build_response(chunks, func_args_and_kwargs), call_log=call_info)
+        
+        # The concurrency slot is held until the stream is exhausted or closed, rather than only while it is opened
+        concurrency_limiter = _get_concurrency_limiter(model, kwargs.get("api_key", None))
+        await concurrency_limiter.__aenter__()
+        try:
+            stream = await open_stream(
+                *args,
+                cache_enabled=False,
+                enable_retries=enable_retries,
+                retry_on_exceptions=retry_on_exceptions,
+                retry_on_all_exceptions=retry_on_all_exceptions,
+                retry_policy=retry_policy,
+                max_retries=max_retries,
+                retry_delay=retry_delay,
+                timeout=timeout, # Only applies to opening the stream
+                **kwargs,
+            )
+        except BaseException:
+            await concurrency_limiter.__aexit__(None, None, None)
+            raise
+        
+        # Opening the stream charged the estimated input tokens to the token rate limiter. The charge is reconciled
+        # with the actual usage once the stream is exhausted, or from the chunks received so far if it is closed early.
+        token_limiter = _get_token_limiter(model, kwargs.get("api_key", None))
+        estimated_tokens = 0
+        if token_limiter is not None and estimate_input_tokens is not None:
+            estimated_tokens = estimate_input_tokens(model, func_args_and_kwargs)
+        tokens_reconciled = False
+        
+        async def on_close(chunks):
+            await concurrency_limiter.__aexit__(None, None, None)
+            if token_limiter is None or tokens_reconciled: return
+            used_tokens = _get_partial_stream_tokens(model, func_args_and_kwargs, chunks, build_response, retrieve_log_data)
+            if used_tokens is not None:
+                token_limiter.reconcile(estimated_tokens, used_tokens)
+        
+        async def on_complete(chunks):
+            nonlocal tokens_reconciled
+            response = build_response(chunks, func_args_and_kwargs)
+            call_info = None
+            if retrieve_log_data is not None:
+                cache_args = {
+                    "cache_path": cache_path,
+                    "cache_key_prefix": cache_key_prefix,
+                    "include_model_in_cache_key": include_model_in_cache_key,
+                }
+                log_data = retrieve_log_data(model, func_args_and_kwargs, response, cache_args)
+                if token_limiter is not None:
+                    token_limiter.reconcile(estimated_tokens, _get_used_tokens(log_data))
+                    tokens_reconciled = True
+                call_info = await _async_log_call(cache_key, cache_path, model=model, **log_data)
+                _add_log_to_tracker(CallLog(**call_info), False)
+            if cache_enabled:
+                await _async_set_cache_record(cache_key, chunks, call_info, cache_path)
+            return response, call_info
+        
+        return AsyncLLMStream(stream, cache_key, cache_hit=False, on_complete=on_complete, on_close=on_close)
+    
+    llm_func.__name__ = func_name
+    llm_func.__module__ = module_name
+    llm_func.__qualname__ = func_name
+    return llm_func
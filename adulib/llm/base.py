@@ -0,0 +1,28 @@
+# AUTOGENERATED! DO NOT EDIT! File to edit: ../../../pts/api/llm/00_base.pct.py.
+
+# %% auto #0
+__all__ = ['available_models', 'search_models']
+
+# %% ../../../pts/api/llm/00_base.pct.py #f0bc2be1
+import functools
+from ..reflection import cached_mod_property
+
+# %% ../../../pts/api/llm/00_base.pct.py #7175e8a6
+@functools.cache
+def _get_available_models() -> list[str]:
+    try:
+        import litellm
+    except ImportError as e:
+        raise ImportError(f"Install adulib[llm] to use this API.") from e
+    models = list(litellm.model_cost.keys())
+    models.remove("sample_spec")
+    return models
+
+# %% ../../../pts/api/llm/00_base.pct.py #e37a4d07
+@cached_mod_property
+def available_models():
+    return _get_available_models()
+
+# %% ../../../pts/api/llm/00_base.pct.py #e2a9a5b6
+def search_models(query: str):
+    return [model for model in _get_available_models() if query.lower() in model.lower()]
@@ -0,0 +1,457 @@
+# AUTOGENERATED! DO NOT EDIT! File to edit: ../../../pts/api/llm/03_caching.pct.py.
+
+# %% auto #0
+__all__ = ['default_cache_key_format', 'default_legacy_cache_key_lookup', 'default_cache_key_exclude_params',
+           'default_cache_key_params', 'default_embedding_cache_dtype', 'default_cache_io_max_workers',
+           'set_cache_key_format', 'get_cache_key', 'set_default_cache_key_exclude_params',
+           'set_default_cache_key_params', 'set_embedding_cache_dtype', 'migrate_cache_records', 'rekey_cache_records',
+           'set_cache_io_max_workers']
+
+# %% ../../../pts/api/llm/03_caching.pct.py #ab61fe27
+try:
+    from pathlib import Path
+    from typing import Dict, Literal, Optional, Union, Callable, Coroutine
+    from adulib.caching import get_cache, clear_cache_key, is_in_cache, get_default_cache
+    from diskcache import ENOVAL
+    from litellm import EmbeddingResponse
+    from concurrent.futures import ThreadPoolExecutor
+    import functools
+    import asyncio
+    import ast
+    import hashlib
+    import itertools
+    import json
+    import re
+    import threading
+    import warnings
+    import weakref
+    import numpy as np
+except ImportError as e:
+    raise ImportError(f"Install adulib[llm] to use this API.") from e
+
+# %% ../../../pts/api/llm/03_caching.pct.py #844aa945
+# matches: <package.module.ClassName at 0xABC123>, and also ... object at ...
+GENERIC_CLASS_AT_ADDR_RE = re.compile(r'<.* at 0x[0-9A-Fa-f]+>')
+def _is_obj_str(s: str) -> bool:
+    return GENERIC_CLASS_AT_ADDR_RE.search(s) is not None
+
+# %% ../../../pts/api/llm/03_caching.pct.py #fce2dee0
+default_cache_key_format: Literal['hashed', 'readable'] = 'hashed'
+default_legacy_cache_key_lookup = True
+
+# %% ../../../pts/api/llm/03_caching.pct.py #965969f4
+def set_cache_key_format(key_format: Literal['hashed', 'readable'], legacy_lookup: bool = True):
+    """
+    Set the format of the cache keys of LLM calls. If `legacy_lookup` is True and the format is `'hashed'`,
+    cache misses fall back to looking up the `'readable'` key in caches that contain readable keys (i.e. that have
+    not been converted with `rekey_cache_records`).
+    """
+    global default_cache_key_format, default_legacy_cache_key_lookup
+    if key_format not in ('hashed', 'readable'):
+        raise ValueError(f"Invalid cache key format '{key_format}'. Must be 'hashed' or 'readable'.")
+    default_cache_key_format = key_format
+    default_legacy_cache_key_lookup = legacy_lookup
+
+# %% ../../../pts/api/llm/03_caching.pct.py #965bf42a
+def _canonical_json_default(obj):
+    if isinstance(obj, type) and hasattr(obj, 'model_json_schema'): # Pydantic models, e.g. as `response_format`
+        return {'pydantic_schema': obj.model_json_schema()}
+    if hasattr(obj, 'model_dump'): # Pydantic model instances
+        return obj.model_dump(mode='json')
+    obj_repr = repr(obj)
+    if _is_obj_str(obj_repr):
+        raise ValueError(f"Cache key contains object string: {obj_repr}")
+    return obj_repr
+
+def _dict_item_sort_key(item) -> tuple:
+    key = item[0]
+    return (type(key).__name__, key if isinstance(key, str) else repr(key))
+
+def _update_content_hash(h, obj):
+    """
+    Feeds a canonical serialization of `obj` to the hash `h`. Every value is tagged with its type, so that e.g. tuples
+    and lists, or `1` and `'1'` as dict keys, are kept apart. Strings are fed as is (prefixed with their length) rather
+    than escaped as in JSON, so that the cost of hashing a long prompt is dominated by the hash function itself.
+    """
+    if isinstance(obj, str):
+        data = obj.encode('utf-8', 'surrogatepass')
+        h.update(b's%d:' % len(data))
+        h.update(data)
+    elif obj is None or isinstance(obj, (bool, int, float)):
+        h.update(f"{type(obj).__name__}:{obj!r};".encode())
+    elif isinstance(obj, dict):
+        h.update(b'{')
+        for key, value in sorted(obj.items(), key=_dict_item_sort_key):
+            _update_content_hash(h, key)
+            _update_content_hash(h, value)
+        h.update(b'}')
+    elif isinstance(obj, (list, tuple)):
+        h.update(b'[' if isinstance(obj, list) else b'(')
+        for value in obj:
+            _update_content_hash(h, value)
+        h.update(b']' if isinstance(obj, list) else b')')
+    elif isinstance(obj, (set, frozenset)):
+        h.update(b'<')
+        for value in sorted(obj, key=lambda v: (type(v).__name__, repr(v))):
+            _update_content_hash(h, value)
+        h.update(b'>')
+    else: # e.g. pydantic models, which are hashed by their schema or contents
+        h.update(b'o')
+        _update_content_hash(h, _canonical_json_default(obj))
+
+def _hash_content(content) -> str:
+    "Hashes a canonical serialization of `content`, which does not depend on the order of dict entries."
+    h = hashlib.blake2b(digest_size=16)
+    _update_content_hash(h, content)
+    return 'blake2b:' + h.hexdigest()
+
+# %% ../../../pts/api/llm/03_caching.pct.py #1fcfcde1
+def get_cache_key(
+    model: str, func_name, content: any, key_prefix: Union[str, None]=None, include_model_in_cache_key: bool=True,
+    key_format: Optional[Literal['hashed', 'readable']]=None,
+) -> tuple:
+    """
+    Returns the cache key of an LLM call. `key_format` defaults to `default_cache_key_format` (see `set_cache_key_format`).
+    """
+    if key_format is None: key_format = default_cache_key_format
+    cache_key_tuple = ('adulib.llm', func_name, key_prefix, model if include_model_in_cache_key else '')
+    if key_format == 'hashed':
+        cache_key_tuple = tuple(
+            str(item) if isinstance(item, (str, int, float, bool)) else repr(item) for item in cache_key_tuple
+        ) + (_hash_content(content),)
+    elif key_format == 'readable':
+        cache_key_tuple = tuple(
+            str(item) if isinstance(item, (str, int, float, bool)) else repr(item) for item in cache_key_tuple + (content,)
+        )
+        if any(_is_obj_str(item) for item in cache_key_tuple):
+            raise ValueError(f"Cache key contains object string: {cache_key_tuple}")
+    else:
+        raise ValueError(f"Invalid cache key format '{key_format}'. Must be 'hashed' or 'readable'.")
+    return cache_key_tuple
+
+# %% ../../../pts/api/llm/03_caching.pct.py #65dc4902
+def _get_legacy_cache_key_func(
+    model: str, func_name, content: any, key_prefix: Union[str, None]=None, include_model_in_cache_key: bool=True,
+) -> Optional[Callable[[], tuple]]:
+    "Returns a function that builds the readable cache key to fall back on, or `None` if there is no fallback."
+    if default_cache_key_format != 'hashed' or not default_legacy_cache_key_lookup: return None
+    return lambda: get_cache_key(model, func_name, content, key_prefix, include_model_in_cache_key, key_format='readable')
+
+# %% ../../../pts/api/llm/03_caching.pct.py #fcbf0a36
+default_cache_key_exclude_params: list[str] = [
+    'temperature', 'top_p', 'timeout', 'num_retries', 'api_key', 'api_base', 'base_url', 'api_version', 'extra_headers', 'metadata',
+]
+default_cache_key_params: list[str] = []
+
+# %% ../../../pts/api/llm/03_caching.pct.py #72d28d2e
+def set_default_cache_key_exclude_params(params: list[str]):
+    """
+    Set the parameters of LLM calls that are left out of their cache keys (see `default_cache_key_exclude_params`).
+    """
+    global default_cache_key_exclude_params
+    default_cache_key_exclude_params = list(params)
+
+# %% ../../../pts/api/llm/03_caching.pct.py #ce60e975
+def set_default_cache_key_params(params: list[str]):
+    """
+    Set the parameters of LLM calls (e.g. `['temperature']`) that are included in their cache keys, even though
+    they are in `default_cache_key_exclude_params`.
+    """
+    global default_cache_key_params
+    default_cache_key_params = list(params)
+
+# %% ../../../pts/api/llm/03_caching.pct.py #3f6a4e1a
+_cache_key_content_args: Dict[str, list[str]] = {}
+
+def _register_cache_key_content_args(func_cache_name: str, cache_key_content_args: list[str]):
+    "Records the content args of the LLM function `func_cache_name`, so that `rekey_cache_records` can derive its cache keys."
+    _cache_key_content_args[func_cache_name] = list(cache_key_content_args)
+
+def _get_cache_key_content(func_args_and_kwargs: dict, cache_key_content_args: list[str], cache_key_params: Optional[list[str]]=None) -> dict:
+    "The content args come first, followed by the other arguments sorted by name, so that readable keys are stable."
+    if cache_key_params is None: cache_key_params = default_cache_key_params
+    excluded = set(default_cache_key_exclude_params).difference(cache_key_params)
+    content = {k: func_args_and_kwargs[k] for k in cache_key_content_args if k in func_args_and_kwargs}
+    for k in sorted(func_args_and_kwargs):
+        if k not in content and k != 'model' and k not in excluded:
+            content[k] = func_args_and_kwargs[k]
+    return content
+
+# %% ../../../pts/api/llm/03_caching.pct.py #cb59bb82
+_CACHE_RECORD_VERSION = 2
+_CACHE_RECORD_MARKER = 'adulib.llm.cache_record'
+
+def _make_cache_record(result, call_log: Union[dict, None]) -> dict:
+    record = {_CACHE_RECORD_MARKER: _CACHE_RECORD_VERSION, 'result': result, 'call_log': call_log}
+    packed_embeddings = _pack_embeddings(result)
+    if packed_embeddings is not None:
+        record['result'], record['packed_embeddings'] = packed_embeddings
+    return record
+
+def _is_cache_record(value) -> bool:
+    return type(value) == dict and _CACHE_RECORD_MARKER in value
+
+def _read_cache_record(record: dict) -> tuple:
+    "Returns the tuple `(result, call_log)` of a cache record."
+    result = record['result']
+    if record.get('packed_embeddings') is not None:
+        result = _unpack_embeddings(result, record['packed_embeddings'])
+    return result, record['call_log']
+
+# %% ../../../pts/api/llm/03_caching.pct.py #ecbf5bb1
+default_embedding_cache_dtype: Optional[Literal['float32', 'float16']] = 'float32'
+
+# %% ../../../pts/api/llm/03_caching.pct.py #4df5f5a1
+def set_embedding_cache_dtype(dtype: Optional[Literal['float32', 'float16']]):
+    """
+    Set the dtype in which embeddings are stored in the cache. Pass `None` to store them as lists of Python floats.
+    """
+    global default_embedding_cache_dtype
+    if dtype is not None and dtype not in _EMBEDDING_DTYPES:
+        raise ValueError(f"Invalid dtype '{dtype}'. Must be one of {list(_EMBEDDING_DTYPES)} or None.")
+    default_embedding_cache_dtype = dtype
+
+# %% ../../../pts/api/llm/03_caching.pct.py #5677c1ef
+_EMBEDDING_DTYPES = {'float32': np.dtype('<f4'), 'float16': np.dtype('<f2')}
+
+def _replace_embedding(item, embedding):
+    return {**item, 'embedding': embedding} if type(item) == dict else item.model_copy(update={'embedding': embedding})
+
+def _pack_embeddings(result):
+    """
+    Returns the tuple `(result, packed_embeddings)`, where the embeddings of `result` have been moved to `packed_embeddings`,
+    or `None` if `result` is not an `EmbeddingResponse` with list embeddings.
+    """
+    dtype = default_embedding_cache_dtype
+    if dtype is None or not isinstance(result, EmbeddingResponse) or not result.data: return None
+    embeddings = [item['embedding'] for item in result.data]
+    if any(type(embedding) != list for embedding in embeddings): return None # e.g. base64-encoded embeddings
+    dims = [len(embedding) for embedding in embeddings]
+    data = np.fromiter(itertools.chain.from_iterable(embeddings), dtype=_EMBEDDING_DTYPES[dtype], count=sum(dims)).tobytes()
+    packed_result = result.model_copy(update={'data': [_replace_embedding(item, None) for item in result.data]})
+    return packed_result, {'dtype': dtype, 'dims': dims, 'data': data}
+
+def _unpack_embeddings(result, packed_embeddings: dict):
+    dims = packed_embeddings['dims']
+    values = np.frombuffer(packed_embeddings['data'], dtype=_EMBEDDING_DTYPES[packed_embeddings['dtype']]).tolist()
+    offsets = list(itertools.accumulate(dims, initial=0))
+    data = [_replace_embedding(item, values[start:end]) for item, start, end in zip(result.data, offsets, offsets[1:])]
+    return result.model_copy(update={'data': data})
+
+# %% ../../../pts/api/llm/03_caching.pct.py #61f9e328
+def _get_llm_cache(cache_path: Union[str, Path, None]=None):
+    return get_cache(cache_path) if cache_path is not None else get_default_cache()
+
+# %% ../../../pts/api/llm/03_caching.pct.py #2240cac5
+_readable_keys_in_cache: Dict[str, bool] = {} # Whether a cache (by directory) contains readable keys
+
+def _is_readable_key(key) -> bool:
+    return type(key) == tuple and len(key) == 5 and key[0] == 'adulib.llm' and not str(key[4]).startswith('blake2b:')
+
+def _has_readable_keys(cache) -> bool:
+    "Whether `cache` contains records under readable keys. The keys are scanned once per cache and process."
+    has_readable_keys = _readable_keys_in_cache.get(cache.directory)
+    if has_readable_keys is None:
+        has_readable_keys = any(_is_readable_key(key) for key in cache.iterkeys())
+        _readable_keys_in_cache[cache.directory] = has_readable_keys
+        if has_readable_keys:
+            warnings.warn(
+                f"The LLM cache at '{cache.directory}' contains records under readable cache keys, which are looked up "
+                "on every cache miss. Convert them once using `adulib.llm.rekey_cache_records`."
+            )
+    return has_readable_keys
+
+# %% ../../../pts/api/llm/03_caching.pct.py #22fdea08
+def _migrate_legacy_cache_entry(cache, cache_key: tuple, value) -> dict:
+    "Converts a legacy cache entry (the raw result, with the call log stored under a separate key) to a cache record."
+    call_log_key = ('call_log', cache_key)
+    record = _make_cache_record(value, cache.get(call_log_key, None, retry=True))
+    cache.set(cache_key, record, retry=True)
+    cache.delete(call_log_key, retry=True)
+    return record
+
+# %% ../../../pts/api/llm/03_caching.pct.py #561da217
+def _get_cache_record(cache_key: tuple, cache_path: Union[str, Path, None]=None, legacy_cache_key_func: Optional[Callable[[], tuple]]=None):
+    """
+    Returns the tuple `(result, call_log)` stored under `cache_key`, or `ENOVAL` if the key is not in the cache.
+
+    If the key is not in the cache and `legacy_cache_key_func` is given, the key it returns is looked up instead, and
+    a record found under it is moved to `cache_key`.
+    """
+    cache = _get_llm_cache(cache_path)
+    value = cache.get(cache_key, default=ENOVAL, retry=True)
+    if value is ENOVAL:
+        if legacy_cache_key_func is None or not _has_readable_keys(cache): return ENOVAL
+        legacy_cache_key = legacy_cache_key_func()
+        if legacy_cache_key == cache_key: return ENOVAL
+        value = cache.get(legacy_cache_key, default=ENOVAL, retry=True)
+        if value is ENOVAL: return ENOVAL
+        record = value if _is_cache_record(value) else _migrate_legacy_cache_entry(cache, legacy_cache_key, value)
+        if record['call_log'] is not None:
+            record['call_log'] = {**record['call_log'], 'call_cache_key': cache_key}
+        cache.set(cache_key, record, retry=True)
+        cache.delete(legacy_cache_key, retry=True)
+        return _read_cache_record(record)
+    record = value if _is_cache_record(value) else _migrate_legacy_cache_entry(cache, cache_key, value)
+    return _read_cache_record(record)
+
+# %% ../../../pts/api/llm/03_caching.pct.py #500faee6
+def _set_cache_record(cache_key: tuple, result, call_log: Union[dict, None], cache_path: Union[str, Path, None]=None):
+    cache = _get_llm_cache(cache_path)
+    cache.set(cache_key, _make_cache_record(result, call_log), retry=True)
+
+# %% ../../../pts/api/llm/03_caching.pct.py #4e231079
+def migrate_cache_records(cache_path: Union[str, Path, None]=None) -> int:
+    """
+    Migrates all legacy `adulib.llm` cache entries in a cache to the current record format.
+    Returns the number of migrated entries.
+    """
+    cache = _get_llm_cache(cache_path)
+    num_migrated = 0
+    for key in list(cache.iterkeys()):
+        if not (type(key) == tuple and len(key) > 0 and key[0] == 'adulib.llm'): continue
+        value = cache.get(key, default=ENOVAL, retry=True)
+        if value is ENOVAL or _is_cache_record(value): continue
+        _migrate_legacy_cache_entry(cache, key, value)
+        num_migrated += 1
+    return num_migrated
+
+# %% ../../../pts/api/llm/03_caching.pct.py #09daf504
+def rekey_cache_records(
+    cache_path: Union[str, Path, None]=None,
+    cache_key_params: Optional[list[str]]=None,
+    dry_run: bool=False,
+) -> Dict[str, int]:
+    """
+    Moves the LLM cache entries stored under readable cache keys to the keys that the LLM functions currently use.
+    Entries that map to the same key are merged, keeping the entry that is already stored under it. Entries whose
+    content can not be parsed (e.g. that of a call with a pydantic `response_format`), or that belong to an unknown
+    LLM function, are skipped.
+
+    Args:
+        cache_path: The path of the cache. Defaults to the default cache.
+        cache_key_params: The parameters to include in the new keys, see `set_default_cache_key_params`.
+        dry_run: If True, only counts the entries that would be rekeyed.
+
+    Returns:
+        dict: The number of `'rekeyed'`, `'merged'` and `'skipped'` entries.
+    """
+    # Imported here, as the LLM functions register their cache key content args when they are created
+    import adulib.llm.completions, adulib.llm.text_completions, adulib.llm.embeddings
+
+    cache = _get_llm_cache(cache_path)
+    counts = {'rekeyed': 0, 'merged': 0, 'skipped': 0}
+    new_keys = set()
+    for key in list(cache.iterkeys()):
+        if not (type(key) == tuple and len(key) == 5 and key[0] == 'adulib.llm'): continue
+        _, func_name, key_prefix, model, content_repr = key
+        if content_repr.startswith('blake2b:'): continue
+        try:
+            func_args_and_kwargs = ast.literal_eval(content_repr)
+        except (ValueError, SyntaxError):
+            func_args_and_kwargs = None
+        if type(func_args_and_kwargs) != dict or func_name not in _cache_key_content_args:
+            counts['skipped'] += 1
+            continue
+        variadic_kwargs = func_args_and_kwargs.pop('kwargs', {})
+        func_args_and_kwargs = {**func_args_and_kwargs, **variadic_kwargs}
+        content = _get_cache_key_content(func_args_and_kwargs, _cache_key_content_args[func_name], cache_key_params)
+        new_key = get_cache_key(
+            model, func_name, content, None if key_prefix == 'None' else key_prefix, include_model_in_cache_key=model != '',
+        )
+        if new_key == key: continue
+        merge = new_key in new_keys or new_key in cache
+        new_keys.add(new_key)
+        counts['merged' if merge else 'rekeyed'] += 1
+        if dry_run: continue
+        if not merge:
+            value = cache.get(key, default=ENOVAL, retry=True)
+            record = value if _is_cache_record(value) else _migrate_legacy_cache_entry(cache, key, value)
+            if record['call_log'] is not None:
+                record['call_log'] = {**record['call_log'], 'call_cache_key': new_key}
+            cache.set(new_key, record, retry=True)
+        cache.delete(key, retry=True)
+        cache.delete(('call_log', key), retry=True)
+    if not dry_run:
+        _readable_keys_in_cache.pop(cache.directory, None) # Rescanned on the next lookup
+    return counts
+
+# %% ../../../pts/api/llm/03_caching.pct.py #2932f26c
+default_cache_io_max_workers = 8
+
+# %% ../../../pts/api/llm/03_caching.pct.py #c2d4c419
+_cache_io_executor: Union[ThreadPoolExecutor, None] = None
+
+def _get_cache_io_executor() -> ThreadPoolExecutor:
+    global _cache_io_executor
+    if _cache_io_executor is None:
+        _cache_io_executor = ThreadPoolExecutor(max_workers=default_cache_io_max_workers, thread_name_prefix="adulib-cache-io")
+    return _cache_io_executor
+
+# %% ../../../pts/api/llm/03_caching.pct.py #e4db5a76
+def set_cache_io_max_workers(max_workers: int):
+    """
+    Set the maximum number of threads used for cache I/O in the async API.
+    """
+    global default_cache_io_max_workers, _cache_io_executor
+    default_cache_io_max_workers = max_workers
+    if _cache_io_executor is not None:
+        _cache_io_executor.shutdown(wait=False)
+        _cache_io_executor = None
+
+# %% ../../../pts/api/llm/03_caching.pct.py #62b5b21f
+async def _run_cache_io(func: Callable, *args, **kwargs):
+    "Runs a blocking cache operation in the cache I/O thread pool."
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_cache_io_executor(), functools.partial(func, *args, **kwargs))
+
+# %% ../../../pts/api/llm/03_caching.pct.py #9f691b1b
+async def _async_get_cache_record(cache_key: tuple, cache_path: Union[str, Path, None]=None, legacy_cache_key_func: Optional[Callable[[], tuple]]=None):
+    return await _run_cache_io(_get_cache_record, cache_key, cache_path, legacy_cache_key_func)
+
+async def _async_set_cache_record(cache_key: tuple, result, call_log: Union[dict, None], cache_path: Union[str, Path, None]=None):
+    await _run_cache_io(_set_cache_record, cache_key, result, call_log, cache_path)
+
+# %% ../../../pts/api/llm/03_caching.pct.py #26ef85d5
+# The in-flight calls of each event loop. The futures of a loop can only be awaited on that loop, so that calls on
+# different loops (e.g. in the worker threads of `batch_executor(..., backend='thread')`) are not coalesced.
+_in_flight_calls: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[tuple, asyncio.Future]]" = weakref.WeakKeyDictionary()
+_in_flight_calls_lock = threading.Lock()
+
+def _get_in_flight_calls() -> Dict[tuple, asyncio.Future]:
+    "Returns the in-flight calls of the running event loop."
+    loop = asyncio.get_running_loop()
+    with _in_flight_calls_lock:
+        return _in_flight_calls.setdefault(loop, {})
+
+# %% ../../../pts/api/llm/03_caching.pct.py #a0b392ed
+async def _single_flight(key: tuple, execute_func: Callable[[], Coroutine]):
+    """
+    Coalesces concurrent calls with the same `key`, so that only the first caller (the leader) runs `execute_func`,
+    while the others (the followers) await the leader's result. Returns a tuple `(is_follower, result)`.
+
+    If the leader is cancelled, a waiting follower takes over and executes the call itself.
+    """
+    in_flight_calls = _get_in_flight_calls()
+    while key in in_flight_calls:
+        flight = in_flight_calls[key]
+        try:
+            return True, await asyncio.shield(flight)
+        except asyncio.CancelledError:
+            if not flight.cancelled(): raise # The follower itself was cancelled
+    
+    flight = asyncio.get_running_loop().create_future()
+    flight.add_done_callback(lambda f: f.cancelled() or f.exception()) # Avoids 'exception was never retrieved' warnings
+    in_flight_calls[key] = flight
+    try:
+        result = await execute_func()
+        flight.set_result(result)
+        return False, result
+    except asyncio.CancelledError:
+        flight.cancel()
+        raise
+    except BaseException as e:
+        flight.set_exception(e)
+        raise
+    finally:
+        del in_flight_calls[key]
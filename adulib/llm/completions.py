@@ -0,0 +1,230 @@
+"""Otherwise known as *chat completions*. See the [`litellm` documention](https://docs.litellm.ai/docs/completion)."""
+
+# AUTOGENERATED! DO NOT EDIT! File to edit: ../../../pts/api/llm/06_completions.pct.py.
+
+# %% auto #0
+__all__ = ['completion', 'sig', 'async_completion', 'stream_completion', 'async_stream_completion', 'single', 'async_single']
+
+# %% ../../../pts/api/llm/06_completions.pct.py #d4bf1bc2
+try:
+    import litellm
+    import inspect
+    from inspect import Parameter
+    import functools
+    from typing import List, Dict
+    from adulib.llm._utils import _llm_func_factory, _llm_async_func_factory, _llm_stream_func_factory, _llm_async_stream_func_factory
+    from adulib.llm.tokens import count_message_tokens
+except ImportError as e:
+    raise ImportError(f"Install adulib[llm] to use this API.") from e
+
+# %% ../../../pts/api/llm/06_completions.pct.py #bd3b24db
+completion = _llm_func_factory(
+    func=litellm.completion,
+    func_name="completion",
+    func_cache_name="completion",
+    module_name=__name__,
+    cache_key_content_args=['messages', 'response_format'],
+    retrieve_log_data=lambda model, func_kwargs, response, cache_args: {
+        "method": "completion",
+        "input_tokens": count_message_tokens(model, func_kwargs['messages']),
+        "output_tokens": sum([count_message_tokens(model, [{'role': c.message.role, 'content': c.message.content}]) for c in response.choices]),
+        "cost": response._hidden_params['response_cost'],
+    },
+    estimate_input_tokens=lambda model, func_kwargs: count_message_tokens(model, func_kwargs['messages']),
+)
+
+completion.__doc__ = """
+This function is a wrapper around a corresponding function in the `litellm` library, see [this](https://docs.litellm.ai/docs/completion/input) for a full list of the available arguments.
+""".strip()
+
+sig = inspect.signature(completion)
+sig = sig.replace(parameters=[
+    Parameter("model", Parameter.POSITIONAL_OR_KEYWORD, annotation=str),
+    Parameter("messages", Parameter.POSITIONAL_OR_KEYWORD, annotation=List[Dict[str, str]]),
+    *sig.parameters.values()
+])
+completion.__signature__ = sig
+
+# %% ../../../pts/api/llm/06_completions.pct.py #cda30fbd
+async_completion = _llm_async_func_factory(
+    func=litellm.acompletion,
+    func_name="async_completion",
+    func_cache_name="completion",
+    module_name=__name__,
+    cache_key_content_args=['messages', 'response_format'],
+    retrieve_log_data=lambda model, func_kwargs, response, cache_args: {
+        "method": "completion",
+        "input_tokens": count_message_tokens(model, func_kwargs['messages']),
+        "output_tokens": sum([count_message_tokens(model, [{'role': c.message.role, 'content': c.message.content}]) for c in response.choices]),
+        "cost": response._hidden_params['response_cost'],
+    },
+    estimate_input_tokens=lambda model, func_kwargs: count_message_tokens(model, func_kwargs['messages']),
+)
+
+completion.__doc__ = """
+This function is a wrapper around a corresponding function in the `litellm` library, see [this](https://docs.litellm.ai/docs/completion/input) for a full list of the available arguments.
+""".strip()
+
+sig = inspect.signature(async_completion)
+sig = sig.replace(parameters=[
+    Parameter("model", Parameter.POSITIONAL_OR_KEYWORD, annotation=str),
+    Parameter("messages", Parameter.POSITIONAL_OR_KEYWORD, annotation=List[Dict[str, str]]),
+    *sig.parameters.values()
+])
+async_completion.__signature__ = sig
+
+# %% ../../../pts/api/llm/06_completions.pct.py #8e4a30b1
+def _build_completion_response(chunks, func_kwargs):
+    return litellm.stream_chunk_builder(chunks, messages=func_kwargs['messages'])
+
+def _get_completion_cost(response) -> float:
+    try:
+        return litellm.completion_cost(completion_response=response)
+    except Exception: # The cost is unknown for some models
+        return 0.0
+
+def _retrieve_stream_completion_log_data(model, func_kwargs, response, cache_args):
+    return {
+        "method": "stream_completion",
+        "input_tokens": count_message_tokens(model, func_kwargs['messages']),
+        "output_tokens": sum([count_message_tokens(model, [{'role': c.message.role, 'content': c.message.content}]) for c in response.choices]),
+        "cost": _get_completion_cost(response),
+    }
+
+# %% ../../../pts/api/llm/06_completions.pct.py #0c17afc2
+stream_completion = _llm_stream_func_factory(
+    func=litellm.completion,
+    func_name="stream_completion",
+    func_cache_name="stream_completion",
+    module_name=__name__,
+    cache_key_content_args=['messages', 'response_format'],
+    build_response=_build_completion_response,
+    retrieve_log_data=_retrieve_stream_completion_log_data,
+    estimate_input_tokens=lambda model, func_kwargs: count_message_tokens(model, func_kwargs['messages']),
+)
+
+stream_completion.__doc__ = """
+Streaming version of `completion`, which returns an `LLMStream` of response chunks. This function is a wrapper around a corresponding function in the `litellm` library, see [this](https://docs.litellm.ai/docs/completion/stream) for details.
+""".strip()
+
+sig = inspect.signature(stream_completion)
+sig = sig.replace(parameters=[
+    Parameter("model", Parameter.POSITIONAL_OR_KEYWORD, annotation=str),
+    Parameter("messages", Parameter.POSITIONAL_OR_KEYWORD, annotation=List[Dict[str, str]]),
+    *sig.parameters.values()
+])
+stream_completion.__signature__ = sig
+
+# %% ../../../pts/api/llm/06_completions.pct.py #6b14faf2
+async_stream_completion = _llm_async_stream_func_factory(
+    func=litellm.acompletion,
+    func_name="async_stream_completion",
+    func_cache_name="stream_completion",
+    module_name=__name__,
+    cache_key_content_args=['messages', 'response_format'],
+    build_response=_build_completion_response,
+    retrieve_log_data=_retrieve_stream_completion_log_data,
+    estimate_input_tokens=lambda model, func_kwargs: count_message_tokens(model, func_kwargs['messages']),
+)
+
+async_stream_completion.__doc__ = """
+Streaming version of `async_completion`, which returns an `AsyncLLMStream` of response chunks. This function is a wrapper around a corresponding function in the `litellm` library, see [this](https://docs.litellm.ai/docs/completion/stream) for details.
+""".strip()
+
+sig = inspect.signature(async_stream_completion)
+sig = sig.replace(parameters=[
+    Parameter("model", Parameter.POSITIONAL_OR_KEYWORD, annotation=str),
+    Parameter("messages", Parameter.POSITIONAL_OR_KEYWORD, annotation=List[Dict[str, str]]),
+    *sig.parameters.values()
+])
+async_stream_completion.__signature__ = sig
+
+# %% ../../../pts/api/llm/06_completions.pct.py #fb3637e6
+def _get_msgs(orig_msgs, response):
+    if len(response.choices) == 0: return orig_msgs
+    msgs = orig_msgs.copy()
+    # msgs.append(response.choices[0].message.model_dump())
+    msgs.append({ 'role': response.choices[0].message.role, 'content': response.choices[0].message.content })
+    return msgs
+
+# %% ../../../pts/api/llm/06_completions.pct.py #a614006b
+def single(
+    prompt: str,
+    model: str|None = None,
+    system: str|None = None,
+    *args,
+    multi: bool|Dict|None = None,
+    return_full_response: bool=False,
+    return_info: bool=True,
+    **kwargs,
+):
+    if system is None and multi is None: system = "You are a helpful assistant."
+    if system is not None and type(multi) == dict: raise ValueError("Cannot provide `system` if already in multi-turn completion mode.")
+    if multi: model = model or multi['model']
+    
+    if type(multi) == dict:
+        messages = multi['messages'].copy() + [ {"role": "user", "content": prompt} ]
+    else:
+        messages = [
+            {"role": "system", "content": system},
+            {"role": "user", "content": prompt}
+        ]
+    
+    if model is None: raise ValueError("`model` must be provided.")
+    
+    response, cache_hit, call_log = completion(model, messages, *args, **kwargs)
+    
+    res = response.choices[0].message.content if not return_full_response else response
+    if multi is not None:
+        res = res, {'model' : model, 'messages' : _get_msgs(messages, response)}
+    
+    return res, cache_hit, call_log if return_info else res
+    
+single.__name__ = "single"
+single.__doc__ = """
+Simplified chat completions designed for single-turn tasks like classification, summarization, or extraction. For a full list of the available arguments see the [documentation](https://docs.litellm.ai/docs/completion/input) for the `completion` function in `litellm`.
+
+If 'return_info' is set to True, the function returns a tuple of the response, cache hit status, and call log. If set to False, it returns only the response.
+If 'multi' is provided, it should be a dictionary containing the model and messages from previous turns, allowing for multi-turn interactions. The function will append the new prompt to the existing messages.
+""".strip()
+
+# %% ../../../pts/api/llm/06_completions.pct.py #00b442be
+async def async_single(
+    prompt: str,
+    model: str|None = None,
+    system: str|None = None,
+    *args,
+    multi: bool|Dict|None = None,
+    return_full_response: bool=False,
+    return_info: bool=True,
+    **kwargs,
+):
+    if system is None and multi is None: system = "You are a helpful assistant."
+    if system is not None and type(multi) == dict: raise ValueError("Cannot provide `system` if already in multi-turn completion mode.")
+    if multi: model = model or multi['model']
+    
+    if type(multi) == dict:
+        messages = multi['messages'].copy() + [ {"role": "user", "content": prompt} ]
+    else:
+        messages = [
+            {"role": "system", "content": system},
+            {"role": "user", "content": prompt}
+        ]
+    
+    if model is None: raise ValueError("`model` must be provided.")
+    
+    response, cache_hit, call_log = await async_completion(model, messages, *args, **kwargs)
+    
+    res = response.choices[0].message.content if not return_full_response else response
+    if multi is not None:
+        res = res, {'model' : model, 'messages' : _get_msgs(messages, response)}
+    
+    return res, cache_hit, call_log if return_info else res
+    
+async_single.__name__ = "async_single"
+async_single.__doc__ = """
+Simplified chat completions designed for single-turn tasks like classification, summarization, or extraction. For a full list of the available arguments see the [documentation](https://docs.litellm.ai/docs/completion/input) for the `completion` function in `litellm`.
+
+If 'return_info' is set to True, the function returns a tuple of the response, cache hit status, and call log. If set to False, it returns only the response.
+If 'multi' is provided, it should be a dictionary containing the model and messages from previous turns, allowing for multi-turn interactions. The function will append the new prompt to the existing messages.
+""".strip()
@@ -0,0 +1,444 @@
+"""See the [`litellm` documention](https://docs.litellm.ai/docs/embedding/supported_embedding)."""
+
+# AUTOGENERATED! DO NOT EDIT! File to edit: ../../../pts/api/llm/08_embeddings.pct.py.
+
+# %% auto #0
+__all__ = ['embedding', 'sig', 'async_embedding', 'default_embedding_max_concurrency', 'batch_embeddings',
+           'async_iter_batch_embeddings', 'async_batch_embeddings']
+
+# %% ../../../pts/api/llm/08_embeddings.pct.py #11ad489a
+import inspect
+from inspect import Parameter
+import asyncio
+try:
+    import litellm
+    import functools
+    import numpy as np
+    from pathlib import Path
+    from typing import Literal, NamedTuple, Optional, Union
+    from collections import Counter
+    from diskcache import ENOVAL
+    from adulib.caching import get_default_cache_path
+    from adulib.llm._utils import _llm_func_factory, _llm_async_func_factory
+    from adulib.llm.caching import get_cache_key, _get_cache_key_content, _get_llm_cache, _get_cache_record, _run_cache_io
+    from adulib.llm.tokens import count_tokens
+except ImportError as e:
+    raise ImportError(f"Install adulib[llm] to use this API.") from e
+
+# %% ../../../pts/api/llm/08_embeddings.pct.py #c8ad0729
+embedding = _llm_func_factory(
+    func=litellm.embedding,
+    func_name="embedding",
+    func_cache_name="embedding",
+    module_name=__name__,
+    cache_key_content_args=['input'],
+    retrieve_log_data=lambda model, func_kwargs, response, cache_args: {
+        "method": "embedding",
+        "input_tokens": int(count_tokens(model, func_kwargs['input']).sum()),
+        "output_tokens": None,
+        "cost": response._hidden_params['response_cost'],
+    },
+    estimate_input_tokens=lambda model, func_kwargs: int(count_tokens(model, func_kwargs['input']).sum()),
+)
+
+embedding.__doc__ = """
+This function is a wrapper around a corresponding function in the `litellm` library, see [this](https://docs.litellm.ai/docs/embedding/supported_embedding) for a full list of the available arguments.
+""".strip()
+sig = inspect.signature(embedding)
+sig = sig.replace(parameters=[
+    Parameter("model", Parameter.POSITIONAL_OR_KEYWORD, annotation=str),
+    Parameter("input", Parameter.POSITIONAL_OR_KEYWORD, annotation=list[str]),
+    *sig.parameters.values()
+])
+embedding.__signature__ = sig
+
+# %% ../../../pts/api/llm/08_embeddings.pct.py #9798b5d7
+async_embedding = _llm_async_func_factory(
+    func=functools.wraps(litellm.embedding)(litellm.aembedding), # This is needed as 'litellm.aembedding' lacks the right signature
+    func_name="async_embedding",
+    func_cache_name="embedding",
+    module_name=__name__,
+    cache_key_content_args=['input'],
+    retrieve_log_data=lambda model, func_kwargs, response, cache_args: {
+        "method": "embedding",
+        "input_tokens": int(count_tokens(model, func_kwargs['input']).sum()),
+        "output_tokens": None,
+        "cost": response._hidden_params['response_cost'],
+    },
+    estimate_input_tokens=lambda model, func_kwargs: int(count_tokens(model, func_kwargs['input']).sum()),
+)
+
+async_embedding.__doc__ = """
+This function is a wrapper around a corresponding function in the `litellm` library, see [this](https://docs.litellm.ai/docs/embedding/supported_embedding) for a full list of the available arguments.
+""".strip()
+sig = inspect.signature(async_embedding)
+sig = sig.replace(parameters=[
+    Parameter("model", Parameter.POSITIONAL_OR_KEYWORD, annotation=str),
+    Parameter("input", Parameter.POSITIONAL_OR_KEYWORD, annotation=list[str]),
+    *sig.parameters.values()
+])
+async_embedding.__signature__ = sig
+
+# %% ../../../pts/api/llm/08_embeddings.pct.py #f9117c84
+def _get_embedding_vector_key(
+    model: str, text: str, kwargs: dict, cache_key_params: Optional[list[str]], cache_key_prefix: Optional[str], include_model_in_cache_key: bool,
+    overlength: Optional[dict] = None,
+) -> tuple:
+    content = _get_cache_key_content({**kwargs, 'input': text}, ['input'], cache_key_params)
+    if overlength is not None: content['overlength'] = overlength # Over-length inputs are truncated or split
+    key = get_cache_key(model, 'embedding_vector', content, cache_key_prefix, include_model_in_cache_key)
+    # The vectors are stored as is rather than as cache records, so they are kept out of the 'adulib.llm' namespace
+    # that e.g. `migrate_cache_records` operates on
+    return ('adulib.llm.vectors',) + key[1:]
+
+def _get_embedding_vectors(keys: list[tuple], cache_path: Union[str, Path, None]=None) -> list[Optional[np.ndarray]]:
+    cache = _get_llm_cache(cache_path)
+    return [cache.get(key, default=None, retry=True) for key in keys]
+
+def _set_embedding_vectors(keys: list[tuple], vectors: np.ndarray, cache_path: Union[str, Path, None]=None):
+    cache = _get_llm_cache(cache_path)
+    with cache.transact(retry=True): # Write the vectors of a batch in a single transaction
+        for key, vector in zip(keys, vectors):
+            cache.set(key, np.array(vector, dtype=np.float32), retry=True)
+
+def _response_to_array(response, num_inputs: int) -> np.ndarray:
+    data = sorted(response.data, key=lambda d: d['index'])
+    if len(data) != num_inputs:
+        raise ValueError(f"Expected {num_inputs} embeddings in the response, got {len(data)}.")
+    return np.array([d['embedding'] for d in data], dtype=np.float32)
+
+
+
+# %% ../../../pts/api/llm/08_embeddings.pct.py #ef50a7e4
+class _EmbeddingSegment(NamedTuple):
+    "A text to send to the provider: an input, or a chunk of an over-length input."
+    key: tuple # The cache key of the vector of the input
+    text: str
+    num_tokens: int
+
+def _get_token_args(model: str, max_batch_tokens: Optional[int], max_input_tokens: Optional[int], overlength_policy: Optional[str]) -> dict:
+    if overlength_policy not in (None, 'error', 'truncate', 'split'):
+        raise ValueError(f"Invalid overlength_policy '{overlength_policy}'. Must be None, 'error', 'truncate' or 'split'.")
+    if max_input_tokens is None:
+        max_input_tokens = litellm.model_cost.get(model, {}).get('max_input_tokens')
+    if overlength_policy is not None and max_input_tokens is None:
+        raise ValueError(f"The maximum number of input tokens of model '{model}' is unknown. Please set 'max_input_tokens'.")
+    return {'max_batch_tokens': max_batch_tokens, 'max_input_tokens': max_input_tokens, 'overlength_policy': overlength_policy}
+
+def _lookup_embedding_chunk(
+    model: str, texts: list[str], start: int, cache_enabled: bool, cache_path: Union[str, Path], cache_args: dict, token_args: dict, kwargs: dict,
+):
+    """
+    Looks up the embedding vectors of `texts`, the inputs at positions `start`, `start + 1`, ..., in the cache.
+    Returns the tuple `(cached_indices, cached_vectors, missing)`, where `missing` is the list of `(index, key, text, num_tokens)`
+    tuples of the inputs whose vectors are not cached. The tokens are only counted if token-aware batching is used.
+    """
+    max_input_tokens, overlength_policy = token_args['max_input_tokens'], token_args['overlength_policy']
+    if token_args['max_batch_tokens'] is not None or overlength_policy is not None:
+        num_tokens = count_tokens(model, texts).tolist()
+    else:
+        num_tokens = [0] * len(texts)
+    vector_keys = []
+    for text, n in zip(texts, num_tokens):
+        overlength = None
+        if overlength_policy is not None and n > max_input_tokens:
+            if overlength_policy == 'error':
+                raise ValueError(f"An input of {n} tokens exceeds the maximum of {max_input_tokens} input tokens of model '{model}': {text[:100]!r}")
+            overlength = {'policy': overlength_policy, 'max_input_tokens': max_input_tokens}
+        vector_keys.append(_get_embedding_vector_key(
+            model, text, kwargs, cache_args['cache_key_params'], cache_args['cache_key_prefix'], cache_args['include_model_in_cache_key'], overlength,
+        ))
+    vectors = _get_embedding_vectors(vector_keys, cache_path) if cache_enabled else [None] * len(texts)
+    dimensions = kwargs.get('dimensions')
+    cached_indices, cached_vectors, missing = [], [], []
+    for i, (key, text, n, vector) in enumerate(zip(vector_keys, texts, num_tokens, vectors), start=start):
+        if vector is None or (dimensions is not None and len(vector) != dimensions): # Vectors of the wrong size are embedded again
+            missing.append((i, key, text, n))
+        else:
+            cached_indices.append(i)
+            cached_vectors.append(vector)
+    return cached_indices, cached_vectors, missing
+
+def _add_missing_embeddings(missing: dict, missing_items: list[tuple]):
+    "Groups the missing inputs of `_lookup_embedding_chunk` by cache key, as `key -> (text, num_tokens, indices)`."
+    for i, key, text, num_tokens in missing_items:
+        if key not in missing: missing[key] = (text, num_tokens, [])
+        missing[key][2].append(i)
+
+def _get_embedding_segments(model: str, key: tuple, text: str, num_tokens: int, token_args: dict) -> list[_EmbeddingSegment]:
+    max_input_tokens, overlength_policy = token_args['max_input_tokens'], token_args['overlength_policy']
+    if overlength_policy not in ('truncate', 'split') or num_tokens <= max_input_tokens:
+        return [_EmbeddingSegment(key, text, num_tokens)]
+    tokens = litellm.encode(model=model, text=text)
+    if overlength_policy == 'truncate':
+        return [_EmbeddingSegment(key, litellm.decode(model=model, tokens=tokens[:max_input_tokens]), max_input_tokens)]
+    chunks = [tokens[i:i + max_input_tokens] for i in range(0, len(tokens), max_input_tokens)]
+    return [_EmbeddingSegment(key, litellm.decode(model=model, tokens=chunk), len(chunk)) for chunk in chunks]
+
+def _plan_embedding_batches(model: str, missing: dict, batch_size: int, token_args: dict) -> list[list[_EmbeddingSegment]]:
+    "Packs the missing inputs into batches of at most `batch_size` texts and `max_batch_tokens` tokens."
+    max_batch_tokens = token_args['max_batch_tokens']
+    batches, batch, batch_tokens = [], [], 0
+    for key, (text, num_tokens, _) in missing.items():
+        for segment in _get_embedding_segments(model, key, text, num_tokens, token_args):
+            if batch and (len(batch) >= batch_size or (max_batch_tokens is not None and batch_tokens + segment.num_tokens > max_batch_tokens)):
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batch.append(segment)
+            batch_tokens += segment.num_tokens
+    if batch: batches.append(batch)
+    return batches
+
+class _EmbeddingSegmentCombiner:
+    "Combines the vectors of the segments of each input, as they arrive, into the vector of the input."
+    def __init__(self, batches: list[list[_EmbeddingSegment]]):
+        self._num_remaining = Counter(segment.key for batch in batches for segment in batch)
+        self._parts = {}
+
+    def add(self, batch: list[_EmbeddingSegment], vectors: np.ndarray) -> tuple[list[tuple], np.ndarray]:
+        "Adds the vectors of a batch. Returns the keys and vectors of the inputs whose segments are now all embedded."
+        keys, key_vectors = [], []
+        for segment, vector in zip(batch, vectors):
+            self._parts.setdefault(segment.key, []).append((vector, segment.num_tokens))
+            self._num_remaining[segment.key] -= 1
+            if self._num_remaining[segment.key] > 0: continue
+            parts = self._parts.pop(segment.key)
+            if len(parts) > 1:
+                vector = np.average([v for v, _ in parts], axis=0, weights=[max(n, 1) for _, n in parts])
+                vector = (vector / np.linalg.norm(vector)).astype(np.float32)
+            keys.append(segment.key)
+            key_vectors.append(vector)
+        return keys, np.array(key_vectors, dtype=np.float32).reshape(len(keys), vectors.shape[1])
+
+def _check_embedding_dims(dims: set[int]):
+    if len(dims) > 1:
+        raise ValueError(f"The embeddings have different dimensions {sorted(dims)}. Are vectors cached with different arguments under the same keys?")
+
+def _stack_embedding_vectors(vectors: list[np.ndarray]) -> np.ndarray:
+    if len(vectors) == 0: return np.empty((0, 0), dtype=np.float32)
+    _check_embedding_dims({len(vector) for vector in vectors})
+    return np.stack(vectors)
+
+# %% ../../../pts/api/llm/08_embeddings.pct.py #a1a0837f
+def batch_embeddings(
+    model: str,
+    input: list[str] = None,
+    batch_size: int = 1000,
+    verbose: bool = False,
+    cache_enabled: bool = True,
+    cache_path: Optional[Union[str, Path]] = None,
+    cache_key_prefix: Optional[str] = None,
+    include_model_in_cache_key: bool = True,
+    cache_key_params: Optional[list[str]] = None,
+    max_batch_tokens: Optional[int] = None,
+    max_input_tokens: Optional[int] = None,
+    overlength_policy: Optional[Literal['error', 'truncate', 'split']] = None,
+    **kwargs
+):
+    """
+    Compute embeddings for a list of input strings in batches synchronously.
+
+    Args:
+        model (str): The embedding model to use.
+        input (list[str]): List of input strings to embed.
+        batch_size (int): Maximum number of inputs per call to the provider.
+        verbose (bool): If True, display a progress bar.
+        max_batch_tokens (Optional[int]): If given, the maximum total number of tokens of the inputs of a call to the provider.
+        max_input_tokens (Optional[int]): The maximum number of tokens of an input. Defaults to the limit of the model in `litellm.model_cost`.
+        overlength_policy (Optional[str]): What to do with inputs longer than `max_input_tokens`: `'error'`, `'truncate'` or `'split'`.
+            If None, they are sent as they are.
+        cache_enabled, cache_path, cache_key_prefix, include_model_in_cache_key, cache_key_params: The cache settings, as for `embedding`.
+        **kwargs: Additional keyword arguments passed to `embedding`.
+
+    Returns:
+        tuple: The float32 array of embeddings of shape `(len(input), dim)`, and the list of `(response, cache_hit, call_log)`
+            tuples of the calls to `embedding`. Inputs whose embeddings are in the cache are not embedded again.
+    """
+    if cache_path is None: cache_path = get_default_cache_path()
+    cache_args = {'cache_key_prefix': cache_key_prefix, 'include_model_in_cache_key': include_model_in_cache_key, 'cache_key_params': cache_key_params}
+    token_args = _get_token_args(model, max_batch_tokens, max_input_tokens, overlength_policy)
+    
+    vectors = [None] * len(input)
+    cached_indices, cached_vectors, missing_items = _lookup_embedding_chunk(model, input, 0, cache_enabled, cache_path, cache_args, token_args, kwargs)
+    for i, vector in zip(cached_indices, cached_vectors):
+        vectors[i] = vector
+    missing = {}
+    _add_missing_embeddings(missing, missing_items)
+    batches = _plan_embedding_batches(model, missing, batch_size, token_args)
+    combiner = _EmbeddingSegmentCombiner(batches)
+    
+    if verbose:
+        from tqdm import tqdm
+        batches = tqdm(batches, desc="Processing embedding batches")
+    responses = []
+    for batch in batches:
+        response, cache_hit, call_log = embedding(
+            model=model, input=[segment.text for segment in batch], cache_enabled=False, cache_path=cache_path, **cache_args, **kwargs,
+        )
+        responses.append((response, cache_hit, call_log))
+        keys, key_vectors = combiner.add(batch, _response_to_array(response, len(batch)))
+        for key, vector in zip(keys, key_vectors):
+            for i in missing[key][2]:
+                vectors[i] = vector # Inputs that occur more than once get the same vector
+        if cache_enabled and keys:
+            _set_embedding_vectors(keys, key_vectors, cache_path)
+    
+    return _stack_embedding_vectors(vectors), responses
+
+# %% ../../../pts/api/llm/08_embeddings.pct.py #bd0bd4de
+default_embedding_max_concurrency = 8
+
+# %% ../../../pts/api/llm/08_embeddings.pct.py #257fd93e
+async def async_iter_batch_embeddings(
+    model: str,
+    input: list[str] = None,
+    batch_size: int = 1000,
+    max_concurrency: Optional[int] = None,
+    cache_enabled: bool = True,
+    cache_path: Optional[Union[str, Path]] = None,
+    cache_key_prefix: Optional[str] = None,
+    include_model_in_cache_key: bool = True,
+    cache_key_params: Optional[list[str]] = None,
+    max_batch_tokens: Optional[int] = None,
+    max_input_tokens: Optional[int] = None,
+    overlength_policy: Optional[Literal['error', 'truncate', 'split']] = None,
+    **kwargs
+):
+    """
+    Compute embeddings for a list of input strings in batches asynchronously, yielding them as they become available.
+
+    Args:
+        model (str): The embedding model to use.
+        input (list[str]): List of input strings to embed.
+        batch_size (int): Maximum number of inputs per call to the provider.
+        max_concurrency (Optional[int]): Maximum number of concurrent calls to the provider. Defaults to `default_embedding_max_concurrency`.
+        max_batch_tokens, max_input_tokens, overlength_policy: The token limits of the calls, as for `batch_embeddings`.
+        cache_enabled, cache_path, cache_key_prefix, include_model_in_cache_key, cache_key_params: The cache settings, as for `async_embedding`.
+        **kwargs: Additional keyword arguments passed to `async_embedding`.
+
+    Yields:
+        tuple: `(indices, embeddings, response)`, where `indices` is the array of positions in `input` of the float32
+            `embeddings`, and `response` is the `(response, cache_hit, call_log)` tuple of the call to `async_embedding`,
+            or `None` for embeddings retrieved from the cache. The embeddings in the cache are yielded first, and the
+            others in the order in which their calls complete. (With `overlength_policy='split'`, the embedding of an input
+            is yielded with the call of its last chunk, so `indices` may be empty.)
+    """
+    if cache_path is None: cache_path = get_default_cache_path()
+    if max_concurrency is None: max_concurrency = default_embedding_max_concurrency
+    cache_args = {'cache_key_prefix': cache_key_prefix, 'include_model_in_cache_key': include_model_in_cache_key, 'cache_key_params': cache_key_params}
+    token_args = _get_token_args(model, max_batch_tokens, max_input_tokens, overlength_policy)
+    
+    # Look up the cached embeddings in chunks, so that they are not all held in memory at once
+    missing = {}
+    for start in range(0, len(input), batch_size):
+        cached_indices, cached_vectors, missing_items = await _run_cache_io(
+            _lookup_embedding_chunk, model, input[start:start + batch_size], start, cache_enabled, cache_path, cache_args, token_args, kwargs,
+        )
+        _add_missing_embeddings(missing, missing_items)
+        if cached_indices:
+            yield np.array(cached_indices), _stack_embedding_vectors(cached_vectors), None
+    
+    batches = _plan_embedding_batches(model, missing, batch_size, token_args)
+    combiner = _EmbeddingSegmentCombiner(batches)
+    
+    async def embed_batch(batch):
+        response, cache_hit, call_log = await async_embedding(
+            model=model, input=[segment.text for segment in batch], cache_enabled=False, cache_path=cache_path, **cache_args, **kwargs,
+        )
+        keys, key_vectors = combiner.add(batch, _response_to_array(response, len(batch)))
+        if cache_enabled and keys:
+            await _run_cache_io(_set_embedding_vectors, keys, key_vectors, cache_path)
+        # Inputs that occur more than once get the same vector
+        repeats = [len(missing[key][2]) for key in keys]
+        indices = np.array([i for key in keys for i in missing[key][2]], dtype=np.int64)
+        return indices, np.repeat(key_vectors, repeats, axis=0), (response, cache_hit, call_log)
+    
+    # A fixed number of workers take the batches in turn, so that only `max_concurrency` calls exist at any time
+    results = asyncio.Queue(maxsize=max_concurrency)
+    remaining_batches = iter(batches)
+    async def worker():
+        for batch in remaining_batches:
+            try:
+                result = await embed_batch(batch)
+            except Exception as e:
+                await results.put(e)
+                return
+            await results.put(result)
+    
+    workers = [asyncio.create_task(worker()) for _ in range(min(max_concurrency, len(batches)))]
+    try:
+        for _ in range(len(batches)):
+            result = await results.get()
+            if isinstance(result, Exception): raise result
+            yield result
+    finally:
+        for task in workers: task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+# %% ../../../pts/api/llm/08_embeddings.pct.py #e7ab6d98
+async def async_batch_embeddings(
+    model: str,
+    input: list[str] = None,
+    batch_size: int = 1000,
+    verbose: bool = False,
+    max_concurrency: Optional[int] = None,
+    output_path: Optional[Union[str, Path]] = None,
+    return_responses: bool = True,
+    cache_enabled: bool = True,
+    cache_path: Optional[Union[str, Path]] = None,
+    cache_key_prefix: Optional[str] = None,
+    include_model_in_cache_key: bool = True,
+    cache_key_params: Optional[list[str]] = None,
+    max_batch_tokens: Optional[int] = None,
+    max_input_tokens: Optional[int] = None,
+    overlength_policy: Optional[Literal['error', 'truncate', 'split']] = None,
+    **kwargs
+):
+    """
+    Compute embeddings for a list of input strings in batches asynchronously.
+
+    Args:
+        model (str): The embedding model to use.
+        input (list[str]): List of input strings to embed.
+        batch_size (int): Maximum number of inputs per call to the provider.
+        verbose (bool): If True, display a progress bar.
+        max_concurrency (Optional[int]): Maximum number of concurrent calls to the provider. Defaults to `default_embedding_max_concurrency`.
+        output_path (Optional[Union[str, Path]]): If given, the embeddings are written to a memory-mapped `.npy` file at this path,
+            which is returned in place of an in-memory array.
+        return_responses (bool): If False, the responses are not kept, which saves memory for large corpora (the responses hold
+            the embeddings as lists of Python floats).
+        max_batch_tokens, max_input_tokens, overlength_policy: The token limits of the calls, as for `batch_embeddings`.
+        cache_enabled, cache_path, cache_key_prefix, include_model_in_cache_key, cache_key_params: The cache settings, as for `async_embedding`.
+        **kwargs: Additional keyword arguments passed to `async_embedding`.
+
+    Returns:
+        tuple: The float32 array of embeddings of shape `(len(input), dim)`, and the list of `(response, cache_hit, call_log)`
+            tuples of the calls to `async_embedding`. Inputs whose embeddings are in the cache are not embedded again.
+    """
+    embeddings = None
+    responses = []
+    if verbose:
+        from tqdm.asyncio import tqdm
+        progress_bar = tqdm(total=len(input), desc="Processing embeddings")
+    async for indices, vectors, response in async_iter_batch_embeddings(
+        model, input, batch_size, max_concurrency, cache_enabled, cache_path, cache_key_prefix, include_model_in_cache_key, cache_key_params,
+        max_batch_tokens, max_input_tokens, overlength_policy, **kwargs,
+    ):
+        if embeddings is None:
+            shape = (len(input), vectors.shape[1])
+            if output_path is not None:
+                embeddings = np.lib.format.open_memmap(output_path, mode='w+', dtype=np.float32, shape=shape)
+            else:
+                embeddings = np.empty(shape, dtype=np.float32)
+        _check_embedding_dims({embeddings.shape[1], vectors.shape[1]})
+        embeddings[indices] = vectors
+        if response is not None and return_responses: responses.append(response)
+        if verbose: progress_bar.update(len(indices))
+    if verbose: progress_bar.close()
+    
+    if embeddings is None:
+        embeddings = np.empty((0, 0), dtype=np.float32)
+        if output_path is not None: np.save(output_path, embeddings)
+    elif output_path is not None:
+        embeddings.flush()
+    return embeddings, responses
@@ -0,0 +1,587 @@
+# AUTOGENERATED! DO NOT EDIT! File to edit: ../../../pts/api/llm/01_rate_limits.pct.py.
+
+# %% auto #0
+__all__ = ['default_rpm', 'default_retry_on_exception', 'default_max_retries', 'default_retry_delay', 'default_timeout',
+           'default_retry_policy', 'RequestRateLimiter', 'set_default_request_rate_limit', 'set_request_rate_limit',
+           'get_request_rate_limit', 'RateLimitBackend', 'LocalRateLimitBackend', 'DiskRateLimitBackend',
+           'set_default_rate_limit_backend', 'AdaptiveLimiter', 'TokenRateLimiter', 'set_token_rate_limit',
+           'ConcurrencyLimiter', 'set_max_concurrency', 'get_max_concurrency', 'RetryPolicy',
+           'set_default_retry_policy']
+
+# %% ../../../pts/api/llm/01_rate_limits.pct.py #9c84989a
+try:
+    import litellm
+    import abc
+    import asyncio
+    import threading
+    import time
+    import random
+    import dataclasses
+    import hashlib
+    import weakref
+    from pathlib import Path
+    from diskcache import Cache
+    from adulib.caching import get_default_cache_path
+    from email.utils import parsedate_to_datetime
+    from datetime import datetime, timezone
+    from typing import Dict, Literal, Union, Optional
+except ImportError as e:
+    raise ImportError(f"Install adulib[llm] to use this API.") from e
+
+# %% ../../../pts/api/llm/01_rate_limits.pct.py #1ac4e2c7
+default_rpm = 1000 # requests per minute
+default_retry_on_exception = [
+    litellm.RateLimitError,
+    asyncio.TimeoutError
+]
+default_max_retries = 5
+default_retry_delay = 10 # seconds. The default delay of `RetryPolicy.fixed`
+default_timeout = None # seconds
+
+# %% ../../../pts/api/llm/01_rate_limits.pct.py #9e27f379
+def _reserve_slot(next_slot: float, now: float, rate: float, max_burst: int) -> tuple[float, float]:
+    """
+    Reserves the next time slot of a limiter whose next free slot is `next_slot`.
+    Returns the time (in seconds) until the reserved slot starts, and the new next free slot.
+    """
+    slot = max(next_slot, now - (max_burst - 1) / rate)
+    return max(0.0, slot - now), slot + 1 / rate
+
+# %% ../../../pts/api/llm/01_rate_limits.pct.py #dc9ce684
+class RequestRateLimiter:
+    """
+    A thread-safe request rate limiter that can be awaited from async code (`wait`) and blocked on from sync code (`wait_sync`).
+
+    Each call reserves the next free time slot, with slots spaced `1/rate` seconds apart, so that calls are let through
+    in order. After a period of inactivity, up to `max_burst` calls are let through at once.
+
+    Args:
+        rate (float): The rate (calls per second) at which calls are let through.
+        max_burst (int): The maximum number of calls let through at once.
+        backend (RateLimitBackend, optional): A shared store of the time slots (see `RateLimitBackend`). If not set,
+            the time slots are kept in memory, and the budget is local to the process.
+        backend_key (str, optional): The key under which the time slots are stored in the backend.
+    """
+    def __init__(self, rate: float, max_burst: int = 5, backend: Optional['RateLimitBackend'] = None, backend_key: Optional[str] = None):
+        if backend is not None and backend_key is None:
+            raise ValueError("'backend_key' must be provided if 'backend' is set.")
+        self._rate = rate
+        self.max_burst = max_burst
+        self.backend = backend
+        self.backend_key = backend_key
+        self._next_slot = time.monotonic()
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(rate={self._rate})"
+
+    @property
+    def rate(self) -> float:
+        return self._rate
+
+    @rate.setter
+    def rate(self, value: float):
+        with self._lock:
+            self._rate = value
+
+    def _reserve(self) -> float:
+        "Reserves the next time slot, and returns the time (in seconds) until it starts."
+        if self.backend is not None:
+            return self.backend.reserve(self.backend_key, self._rate, self.max_burst)
+        with self._lock:
+            delay, self._next_slot = _reserve_slot(self._next_slot, time.monotonic(), self._rate, self.max_burst)
+            return delay
+
+    async def wait(self):
+        if self.backend is not None:
+            # Backends may block (e.g. on a SQLite transaction), so the reservation is made off the event loop
+            delay = await asyncio.get_running_loop().run_in_executor(None, self._reserve)
+        else:
+            delay = self._reserve()
+        if delay > 0: await asyncio.sleep(delay)
+
+    def wait_sync(self):
+        delay = self._reserve()
+        if delay > 0: time.sleep(delay)
+
+    def breach(self):
+        """
+        Discards all pending reservations, so that the next call is let through immediately. With a backend, this
+        discards the reservations of all processes that share the budget.
+        """
+        if self.backend is not None:
+            self.backend.breach(self.backend_key)
+            return
+        with self._lock:
+            self._next_slot = time.monotonic()
+
+# %% ../../../pts/api/llm/01_rate_limits.pct.py #0a453be0
+_request_rate_limiters: Dict[str, RequestRateLimiter] = {}
+_request_rate_limiters_lock = threading.Lock()
+_default_rate_limit_backend: Optional['RateLimitBackend'] = None
+
+# %% ../../../pts/api/llm/01_rate_limits.pct.py #50deadbd
+def _convert_to_per_minute(rate: float, unit: Literal['per-second', 'per-minute', 'per-hour'] = 'per-minute') -> float:
+    if unit == 'per-second':
+        return rate * 60
+    elif unit == 'per-hour':
+        return rate / 60
+    else:
+        return rate
+
+# %% ../../../pts/api/llm/01_rate_limits.pct.py #711fa71f
+def set_default_request_rate_limit(
+    request_rate: float, request_rate_unit: Literal['per-second', 'per-minute', 'per-hour'] = 'per-minute'
+):
+    global default_rpm
+    default_rpm = _convert_to_per_minute(request_rate, request_rate_unit)
+    return default_rpm
+
+# %% ../../../pts/api/llm/01_rate_limits.pct.py #d3cff884
+def _get_backend_key(key: str) -> str:
+    "Backends are shared with other processes, so API keys are not stored in them in plain text."
+    return hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+
+def _get_limiter(model: str, api_key: Union[str, None]=None) -> RequestRateLimiter:
+    key = f"{model}-{api_key}" if api_key is not None else model
+    with _request_rate_limiters_lock:
+        if key not in _request_rate_limiters:
+            backend = _default_rate_limit_backend
+            _request_rate_limiters[key] = RequestRateLimiter(
+                default_rpm / 60, backend=backend, backend_key=_get_backend_key(key) if backend is not None else None,
+            )
+        return _request_rate_limiters[key]
+
+# %% ../../../pts/api/llm/01_rate_limits.pct.py #2dea7418
+def set_request_rate_limit(
+    model: str, api_key: str|None, request_rate: float, request_rate_unit: Literal['per-second', 'per-minute', 'per-hour'] = 'per-minute',
+    adaptive: bool = False,
+    min_request_rate: Optional[float] = None,
+    max_request_rate: Optional[float] = None,
+    backend: Optional['RateLimitBackend'] = None,
+):
+    """
+    Set the request rate limit for a model and API key.
+
+    If `adaptive` is True, `request_rate` is only the initial rate of an `AdaptiveLimiter`, which increases the rate
+    while calls succeed and backs off when the provider responds with rate limit errors. The rate is then kept
+    within `min_request_rate` and `max_request_rate` (in the same unit as `request_rate`).
+
+    If `backend` is set, the budget is shared with all other processes using the same backend (see `RateLimitBackend`).
+    Defaults to the backend set with `set_default_rate_limit_backend`, if any.
+    """
+    limiter = _get_limiter(model, api_key)
+    if limiter is not None:
+        limiter.breach() # Release any pending requests
+    key = f"{model}-{api_key}" if api_key is not None else model
+    rpm = _convert_to_per_minute(request_rate, request_rate_unit)
+    if backend is None: backend = _default_rate_limit_backend
+    backend_kwargs = dict(backend=backend, backend_key=_get_backend_key(key) if backend is not None else None)
+    if adaptive:
+        new_limiter = AdaptiveLimiter(
+            rpm / 60,
+            min_rate=_convert_to_per_minute(min_request_rate, request_rate_unit) / 60 if min_request_rate is not None else None,
+            max_rate=_convert_to_per_minute(max_request_rate, request_rate_unit) / 60 if max_request_rate is not None else None,
+            **backend_kwargs,
+        )
+    else:
+        new_limiter = RequestRateLimiter(rpm / 60, **backend_kwargs)
+    with _request_rate_limiters_lock:
+        _request_rate_limiters[key] = new_limiter
+
+# %% ../../../pts/api/llm/01_rate_limits.pct.py #0154fa1a
+def get_request_rate_limit(
+    model: str, api_key: str|None = None, request_rate_unit: Literal['per-second', 'per-minute', 'per-hour'] = 'per-minute'
+) -> float:
+    """
+    Get the current (for adaptive limiters, the current effective) request rate limit for a model and API key.
+    """
+    rpm = _get_limiter(model, api_key).rate * 60
+    if request_rate_unit == 'per-second':
+        return rpm / 60
+    elif request_rate_unit == 'per-hour':
+        return rpm * 60
+    else:
+        return rpm
+
+# %% ../../../pts/api/llm/01_rate_limits.pct.py #d23c1651
+class RateLimitBackend(abc.ABC):
+    """
+    Interface of a store of rate limiter time slots that is shared between processes.
+
+    Subclasses implement `reserve`, which must atomically read the next free time slot stored under `key`, reserve it,
+    and store the new next free slot (see `_reserve_slot`), and `breach`. As the slots are compared between processes,
+    they are measured in wall-clock time (`time.time()`).
+    """
+    @abc.abstractmethod
+    def reserve(self, key: str, rate: float, max_burst: int) -> float:
+        "Reserves the next time slot under `key`, and returns the time (in seconds) until it starts."
+
+    @abc.abstractmethod
+    def breach(self, key: str):
+        "Discards all pending reservations under `key`, so that the next call is let through immediately."
+
+# %% ../../../pts/api/llm/01_rate_limits.pct.py #2ceb66b6
+class LocalRateLimitBackend(RateLimitBackend):
+    """
+    An in-memory stand-in of a key-value store such as Redis. Only shared between the limiters of a single process,
+    which makes it useful for testing and as a reference implementation.
+    """
+    def __init__(self):
+        self._next_slots: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def reserve(self, key: str, rate: float, max_burst: int) -> float:
+        with self._lock:
+            delay, self._next_slots[key] = _reserve_slot(self._next_slots.get(key, 0.0), time.time(), rate, max_burst)
+            return delay
+
+    def breach(self, key: str):
+        with self._lock:
+            self._next_slots[key] = time.time()
+
+# %% ../../../pts/api/llm/01_rate_limits.pct.py #f2c4d25b
+class DiskRateLimitBackend(RateLimitBackend):
+    """
+    Stores the time slots in a SQLite database using `diskcache`, so that they are shared by all processes that use
+    the same directory. The reservations are atomic, as they are made within a cache transaction.
+
+    Args:
+        directory (str | Path, optional): The directory of the database. Defaults to the `rate_limits` subdirectory of
+            the default cache path, resolved on first use.
+    """
+    def __init__(self, directory: Optional[Union[str, Path]] = None):
+        self._directory = directory
+        self._cache: Optional[Cache] = None
+        self._cache_lock = threading.Lock()
+
+    @property
+    def directory(self) -> Path:
+        if self._directory is not None: return Path(self._directory)
+        cache_path = get_default_cache_path()
+        if cache_path is None:
+            raise ValueError("The default cache path is not set. Please set it using `set_default_cache_path`, or pass a 'directory'.")
+        return Path(cache_path) / 'rate_limits'
+
+    def _get_cache(self) -> Cache:
+        # Created on first use, so that the default cache path can be set after the backend. The lock ensures that
+        # threads that use the backend concurrently share a single `Cache`.
+        if self._cache is None:
+            with self._cache_lock:
+                if self._cache is None:
+                    self._cache = Cache(self.directory)
+        return self._cache
+
+    def reserve(self, key: str, rate: float, max_burst: int) -> float:
+        cache = self._get_cache()
+        with cache.transact(retry=True):
+            delay, next_slot = _reserve_slot(cache.get(key, 0.0), time.time(), rate, max_burst)
+            cache.set(key, next_slot)
+        return delay
+
+    def breach(self, key: str):
+        self._get_cache().set(key, time.time(), retry=True)
+
+# %% ../../../pts/api/llm/01_rate_limits.pct.py #dc136e9f
+def set_default_rate_limit_backend(backend: Optional[RateLimitBackend]):
+    """
+    Set the backend used by all request rate limiters, so that their budgets are shared between processes.
+    Pass `None` to keep the budgets local to the process. Existing limiters are replaced, keeping their rates.
+    """
+    global _default_rate_limit_backend
+    _default_rate_limit_backend = backend
+    with _request_rate_limiters_lock:
+        for key, limiter in _request_rate_limiters.items():
+            limiter.breach() # Release any pending requests
+            limiter.backend = backend
+            limiter.backend_key = _get_backend_key(key) if backend is not None else None
+
+# %% ../../../pts/api/llm/01_rate_limits.pct.py #3d3b690d
+class AdaptiveLimiter(RequestRateLimiter):
+    """
+    A `RequestRateLimiter` whose rate (in calls per second) adapts to the feedback of the provider using AIMD.
+
+    Args:
+        rate (float): The initial rate.
+        min_rate (float, optional): Lower bound of the rate. Defaults to 1% of the initial rate.
+        max_rate (float, optional): Upper bound of the rate. Defaults to no upper bound.
+        additive_increase (float): Rate increase per `increase_interval`, relative to the initial rate, i.e. while
+            calls succeed, the rate grows by `additive_increase * rate` every `increase_interval` seconds.
+        increase_interval (float): Minimum time (in seconds) between two consecutive increases.
+        decrease_factor (float): Factor by which the rate is multiplied upon a rate limit error.
+        decrease_cooldown (float): Minimum time (in seconds) between two consecutive decreases.
+    """
+    def __init__(
+        self,
+        rate: float,
+        min_rate: Optional[float] = None,
+        max_rate: Optional[float] = None,
+        additive_increase: float = 0.01,
+        increase_interval: float = 1.0,
+        decrease_factor: float = 0.5,
+        decrease_cooldown: float = 1.0,
+        **kwargs,
+    ):
+        super().__init__(rate, **kwargs)
+        self.min_rate = min_rate if min_rate is not None else rate / 100
+        self.max_rate = max_rate if max_rate is not None else float('inf')
+        self.rate_increment = additive_increase * rate
+        self.increase_interval = increase_interval
+        self.decrease_factor = decrease_factor
+        self.decrease_cooldown = decrease_cooldown
+        self._last_increase: Optional[float] = None
+        self._last_decrease: Optional[float] = None
+        self._clock = time.monotonic
+
+    def on_success(self):
+        with self._lock:
+            now = self._clock()
+            if self._last_increase is not None and now - self._last_increase < self.increase_interval: return
+            self._last_increase = now
+            self._rate = min(self.max_rate, self._rate + self.rate_increment)
+
+    def on_rate_limited(self):
+        with self._lock:
+            now = self._clock()
+            if self._last_decrease is not None and now - self._last_decrease < self.decrease_cooldown: return
+            self._last_decrease = now
+            self._rate = max(self.min_rate, self._rate * self.decrease_factor)
+
+# %% ../../../pts/api/llm/01_rate_limits.pct.py #a9fd7908
+def _is_rate_limit_error(exception: BaseException) -> bool:
+    return isinstance(exception, litellm.RateLimitError) or getattr(exception, 'status_code', None) == 429
+
+def _record_call_outcome(limiter: RequestRateLimiter, exception: Optional[BaseException] = None):
+    "Reports the outcome of a call to the limiter, if it is adaptive."
+    if not isinstance(limiter, AdaptiveLimiter): return
+    if exception is None:
+        limiter.on_success()
+    elif _is_rate_limit_error(exception):
+        limiter.on_rate_limited()
+
+# %% ../../../pts/api/llm/01_rate_limits.pct.py #af242b59
+class TokenRateLimiter:
+    """
+    A thread-safe token bucket that holds up to `tokens_per_minute` tokens, and is refilled at a rate of `tokens_per_minute` per minute.
+    It can be awaited from async code (`acquire`) and blocked on from sync code (`acquire_sync`).
+
+    Charges are drawn from the bucket immediately, and may put it into debt, in which case the caller waits until the debt
+    is repaid. Calls are thereby let through in order. Charges larger than the capacity of the bucket are capped at the
+    capacity, so that they can pass once the bucket is full.
+    """
+    def __init__(self, tokens_per_minute: float):
+        self.tokens_per_minute = tokens_per_minute
+        self._tokens = tokens_per_minute
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.tokens_per_minute, self._tokens + (now - self._last_refill) * self.tokens_per_minute / 60)
+        self._last_refill = now
+
+    @property
+    def available_tokens(self) -> float:
+        with self._lock:
+            self._refill()
+            return self._tokens
+
+    def _reserve(self, tokens: float) -> float:
+        "Draws `tokens` tokens from the bucket, and returns the time (in seconds) until the bucket is out of debt."
+        with self._lock:
+            self._refill()
+            self._tokens -= min(tokens, self.tokens_per_minute)
+            return max(0.0, -self._tokens * 60 / self.tokens_per_minute)
+
+    async def acquire(self, tokens: float):
+        "Draws `tokens` tokens from the bucket, waiting until they are available."
+        delay = self._reserve(tokens)
+        if delay > 0: await asyncio.sleep(delay)
+
+    def acquire_sync(self, tokens: float):
+        "Draws `tokens` tokens from the bucket, blocking until they are available."
+        delay = self._reserve(tokens)
+        if delay > 0: time.sleep(delay)
+
+    def reconcile(self, charged_tokens: float, actual_tokens: float):
+        "Corrects a previous charge of `charged_tokens` to the actual number of tokens used."
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.tokens_per_minute, self._tokens + min(charged_tokens, self.tokens_per_minute) - actual_tokens)
+
+# %% ../../../pts/api/llm/01_rate_limits.pct.py #c4e5fc3e
+_token_rate_limiters: Dict[str, TokenRateLimiter] = {}
+
+def _get_token_limiter(model: str, api_key: Union[str, None]=None) -> Optional[TokenRateLimiter]:
+    key = f"{model}-{api_key}" if api_key is not None else model
+    return _token_rate_limiters.get(key, None)
+
+# %% ../../../pts/api/llm/01_rate_limits.pct.py #615fd479
+def set_token_rate_limit(model: str, api_key: str|None, tokens_per_minute: Optional[float]):
+    """
+    Set the token rate limit (in tokens per minute) for a model and API key. Pass `None` to remove the limit.
+    """
+    key = f"{model}-{api_key}" if api_key is not None else model
+    if tokens_per_minute is None:
+        _token_rate_limiters.pop(key, None)
+    else:
+        _token_rate_limiters[key] = TokenRateLimiter(tokens_per_minute)
+
+# %% ../../../pts/api/llm/01_rate_limits.pct.py #36775e79
+class ConcurrencyLimiter:
+    """
+    An async context manager that limits the number of concurrent calls to `max_concurrency` (`None` for no limit).
+    A separate semaphore is used for every event loop, so that the limiter can be used across `asyncio.run` calls.
+    """
+    def __init__(self, max_concurrency: Optional[int]):
+        if max_concurrency is not None and max_concurrency < 1:
+            raise ValueError("'max_concurrency' must be at least 1.")
+        self.max_concurrency = max_concurrency
+        self._semaphores: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore] = weakref.WeakKeyDictionary()
+
+    def __repr__(self) -> str:
+        return f"ConcurrencyLimiter(max_concurrency={self.max_concurrency})"
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if loop not in self._semaphores:
+            self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphores[loop]
+
+    async def __aenter__(self):
+        if self.max_concurrency is not None:
+            await self._get_semaphore().acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if self.max_concurrency is not None:
+            self._get_semaphore().release()
+
+# %% ../../../pts/api/llm/01_rate_limits.pct.py #95551168
+_concurrency_limiters: Dict[str, ConcurrencyLimiter] = {}
+_unlimited_concurrency = ConcurrencyLimiter(None)
+
+def _get_concurrency_limiter(model: str, api_key: Union[str, None]=None) -> ConcurrencyLimiter:
+    key = f"{model}-{api_key}" if api_key is not None else model
+    return _concurrency_limiters.get(key, _unlimited_concurrency)
+
+# %% ../../../pts/api/llm/01_rate_limits.pct.py #12e1cc0f
+def set_max_concurrency(model: str, api_key: str|None, max_concurrency: Optional[int]):
+    """
+    Set the maximum number of concurrent (non-cached) calls for a model and API key. Pass `None` to remove the limit.
+    Calls that are already in flight are not affected.
+    """
+    key = f"{model}-{api_key}" if api_key is not None else model
+    if max_concurrency is None:
+        _concurrency_limiters.pop(key, None)
+    else:
+        _concurrency_limiters[key] = ConcurrencyLimiter(max_concurrency)
+
+# %% ../../../pts/api/llm/01_rate_limits.pct.py #e9226512
+def get_max_concurrency(model: str, api_key: str|None = None) -> Optional[int]:
+    """
+    Get the maximum number of concurrent calls for a model and API key, or `None` if there is no limit.
+    """
+    return _get_concurrency_limiter(model, api_key).max_concurrency
+
+# %% ../../../pts/api/llm/01_rate_limits.pct.py #42773a1c
+@dataclasses.dataclass(frozen=True)
+class RetryPolicy:
+    """
+    Determines how many times, and after which delays, a failed LLM call is retried.
+
+    Attributes:
+        max_retries (int, optional): Maximum number of attempts. If None, `default_max_retries` is used.
+        base_delay (float): Delay (in seconds) before the first retry.
+        max_delay (float): Upper bound (in seconds) for any single delay, excluding delays requested through `Retry-After`.
+        multiplier (float): Growth factor of the delay between consecutive retries.
+        jitter (Literal['none', 'full', 'decorrelated']): 'none' uses the exponential delay as is, 'full' samples uniformly
+            between 0 and the exponential delay, and 'decorrelated' samples uniformly between `base_delay` and `multiplier`
+            times the previous delay.
+        deadline (float, optional): Maximum total time (in seconds) spent on a call, including retries. No further retries
+            are attempted if the next retry would start after the deadline.
+        respect_retry_after (bool): If True, delays are at least as long as the `Retry-After` header of the provider's response.
+    """
+    max_retries: Optional[int] = None
+    base_delay: float = 1.0
+    max_delay: float = 60.0
+    multiplier: float = 3.0
+    jitter: Literal['none', 'full', 'decorrelated'] = 'decorrelated'
+    deadline: Optional[float] = None
+    respect_retry_after: bool = True
+
+    def get_retry_delay(self, attempt: int, prev_delay: Optional[float], exception: BaseException, elapsed: float) -> Optional[float]:
+        """
+        Returns the delay (in seconds) before the next attempt, or None if no further attempts should be made.
+
+        Args:
+            attempt (int): The index of the attempt that just failed (starting at 0).
+            prev_delay (float, optional): The delay returned for the previous attempt, if any.
+            exception (BaseException): The exception raised by the failed attempt.
+            elapsed (float): Time (in seconds) elapsed since the first attempt started.
+        """
+        max_retries = self.max_retries if self.max_retries is not None else default_max_retries
+        if attempt + 1 >= max_retries: return None
+        if self.jitter == 'decorrelated':
+            delay = random.uniform(self.base_delay, max(self.base_delay, (prev_delay or self.base_delay) * self.multiplier))
+        else:
+            delay = self.base_delay * self.multiplier ** attempt
+            if self.jitter == 'full': delay = random.uniform(0, delay)
+        delay = min(delay, self.max_delay)
+        if self.respect_retry_after:
+            retry_after = _get_retry_after(exception)
+            if retry_after is not None: delay = max(delay, retry_after)
+        if self.deadline is not None and elapsed + delay > self.deadline: return None
+        return delay
+
+    @classmethod
+    def fixed(cls, delay: Optional[float] = None, **kwargs) -> 'RetryPolicy':
+        """
+        Returns a policy that waits `delay` seconds (default: `default_retry_delay`) before every retry, as in earlier
+        versions of `adulib`. The other attributes can be given as keyword arguments.
+        """
+        if delay is None: delay = default_retry_delay
+        return cls(base_delay=delay, max_delay=delay, multiplier=1.0, jitter='none', **kwargs)
+
+# %% ../../../pts/api/llm/01_rate_limits.pct.py #c71f8e33
+def _get_retry_after(exception: BaseException) -> Optional[float]:
+    "Returns the delay (in seconds) requested by the `Retry-After` (or `Retry-After-Ms`) header of a provider response, if any."
+    headers = getattr(exception, 'litellm_response_headers', None)
+    if headers is None:
+        headers = getattr(getattr(exception, 'response', None), 'headers', None)
+    if not headers: return None
+    try:
+        if headers.get('retry-after-ms') is not None:
+            return float(headers['retry-after-ms']) / 1000
+        retry_after = headers.get('retry-after')
+        if retry_after is None: return None
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            return max(0.0, (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+# %% ../../../pts/api/llm/01_rate_limits.pct.py #bb3a5067
+default_retry_policy = RetryPolicy()
+
+def set_default_retry_policy(retry_policy: RetryPolicy):
+    global default_retry_policy
+    default_retry_policy = retry_policy
+
+# %% ../../../pts/api/llm/01_rate_limits.pct.py #3cf03d5b
+def _resolve_retry_policy(
+    retry_policy: Optional[RetryPolicy]=None, max_retries: Optional[int]=None, retry_delay: Optional[float]=None,
+) -> RetryPolicy:
+    "Passing `retry_delay` gives a fixed-delay policy (see `RetryPolicy.fixed`). `max_retries` overrides the policy's."
+    if retry_policy is None: retry_policy = default_retry_policy
+    if retry_delay is not None:
+        fixed = RetryPolicy.fixed(retry_delay)
+        retry_policy = dataclasses.replace(
+            retry_policy, base_delay=fixed.base_delay, max_delay=fixed.max_delay, multiplier=fixed.multiplier, jitter=fixed.jitter,
+        )
+    if max_retries is None and retry_policy.max_retries is None:
+        max_retries = default_max_retries # Read at call time, so that reassigning `default_max_retries` takes effect
+    if max_retries is not None:
+        retry_policy = dataclasses.replace(retry_policy, max_retries=max_retries)
+    return retry_policy
@@ -0,0 +1,102 @@
+# AUTOGENERATED! DO NOT EDIT! File to edit: ../../../pts/api/llm/05_tokens.pct.py.
+
+# %% auto #0
+__all__ = ['token_counter', 'default_token_count_cache_size', 'set_token_count_cache_size', 'count_tokens',
+           'count_message_tokens']
+
+# %% ../../../pts/api/llm/05_tokens.pct.py #bff37cbc
+try:
+    import litellm
+    import functools
+    import threading
+    import numpy as np
+    from collections import OrderedDict
+    from typing import Union
+    from adulib.llm._utils import _llm_func_factory
+except ImportError as e:
+    raise ImportError(f"Install adulib[llm] to use this API.") from e
+
+# %% ../../../pts/api/llm/05_tokens.pct.py #3f838b88
+token_counter = _llm_func_factory(
+    func=litellm.token_counter,
+    func_name="token_counter",
+    func_cache_name="token_counter",
+    module_name=__name__,
+    cache_key_content_args=['messages', 'text'],
+    default_return_info=False,
+    rate_limited=False, # Token counting is done locally
+)
+
+# %% ../../../pts/api/llm/05_tokens.pct.py #e707b0d8
+default_token_count_cache_size = 100_000
+
+# %% ../../../pts/api/llm/05_tokens.pct.py #198d41b6
+def set_token_count_cache_size(size: int):
+    """
+    Set the maximum number of token counts kept in the in-memory cache of `count_tokens`.
+    """
+    global default_token_count_cache_size
+    default_token_count_cache_size = size
+    with _token_count_cache_lock:
+        while len(_token_count_cache) > default_token_count_cache_size:
+            _token_count_cache.popitem(last=False)
+
+# %% ../../../pts/api/llm/05_tokens.pct.py #9d955ebe
+_token_count_cache: OrderedDict = OrderedDict() # (model, text) -> number of tokens
+_token_count_cache_lock = threading.Lock()
+_MAX_CACHED_TEXT_LENGTH = 10_000 # Longer texts are not cached, so that the cache does not hold on to large strings
+
+@functools.lru_cache(maxsize=None)
+def _get_tokenizer(model: str):
+    """
+    Returns the tokenizer of `model`, as selected by `litellm.encode`, or None if it can not be retrieved.
+    `_select_tokenizer` is private to litellm, so the texts are counted with `litellm.encode` if it is unavailable.
+    """
+    try:
+        from litellm.utils import _select_tokenizer
+        return _select_tokenizer(model=model)['tokenizer']
+    except Exception:
+        return None
+
+def _count_tokens_uncached(model: str, texts: list[str]) -> list[int]:
+    tokenizer = _get_tokenizer(model)
+    if hasattr(tokenizer, 'encode_ordinary_batch'): # tiktoken
+        return [len(tokens) for tokens in tokenizer.encode_batch(texts, disallowed_special=())]
+    if hasattr(tokenizer, 'encode_batch'): # Hugging Face tokenizers
+        return [len(encoding.ids) for encoding in tokenizer.encode_batch(texts)]
+    return [len(litellm.encode(model=model, text=text)) for text in texts]
+
+# %% ../../../pts/api/llm/05_tokens.pct.py #49f9c1d6
+def count_tokens(model: str, texts: Union[str, list[str]]) -> np.ndarray:
+    """
+    Count the tokens of each of `texts` with the tokenizer of `model`. Returns an integer array with one count per text.
+    """
+    if isinstance(texts, str): texts = [texts]
+    counts = np.empty(len(texts), dtype=np.int64)
+    missing = []
+    with _token_count_cache_lock:
+        for i, text in enumerate(texts):
+            count = _token_count_cache.get((model, text))
+            if count is None:
+                missing.append(i)
+            else:
+                counts[i] = count
+                _token_count_cache.move_to_end((model, text))
+    if not missing: return counts
+    
+    missing_counts = _count_tokens_uncached(model, [texts[i] for i in missing])
+    with _token_count_cache_lock:
+        for i, count in zip(missing, missing_counts):
+            counts[i] = count
+            if len(texts[i]) <= _MAX_CACHED_TEXT_LENGTH:
+                _token_count_cache[(model, texts[i])] = count
+        while len(_token_count_cache) > default_token_count_cache_size:
+            _token_count_cache.popitem(last=False)
+    return counts
+
+# %% ../../../pts/api/llm/05_tokens.pct.py #ff2494ca
+def count_message_tokens(model: str, messages: list[dict]) -> int:
+    """
+    Count the tokens of a list of chat messages with the tokenizer of `model`, including the tokens added by the chat format.
+    """
+    return litellm.token_counter(model=model, messages=messages)
@@ -1,4 +1,10 @@
 from .base import *
 from .daemons import *
 from . import pipes
-from .wrangle import *
\ No newline at end of file
+from adulib.reflection import lazy_module_attrs as _lazy_module_attrs
+
+_submodule_attrs = {
+    'wrangle': ['df_to_tsv', 'df_to_clipboard', 'flatten_dict', 'flatten_records_to_df'],
+}
+__getattr__, __dir__ = _lazy_module_attrs(__name__, _submodule_attrs)
+__all__ = [*base.__all__, *daemons.__all__, 'pipes', *[attr for attrs in _submodule_attrs.values() for attr in attrs]]
@@ -13,6 +13,7 @@ import adulib.algos.str_matching as this_module
 
 # %%
 #|export
+from typing import Union
 try:
     import rapidfuzz
     import numpy as np
@@ -74,14 +75,14 @@ show_doc(this_module.get_vector_dist_matrix)
 # %%
 #|export
 def get_vector_dist_matrix(
-    vectors:list[list[float]],
+    vectors:Union[np.ndarray, list[list[float]]],
     metric:str="cosine",
 ):
     """
     Calculate the pairwise distance matrix for a set of vectors.
 
     Args:
-        vectors (List[List[float]]): List of vectors to calculate distances for.
+        vectors (np.ndarray | List[List[float]]): Array or list of vectors to calculate distances for. Arrays (e.g. the float32 arrays returned by `adulib.llm.batch_embeddings`) are used without copying.
         metric (str, optional): Distance metric to use. Defaults to "cosine". Options include "euclidean", "manhattan", "cosine", etc. See sklearn.metrics.pairwise_distances for more options.
 
     Returns:
@@ -17,10 +17,11 @@ from adulib.algos import smart_dedup
 #|top_export
 import inspect
 from pydantic import BaseModel
-from typing import Optional
+from typing import Optional, Union
 from adulib.algos.str_matching import fuzzy_match, get_vector_dist_matrix, embedding_match
 from adulib.llm import async_batch_embeddings
 import rapidfuzz
+import numpy as np
 from tqdm.asyncio import tqdm_asyncio
 import asyncio
 
@@ -43,7 +44,7 @@ async def smart_dedup(
     match_selection_temperature: float = 0.0,
     system_prompt: str = None,
     prompt_template: str = None,
-    entity_embeddings: Optional[list[list[float]]] = None,
+    entity_embeddings: Optional[Union[np.ndarray, list[list[float]]]] = None,
     use_fuzzy_str_matching: bool = True,
     use_embedding_matching: bool = True,
     verbose: bool = False,
@@ -64,7 +65,7 @@ async def smart_dedup(
         match_selection_temperature (float, optional): Temperature parameter for match selection model. Defaults to 0.0.
         system_prompt (str, optional): Optional system prompt for the match selection model.
         prompt_template (str, optional): Optional prompt template for the match selection model.
-        entity_embeddings (list[list[float]], optional): Precomputed embeddings for entities. If None, embeddings will be computed. Defaults to None.
+        entity_embeddings (np.ndarray | list[list[float]], optional): Precomputed embeddings for entities. If None, embeddings will be computed. Defaults to None.
         use_fuzzy_str_matching (bool, optional): If True, uses fuzzy string matching to find potential duplicates. Defaults to True.
         use_embedding_matching (bool, optional): If True, uses embedding-based matching to find potential
         verbose (bool, optional): If True, displays progress bars and additional output. Defaults to False.
@@ -13,8 +13,20 @@ import nblite; from nblite import show_doc; nblite.nbl_export()
 # %%
 #|export
 import asyncio
+import collections
+import concurrent.futures
+import dataclasses
+import functools
+import json
+import os
+import time
+import traceback
+import diskcache
+from diskcache.core import ENOVAL
+from pathlib import Path
 from tqdm.asyncio import tqdm_asyncio
-from typing import Callable, Tuple, Any, Dict, Iterable, Optional
+from typing import Callable, Tuple, Any, Dict, List, Hashable, Iterable, AsyncIterable, AsyncIterator, Literal, NamedTuple, Optional, Type, Union
+from adulib.caching import get_cache
 
 # %%
 import adulib.asynchronous as this_module
@@ -34,6 +46,660 @@ def is_in_event_loop():
         return False
 
 
+# %%
+#|exporti
+async def _aiter(items: Union[Iterable, AsyncIterable]) -> AsyncIterator:
+    if hasattr(items, '__aiter__'):
+        async for item in items: yield item
+    else:
+        for item in items: yield item
+
+_END = object()
+
+async def _anext_or_end(iterator: AsyncIterator):
+    try:
+        return await iterator.__anext__()
+    except StopAsyncIteration:
+        return _END
+
+async def _aiter_batch_items(
+    batch_args: Union[Iterable, AsyncIterable, None],
+    batch_kwargs: Union[Iterable, AsyncIterable, None],
+) -> AsyncIterator[Tuple[tuple, dict]]:
+    "Lazily yields the `(args, kwargs)` of each call. `batch_args` and `batch_kwargs` can be sync or async iterables."
+    args_iter = _aiter(batch_args) if batch_args is not None else None
+    kwargs_iter = _aiter(batch_kwargs) if batch_kwargs is not None else None
+    while True:
+        args = await _anext_or_end(args_iter) if args_iter is not None else ()
+        kwargs = await _anext_or_end(kwargs_iter) if kwargs_iter is not None else {}
+        ended = [item is _END for item, it in ((args, args_iter), (kwargs, kwargs_iter)) if it is not None]
+        if all(ended): return
+        if any(ended):
+            raise ValueError("'batch_args' and 'batch_kwargs' must have the same length.")
+        yield args, kwargs
+
+
+# %% [markdown]
+# ## Failures
+#
+# By default, the first failing task cancels the rest of the batch and its exception is raised. With
+# `on_error='return'`, failures are instead isolated: each failed task yields a `TaskFailure` in place of its result,
+# and the rest of the batch continues. Tasks can also be retried with a `retry_policy` (e.g. `adulib.llm.RetryPolicy`),
+# and `max_failures` cancels the batch early (raising `FailureBudgetExceeded`) once too many tasks have failed.
+
+# %%
+#|hide
+show_doc(this_module.TaskFailure)
+
+
+# %%
+#|export
+@dataclasses.dataclass
+class TaskFailure:
+    """
+    A task of a batch that failed.
+
+    Attributes:
+        index (int): The position of the task's arguments in the batch.
+        exception (BaseException): The exception raised by the last attempt.
+        traceback (str): The formatted traceback of the exception.
+        attempts (int): The number of attempts made.
+        duration (float): The time (in seconds) spent on the task, including retries.
+    """
+    index: int
+    exception: BaseException
+    traceback: str
+    attempts: int
+    duration: float
+
+
+# %%
+#|hide
+show_doc(this_module.FailureBudgetExceeded)
+
+
+# %%
+#|export
+class FailureBudgetExceeded(Exception):
+    """
+    Raised when more than `max_failures` tasks of a batch have failed. The remaining tasks are cancelled.
+
+    Attributes:
+        failures (List[TaskFailure]): The failures so far.
+        batch_result (BatchResult, optional): The partial results of the batch, if raised by `batch_executor`.
+    """
+    def __init__(self, failures: List[TaskFailure], batch_result: Optional['BatchResult'] = None):
+        super().__init__(f"{len(failures)} tasks failed, exceeding the failure budget. Last error: {failures[-1].exception!r}")
+        self.failures = failures
+        self.batch_result = batch_result
+
+
+# %%
+#|hide
+show_doc(this_module.BatchResult)
+
+
+# %%
+#|export
+@dataclasses.dataclass
+class BatchResult:
+    """
+    The outcome of a batch, as returned by `batch_executor` with `return_batch_result=True`.
+
+    Attributes:
+        results (List[Any]): The results of the tasks, in order. Results of failed and cancelled tasks are `None`.
+        failures (Dict[int, TaskFailure]): The failed tasks, by index.
+        durations (List[Optional[float]]): The time (in seconds) spent on each task. `None` for cancelled tasks,
+            and `0.0` for tasks restored from a checkpoint.
+        restored (List[int]): Indices of the tasks whose results were restored from a checkpoint.
+        aborted (bool): Whether the batch was cancelled early because the failure budget was exceeded.
+    """
+    results: List[Any]
+    failures: Dict[int, TaskFailure] = dataclasses.field(default_factory=dict)
+    durations: List[Optional[float]] = dataclasses.field(default_factory=list)
+    restored: List[int] = dataclasses.field(default_factory=list)
+    aborted: bool = False
+
+    @property
+    def successes(self) -> Dict[int, Any]:
+        "The results of the successful tasks, by index."
+        return {i: r for i, (r, d) in enumerate(zip(self.results, self.durations)) if d is not None and i not in self.failures}
+
+    @property
+    def cancelled(self) -> List[int]:
+        "Indices of the tasks that were not completed because the batch was aborted."
+        return [i for i, d in enumerate(self.durations) if d is None]
+
+    def raise_for_failures(self):
+        "Raises the exception of the first failed task, if any."
+        if self.failures:
+            raise self.failures[min(self.failures)].exception
+
+
+# %%
+#|hide
+show_doc(this_module.TaskMetrics)
+
+
+# %%
+#|export
+@dataclasses.dataclass
+class TaskMetrics:
+    """
+    Metrics of a task of a batch, as recorded by `BatchMetrics`.
+
+    Attributes:
+        index (int): The position of the task's arguments in the batch.
+        outcome (Literal['success', 'failure', 'restored']): 'restored' if the result was restored from a checkpoint.
+        submitted_at (float): The time (as a Unix timestamp) at which the task was submitted, i.e. the start of the
+            batch, as the tasks of a batch are queued at once.
+        started_at (float): The time at which the task started running.
+        finished_at (float): The time at which the task finished.
+        queue_wait (float): The time (in seconds) between submission and start, i.e. waiting for a free slot of
+            `concurrency_limit`, for the previous tasks of its chunk, or for a worker of a pool. For lazily consumed
+            arguments, this includes the time spent producing them.
+        duration (float): The time (in seconds) spent running the task, including retries and any waits within the
+            function itself (such as rate limiting).
+        attempts (int): The number of attempts made.
+    """
+    index: int
+    outcome: Literal['success', 'failure', 'restored']
+    submitted_at: float
+    started_at: float
+    finished_at: float
+    queue_wait: float
+    duration: float
+    attempts: int
+
+
+# %%
+#|exporti
+def _percentile(sorted_values: List[float], percentile: float) -> float:
+    "Linearly interpolated percentile, as `numpy.percentile`."
+    position = (len(sorted_values) - 1) * percentile / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+# %%
+#|hide
+show_doc(this_module.BatchMetrics)
+
+
+# %%
+#|export
+class BatchMetrics:
+    """
+    Collects the per-task metrics of a batch, when passed as the `metrics` argument of `batch_executor` or
+    `iter_batch_executor`. If a collector is reused, the metrics of the batches are accumulated.
+
+    Attributes:
+        tasks (List[TaskMetrics]): The metrics of each task, in order of completion.
+        capacity (int, optional): The maximum number of tasks that could run at the same time in the last batch. If the
+            size of a given executor is unknown, this is `concurrency_limit`.
+    """
+    def __init__(self):
+        self.tasks: List[TaskMetrics] = []
+        self.capacity: Optional[int] = None
+
+    def _executed_tasks(self) -> List[TaskMetrics]:
+        return [t for t in self.tasks if t.outcome != 'restored']
+
+    def percentiles(
+        self, field: Literal['duration', 'queue_wait'] = 'duration', percentiles: Iterable[float] = (50, 95, 99),
+    ) -> Dict[str, Optional[float]]:
+        "Returns the percentiles of `field` over the tasks that were run, e.g. `{'p50': ..., 'p95': ..., 'p99': ...}`."
+        values = sorted(getattr(t, field) for t in self._executed_tasks())
+        return {f"p{p:g}": _percentile(values, p) if values else None for p in percentiles}
+
+    @property
+    def wall_time(self) -> float:
+        "The time (in seconds) from the first submission to the last completion of the tasks that were run."
+        tasks = self._executed_tasks()
+        if not tasks: return 0.0
+        return max(t.finished_at for t in tasks) - min(t.submitted_at for t in tasks)
+
+    @property
+    def mean_concurrency(self) -> float:
+        "The average number of tasks running at the same time."
+        wall_time = self.wall_time
+        return sum(t.duration for t in self._executed_tasks()) / wall_time if wall_time > 0 else 0.0
+
+    @property
+    def utilization(self) -> Optional[float]:
+        "The average fraction of the capacity that was used, or None if the capacity is unknown."
+        return self.mean_concurrency / self.capacity if self.capacity else None
+
+    def throughput(self, interval: float = 1.0) -> List[Tuple[float, float]]:
+        """
+        Returns the throughput over time, as tuples `(time, tasks_per_second)` where `time` is the start (in seconds,
+        relative to the first submission) of each interval.
+        """
+        tasks = self._executed_tasks()
+        if not tasks: return []
+        start = min(t.submitted_at for t in tasks)
+        counts = [0] * (int((max(t.finished_at for t in tasks) - start) / interval) + 1)
+        for t in tasks:
+            counts[int((t.finished_at - start) / interval)] += 1
+        return [(i * interval, count / interval) for i, count in enumerate(counts)]
+
+    def summary(self) -> Dict[str, Any]:
+        "Returns the overall metrics of the tasks."
+        wall_time = self.wall_time
+        n_executed = len(self._executed_tasks())
+        return {
+            'n_tasks': len(self.tasks),
+            'n_failed': sum(t.outcome == 'failure' for t in self.tasks),
+            'n_restored': len(self.tasks) - n_executed,
+            'wall_time': wall_time,
+            'throughput': n_executed / wall_time if wall_time > 0 else None,
+            'mean_concurrency': self.mean_concurrency,
+            'utilization': self.utilization,
+            'duration': self.percentiles('duration'),
+            'queue_wait': self.percentiles('queue_wait'),
+        }
+
+    def to_dataframe(self):
+        "Returns the metrics of the tasks as a `pandas.DataFrame`, with a row per task."
+        import pandas as pd
+        return pd.DataFrame([dataclasses.asdict(t) for t in self.tasks], columns=[f.name for f in dataclasses.fields(TaskMetrics)])
+
+    def to_jsonl(self, path: Union[Path, str]):
+        "Writes the metrics of the tasks to a JSONL file, with a line per task."
+        with open(path, 'w') as f:
+            for t in self.tasks:
+                f.write(json.dumps(dataclasses.asdict(t)) + '\n')
+
+
+# %%
+#|exporti
+class _TaskOutcome(NamedTuple):
+    index: int
+    result: Any
+    failure: Optional[TaskFailure]
+    duration: float
+    restored: bool = False
+    started_at: Optional[float] = None # Wall-clock time, as the tasks may run in other processes
+    attempts: int = 1
+
+
+def _failed_outcome(index: int, exception: Exception, attempts: int, start: float, started_at: float) -> _TaskOutcome:
+    duration = time.monotonic() - start
+    tb = ''.join(traceback.format_exception(type(exception), exception, exception.__traceback__))
+    failure = TaskFailure(index, exception, tb, attempts, duration)
+    return _TaskOutcome(index, None, failure, duration, started_at=started_at, attempts=attempts)
+
+
+async def _run_task(
+    func: Callable, index: int, args: tuple, kwargs: dict, retry_policy: Optional[Any], retry_on: Tuple[Type[BaseException], ...],
+) -> _TaskOutcome:
+    "Runs a task, retrying it according to `retry_policy`. Exceptions are returned as a `TaskFailure`."
+    start, started_at = time.monotonic(), time.time()
+    attempt, delay = 0, None
+    while True:
+        try:
+            result = await func(*args, **kwargs)
+            return _TaskOutcome(index, result, None, time.monotonic() - start, started_at=started_at, attempts=attempt + 1)
+        except Exception as e:
+            if retry_policy is not None and isinstance(e, retry_on):
+                delay = retry_policy.get_retry_delay(attempt, delay, e, time.monotonic() - start)
+                if delay is not None:
+                    await asyncio.sleep(delay)
+                    attempt += 1
+                    continue
+            return _failed_outcome(index, e, attempt + 1, start, started_at)
+
+
+def _run_sync_task(
+    func: Callable, index: int, args: tuple, kwargs: dict, retry_policy: Optional[Any], retry_on: Tuple[Type[BaseException], ...],
+) -> _TaskOutcome:
+    "Synchronous version of `_run_task`, for the thread and process backends."
+    start, started_at = time.monotonic(), time.time()
+    attempt, delay = 0, None
+    while True:
+        try:
+            result = func(*args, **kwargs)
+            return _TaskOutcome(index, result, None, time.monotonic() - start, started_at=started_at, attempts=attempt + 1)
+        except Exception as e:
+            if retry_policy is not None and isinstance(e, retry_on):
+                delay = retry_policy.get_retry_delay(attempt, delay, e, time.monotonic() - start)
+                if delay is not None:
+                    time.sleep(delay)
+                    attempt += 1
+                    continue
+            return _failed_outcome(index, e, attempt + 1, start, started_at)
+
+
+async def _run_chunk(func: Callable, chunk: List[Tuple[int, tuple, dict]], *retry_args) -> List[_TaskOutcome]:
+    return [await _run_task(func, index, args, kwargs, *retry_args) for index, args, kwargs in chunk]
+
+
+def _run_sync_chunk(func: Callable, chunk: List[Tuple[int, tuple, dict]], *retry_args) -> List[_TaskOutcome]:
+    "Runs the tasks of a chunk in a worker thread or process. Chunks are submitted as one job to amortize the overhead."
+    return [_run_sync_task(func, index, args, kwargs, *retry_args) for index, args, kwargs in chunk]
+
+
+def _create_executor(backend: str, max_workers: Optional[int]) -> concurrent.futures.Executor:
+    if backend == 'thread':
+        return concurrent.futures.ThreadPoolExecutor(max_workers)
+    elif backend == 'process':
+        return concurrent.futures.ProcessPoolExecutor(max_workers)
+    raise ValueError(f"Invalid value for 'backend': {backend!r}. Must be 'asyncio', 'thread', 'process' or an executor.")
+
+
+def _get_pool_size(backend: Union[str, concurrent.futures.Executor], max_workers: Optional[int]) -> Optional[int]:
+    "The number of workers of the pool created for `backend`, or None if it is unknown (e.g. for a given executor)."
+    if not isinstance(backend, str) or backend == 'asyncio': return None
+    if max_workers is not None: return max_workers
+    # The `concurrent.futures` defaults
+    if backend == 'thread': return min(32, (os.cpu_count() or 1) + 4)
+    return os.cpu_count() or 1
+
+
+def _get_default_checkpoint_id(func: Callable) -> str:
+    "The qualified name of `func`, which namespaces its checkpoint keys unless a `checkpoint_id` is given."
+    while isinstance(func, functools.partial):
+        func = func.func
+    return f"{getattr(func, '__module__', None)}.{getattr(func, '__qualname__', type(func).__qualname__)}"
+
+
+def _get_checkpoint_key(checkpoint_id: str, item_id: Hashable) -> tuple:
+    return ('batch_executor_checkpoint', checkpoint_id, item_id)
+
+
+def _read_checkpoint(checkpoint: diskcache.Cache, keys: List[tuple]) -> list:
+    "Looks up the results of a batch of items. Run in a thread, so that the database reads do not block the event loop."
+    return [checkpoint.get(key, default=ENOVAL, retry=True) for key in keys]
+
+
+def _write_checkpoint(checkpoint: diskcache.Cache, records: List[Tuple[tuple, Any]]):
+    "Records the results of a batch of items in a single transaction. Run in a thread, as `_read_checkpoint`."
+    with checkpoint.transact(retry=True):
+        for key, result in records:
+            checkpoint.set(key, result)
+
+
+def _get_task_metrics(outcome: _TaskOutcome, submitted_at: float) -> TaskMetrics:
+    started_at = outcome.started_at if outcome.started_at is not None else submitted_at
+    return TaskMetrics(
+        index=outcome.index,
+        outcome='restored' if outcome.restored else 'success' if outcome.failure is None else 'failure',
+        submitted_at=submitted_at,
+        started_at=started_at,
+        finished_at=started_at + outcome.duration,
+        queue_wait=max(0.0, started_at - submitted_at),
+        duration=outcome.duration,
+        attempts=outcome.attempts,
+    )
+
+
+async def _iter_task_outcomes(
+    func: Callable,
+    constant_kwargs: Dict[str, Any],
+    batch_args: Union[Iterable, AsyncIterable, None],
+    batch_kwargs: Union[Iterable, AsyncIterable, None],
+    concurrency_limit: int,
+    ordered: bool,
+    on_error: Literal['raise', 'return'],
+    retry_policy: Optional[Any],
+    retry_on: Tuple[Type[BaseException], ...],
+    max_failures: Optional[int],
+    checkpoint: Union[Path, str, diskcache.Cache, None],
+    item_ids: Union[Iterable[Hashable], AsyncIterable[Hashable], None],
+    backend: Union[Literal['asyncio', 'thread', 'process'], concurrent.futures.Executor],
+    max_workers: Optional[int],
+    chunk_size: int,
+    metrics: Optional[BatchMetrics],
+    checkpoint_id: Optional[str] = None,
+) -> AsyncIterator[_TaskOutcome]:
+    "Yields the `_TaskOutcome` of each task of a batch. See `iter_batch_executor`."
+    if batch_args is None and batch_kwargs is None:
+        raise ValueError("At least one of 'batch_args' or 'batch_kwargs' must be given.")
+    if concurrency_limit < 1:
+        raise ValueError("'concurrency_limit' must be at least 1.")
+    if chunk_size < 1:
+        raise ValueError("'chunk_size' must be at least 1.")
+    if on_error not in ('raise', 'return'):
+        raise ValueError(f"Invalid value for 'on_error': {on_error!r}. Must be 'raise' or 'return'.")
+    
+    if item_ids is not None and checkpoint is None:
+        raise ValueError("'item_ids' can only be given together with 'checkpoint'.")
+    if checkpoint is not None and not isinstance(checkpoint, diskcache.Cache):
+        checkpoint = get_cache(checkpoint)
+    if checkpoint_id is None:
+        checkpoint_id = _get_default_checkpoint_id(func)
+    
+    executor, owns_executor = None, False
+    if isinstance(backend, concurrent.futures.Executor):
+        executor = backend
+    elif backend != 'asyncio':
+        executor, owns_executor = _create_executor(backend, max_workers), True
+    
+    if metrics is not None:
+        # The tasks of a chunk are run one after the other, so at most one task per chunk is running
+        pool_size = _get_pool_size(backend, max_workers)
+        metrics.capacity = concurrency_limit if pool_size is None else min(concurrency_limit, pool_size)
+    batch_start = time.time()
+    
+    def submit(chunk: List[Tuple[int, tuple, dict]]) -> asyncio.Future:
+        if executor is None:
+            return asyncio.ensure_future(_run_chunk(func, chunk, retry_policy, retry_on))
+        return asyncio.get_running_loop().run_in_executor(executor, _run_sync_chunk, func, chunk, retry_policy, retry_on)
+    
+    loop = asyncio.get_running_loop()
+    items = _aiter_batch_items(batch_args, batch_kwargs)
+    ids = _aiter(item_ids) if item_ids is not None else None
+    items_exhausted = False
+    # Items read ahead of submission, with their checkpoint keys and restored results. Items are read (and looked up
+    # in the checkpoint) in batches of up to the number of free slots, to save on round trips to the checkpoint.
+    intake: collections.deque = collections.deque()
+    task_indices: Dict[asyncio.Future, int] = {} # Running tasks, and the index of their first item
+    chunk: List[Tuple[int, tuple, dict]] = [] # Items of the next task
+    checkpoint_keys: Dict[int, tuple] = {} # Checkpoint keys of the running tasks' items
+    checkpoint_records: List[Tuple[tuple, Any]] = [] # Results waiting to be written to the checkpoint
+    finished: Dict[int, _TaskOutcome] = {} # Outcomes waiting to be yielded in order
+    failures: List[TaskFailure] = []
+    next_index = 0 # Index of the next item
+    next_yield_index = 0 # Index of the next outcome to yield, if `ordered`
+    
+    async def read_items(n: int):
+        nonlocal items_exhausted, next_index
+        new_items = []
+        while len(new_items) < n:
+            try:
+                args, kwargs = await items.__anext__()
+            except StopAsyncIteration:
+                items_exhausted = True
+                if ids is not None and await _anext_or_end(ids) is not _END:
+                    raise ValueError("'item_ids' must have the same length as the batch.")
+                break
+            key = None
+            if checkpoint is not None:
+                item_id = await _anext_or_end(ids) if ids is not None else next_index
+                if item_id is _END:
+                    raise ValueError("'item_ids' must have the same length as the batch.")
+                key = _get_checkpoint_key(checkpoint_id, item_id)
+            new_items.append((next_index, args, kwargs, key))
+            next_index += 1
+        if checkpoint is not None and new_items:
+            results = await loop.run_in_executor(None, _read_checkpoint, checkpoint, [key for *_, key in new_items])
+        else:
+            results = [ENOVAL] * len(new_items)
+        intake.extend(item + (result,) for item, result in zip(new_items, results))
+    
+    async def flush_checkpoint():
+        if checkpoint_records:
+            records = checkpoint_records.copy()
+            checkpoint_records.clear()
+            await loop.run_in_executor(None, _write_checkpoint, checkpoint, records)
+    
+    try:
+        while True:
+            while len(task_indices) + len(finished) < concurrency_limit:
+                if not intake:
+                    if items_exhausted: break
+                    n_free = concurrency_limit - len(task_indices) - len(finished)
+                    await read_items(n_free * chunk_size - len(chunk))
+                    if not intake: break
+                index, args, kwargs, key, result = intake.popleft()
+                
+                if result is not ENOVAL: # Completed in a previous run
+                    outcome = _TaskOutcome(index, result, None, 0.0, restored=True)
+                    if metrics is not None:
+                        metrics.tasks.append(_get_task_metrics(outcome, time.time()))
+                    if ordered:
+                        finished[index] = outcome
+                    else:
+                        yield outcome
+                    continue
+                if key is not None:
+                    checkpoint_keys[index] = key
+                
+                chunk.append((index, args, {**constant_kwargs, **kwargs}))
+                if len(chunk) == chunk_size:
+                    task_indices[submit(chunk)] = chunk[0][0]
+                    chunk = []
+            # Submit incomplete chunks rather than waiting for more items, as the outcomes yielded next may depend on them
+            if chunk:
+                task_indices[submit(chunk)] = chunk[0][0]
+                chunk = []
+            
+            while next_yield_index in finished:
+                yield finished.pop(next_yield_index)
+                next_yield_index += 1
+            
+            if not task_indices:
+                if items_exhausted and not intake: break
+                continue
+            done, _ = await asyncio.wait(task_indices.keys(), return_when=asyncio.FIRST_COMPLETED)
+            # Handle in index order, so that tasks that finished together are yielded deterministically
+            for task in sorted(done, key=task_indices.get):
+                del task_indices[task]
+                for outcome in task.result():
+                    if metrics is not None:
+                        metrics.tasks.append(_get_task_metrics(outcome, batch_start))
+                    key = checkpoint_keys.pop(outcome.index, None)
+                    if key is not None and outcome.failure is None:
+                        checkpoint_records.append((key, outcome.result))
+                    if outcome.failure is not None:
+                        if on_error == 'raise':
+                            raise outcome.failure.exception
+                        failures.append(outcome.failure)
+                        if max_failures is not None and len(failures) > max_failures:
+                            raise FailureBudgetExceeded(failures)
+                    if ordered:
+                        finished[outcome.index] = outcome
+                    else:
+                        yield outcome
+            await flush_checkpoint()
+    finally:
+        for task in task_indices:
+            task.cancel()
+        await asyncio.gather(*task_indices, return_exceptions=True)
+        if owns_executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+        await items.aclose()
+        # Results of completed tasks are recorded even if the batch is aborted, so that they are not run again on resume
+        await flush_checkpoint()
+
+
+# %%
+#|hide
+show_doc(this_module.iter_batch_executor)
+
+
+# %%
+#|export
+async def iter_batch_executor(
+    func: Callable,
+    constant_kwargs: Dict[str, Any] = {},
+    batch_args: Optional[Union[Iterable[Tuple[Any, ...]], AsyncIterable[Tuple[Any, ...]]]] = None,
+    batch_kwargs: Optional[Union[Iterable[Dict[str, Any]], AsyncIterable[Dict[str, Any]]]] = None,
+    concurrency_limit: int = 100,
+    ordered: bool = True,
+    on_error: Literal['raise', 'return'] = 'raise',
+    retry_policy: Optional[Any] = None,
+    retry_on: Tuple[Type[BaseException], ...] = (Exception,),
+    max_failures: Optional[int] = None,
+    checkpoint: Union[Path, str, diskcache.Cache, None] = None,
+    item_ids: Optional[Union[Iterable[Hashable], AsyncIterable[Hashable]]] = None,
+    checkpoint_id: Optional[str] = None,
+    backend: Union[Literal['asyncio', 'thread', 'process'], concurrent.futures.Executor] = 'asyncio',
+    max_workers: Optional[int] = None,
+    chunk_size: int = 1,
+    metrics: Optional[BatchMetrics] = None,
+) -> AsyncIterator[Tuple[int, Any]]:
+    """
+    Executes a batch of asynchronous tasks, yielding the results as they become available.
+
+    Unlike `batch_executor`, the arguments are consumed lazily and at most `concurrency_limit` tasks exist at any
+    time (including finished tasks whose results are waiting to be yielded in order), so memory use does not grow
+    with the size of the batch.
+
+    Parameters:
+    - func (Callable): The function to execute for each batch. Must be asynchronous for the 'asyncio' backend, and
+      synchronous (and, for the 'process' backend, picklable) otherwise.
+    - constant_kwargs (Dict[str, Any], optional): Constant keyword arguments to pass to each function call.
+    - batch_args (optional): Iterable or async iterable of argument tuples for each function call.
+    - batch_kwargs (optional): Iterable or async iterable of keyword argument dictionaries for each function call.
+    - concurrency_limit (int, optional): Maximum number of concurrent tasks. Default is 100.
+    - ordered (bool, optional): If True, results are yielded in the order of the arguments. Otherwise, they are
+      yielded as the tasks complete. Default is True.
+    - on_error (Literal['raise', 'return'], optional): If 'raise', the first failure cancels the remaining tasks and
+      its exception is raised. If 'return', a `TaskFailure` is yielded in place of the result. Default is 'raise'.
+    - retry_policy (optional): An object with a `get_retry_delay(attempt, prev_delay, exception, elapsed)` method, such as
+      `adulib.llm.RetryPolicy`, used to retry failed tasks. If None, tasks are not retried.
+    - retry_on (Tuple[Type[BaseException], ...], optional): The exception types that are retried. Default is `(Exception,)`.
+    - max_failures (int, optional): If more tasks than this fail, the remaining tasks are cancelled and
+      `FailureBudgetExceeded` is raised. Only used if `on_error='return'`. If None, there is no limit.
+    - checkpoint (Union[Path, str, diskcache.Cache, None], optional): A cache (or the path of one) in which the results of
+      successful tasks are recorded as they complete. Tasks whose results are already in the checkpoint are not run
+      again, so an interrupted batch can be resumed by re-running it with the same checkpoint. The lookups and writes
+      are made in batches, in a worker thread.
+    - item_ids (optional): Iterable or async iterable of hashable ids for the tasks, used as checkpoint keys. Only used
+      with `checkpoint`. If None, the positions of the tasks in the batch are used.
+    - checkpoint_id (str, optional): Namespaces the checkpoint keys, so that several batch jobs can share a checkpoint.
+      Jobs with the same function but different `constant_kwargs` need different ids. If None, the qualified name of
+      `func` is used.
+    - backend (optional): How the tasks are run. 'asyncio' runs them on the event loop, 'thread' in a thread pool
+      (for blocking calls), and 'process' in a process pool (for CPU-bound work). An existing
+      `concurrent.futures.Executor` can also be given, which is not shut down afterwards. Default is 'asyncio'.
+    - max_workers (int, optional): The number of workers of the thread or process pool. If None, the
+      `concurrent.futures` default is used.
+    - chunk_size (int, optional): The number of tasks submitted to the pool as one job, to amortize the overhead
+      of pickling and inter-process communication. With chunks, `concurrency_limit` applies to the number of
+      chunks. Default is 1.
+    - metrics (BatchMetrics, optional): A collector in which the metrics of each task (queue wait, duration, outcome)
+      are recorded.
+
+    Yields:
+    - Tuples `(index, result)`, where `index` is the position of the task's arguments in the batch.
+
+    Raises:
+    - ValueError: If neither 'batch_args' nor 'batch_kwargs' is given, or if their lengths do not match.
+    - FailureBudgetExceeded: If more than `max_failures` tasks failed.
+    - Any exception raised by a task if `on_error='raise'`, after cancelling the remaining tasks.
+    """
+    async for outcome in _iter_task_outcomes(
+        func, constant_kwargs, batch_args, batch_kwargs,
+        concurrency_limit=concurrency_limit,
+        ordered=ordered,
+        on_error=on_error,
+        retry_policy=retry_policy,
+        retry_on=retry_on,
+        max_failures=max_failures,
+        checkpoint=checkpoint,
+        item_ids=item_ids,
+        checkpoint_id=checkpoint_id,
+        backend=backend,
+        max_workers=max_workers,
+        chunk_size=chunk_size,
+        metrics=metrics,
+    ):
+        yield outcome.index, outcome.result if outcome.failure is None else outcome.failure
+
+
 # %%
 #|hide
 show_doc(this_module.batch_executor)
@@ -49,24 +715,56 @@ async def batch_executor(
     concurrency_limit: Optional[int] = None,
     verbose: bool = True,
     progress_bar_desc: str = "Processing",
+    on_error: Literal['raise', 'return'] = 'raise',
+    retry_policy: Optional[Any] = None,
+    retry_on: Tuple[Type[BaseException], ...] = (Exception,),
+    max_failures: Optional[int] = None,
+    return_batch_result: bool = False,
+    checkpoint: Union[Path, str, diskcache.Cache, None] = None,
+    item_ids: Optional[Iterable[Hashable]] = None,
+    checkpoint_id: Optional[str] = None,
+    backend: Union[Literal['asyncio', 'thread', 'process'], concurrent.futures.Executor] = 'asyncio',
+    max_workers: Optional[int] = None,
+    chunk_size: int = 1,
+    metrics: Optional[BatchMetrics] = None,
 ):
     """
     Executes a batch of asynchronous tasks.
 
     Parameters:
-    - func (Callable): The asynchronous function to execute for each batch.
+    - func (Callable): The function to execute for each batch. Must be asynchronous for the 'asyncio' backend, and
+      synchronous otherwise.
     - constant_kwargs (Dict[str, Any], optional): Constant keyword arguments to pass to each function call.
     - batch_args (Optional[Iterable[Tuple[Any, ...]]], optional): Iterable of argument tuples for each function call.
     - batch_kwargs (Optional[Iterable[Dict[str, Any]]], optional): Iterable of keyword argument dictionaries for each function call.
     - concurrency_limit (Optional[int], optional): Maximum number of concurrent tasks. If None, no limit is applied.
     - verbose (bool, optional): If True, displays a progress bar. Default is True.
     - progress_bar_desc (str, optional): Description for the progress bar. Default is "Processing".
+    - on_error (Literal['raise', 'return'], optional): If 'raise', the first failure cancels the remaining tasks and
+      its exception is raised. If 'return', the failed tasks' results are `TaskFailure`s. Default is 'raise'.
+    - retry_policy (optional): Used to retry failed tasks, e.g. an `adulib.llm.RetryPolicy`. See `iter_batch_executor`.
+    - retry_on (Tuple[Type[BaseException], ...], optional): The exception types that are retried. Default is `(Exception,)`.
+    - max_failures (int, optional): If more tasks than this fail, the remaining tasks are cancelled. Only used if
+      `on_error='return'`. If None, there is no limit.
+    - return_batch_result (bool, optional): If True, returns a `BatchResult` instead of a list of results. Default is False.
+    - checkpoint (Union[Path, str, diskcache.Cache, None], optional): A cache (or the path of one) in which results are
+      recorded as they complete, so that an interrupted batch can be resumed. See `iter_batch_executor`.
+    - item_ids (Optional[Iterable[Hashable]], optional): Ids of the tasks, used as checkpoint keys. If None, the
+      positions of the tasks in the batch are used.
+    - checkpoint_id (str, optional): Namespaces the checkpoint keys. Defaults to the qualified name of `func`. See
+      `iter_batch_executor`.
+    - backend (optional): 'asyncio', 'thread', 'process' or a `concurrent.futures.Executor`. See `iter_batch_executor`.
+    - max_workers (int, optional): The number of workers of the thread or process pool.
+    - chunk_size (int, optional): The number of tasks submitted to the pool as one job. Default is 1.
+    - metrics (BatchMetrics, optional): A collector in which the metrics of each task are recorded.
 
     Returns:
-    - List of results from the executed tasks.
+    - List of results from the executed tasks, or a `BatchResult` if `return_batch_result` is True.
 
     Raises:
     - ValueError: If both 'batch_args' and 'batch_kwargs' are empty or if their lengths do not match.
+    - FailureBudgetExceeded: If more than `max_failures` tasks failed and `return_batch_result` is False. The
+      partial results are available as its `batch_result` attribute.
     """
     if not batch_args and not batch_kwargs:
         raise ValueError("At least one of 'batch_args' or 'batch_kwargs' must be non-empty.")
@@ -78,22 +776,57 @@ async def batch_executor(
     
     if len(batch_args) != len(batch_kwargs):
         raise ValueError("'batch_args' and 'batch_kwargs' must have the same length.")
+    if item_ids is not None and len(item_ids) != len(batch_args):
+        raise ValueError("'item_ids' must have the same length as the batch.")
     
     n_tasks = len(batch_args)
-    semaphore = asyncio.Semaphore(concurrency_limit or n_tasks)
-    
-    async def execute_func(*args, **kwargs):
-        async with semaphore:
-            return await func(*args, **kwargs)
-        
-    kwargs_list = [ {**constant_kwargs, **kwargs} for kwargs in batch_kwargs ]
-    tasks = [execute_func(*args, **kwargs) for args, kwargs in zip(batch_args, kwargs_list)]
+    batch_result = BatchResult(results=[None] * n_tasks, durations=[None] * n_tasks)
+    outcomes = _iter_task_outcomes(
+        func, constant_kwargs, batch_args, batch_kwargs,
+        concurrency_limit=concurrency_limit or n_tasks,
+        ordered=False,
+        on_error=on_error,
+        retry_policy=retry_policy,
+        retry_on=retry_on,
+        max_failures=max_failures,
+        checkpoint=checkpoint,
+        item_ids=item_ids,
+        checkpoint_id=checkpoint_id,
+        backend=backend,
+        max_workers=max_workers,
+        chunk_size=chunk_size,
+        metrics=metrics,
+    )
+    with tqdm_asyncio(total=n_tasks, desc=progress_bar_desc, disable=not verbose) as pbar:
+        try:
+            async for outcome in outcomes:
+                batch_result.durations[outcome.index] = outcome.duration
+                if outcome.failure is None:
+                    batch_result.results[outcome.index] = outcome.result
+                else:
+                    batch_result.failures[outcome.index] = outcome.failure
+                if outcome.restored:
+                    batch_result.restored.append(outcome.index)
+                    # Restored results count towards the progress, but not towards the rate estimate
+                    pbar.n += 1
+                    pbar.last_print_n = pbar.n
+                else:
+                    pbar.update(1)
+        except FailureBudgetExceeded as e:
+            # The failure that exceeded the budget is not yielded
+            batch_result.failures[e.failures[-1].index] = e.failures[-1]
+            batch_result.durations[e.failures[-1].index] = e.failures[-1].duration
+            batch_result.aborted = True
+            if not return_batch_result:
+                e.batch_result = batch_result
+                raise
     
-    if verbose:
-        results = await tqdm_asyncio.gather(*tasks, desc=progress_bar_desc)
-    else:
-        results = await asyncio.gather(*tasks)
-    return results
+    if return_batch_result:
+        return batch_result
+    return [
+        batch_result.failures[i] if i in batch_result.failures else result
+        for i, result in enumerate(batch_result.results)
+    ]
 
 
 # %%
@@ -115,3 +848,418 @@ results = await batch_executor(
 )
 
 print("Results:", results)
+
+# %%
+assert results == [30, 70, 110]
+
+# %% [markdown]
+# `iter_batch_executor` is the streaming counterpart of `batch_executor`. The arguments can be lazy (or async)
+# iterables of any size, since only `concurrency_limit` tasks are kept alive at a time.
+
+# %%
+n_running = max_running = 0
+
+async def tracked_function(x, y=0):
+    global n_running, max_running
+    n_running += 1
+    max_running = max(max_running, n_running)
+    await asyncio.sleep(0.001 * (x % 7))
+    n_running -= 1
+    return x + y
+
+results = [
+    r async for r in iter_batch_executor(
+        tracked_function,
+        batch_args=((i,) for i in range(1000)),
+        concurrency_limit=10,
+    )
+]
+assert results == [(i, i) for i in range(1000)]
+assert max_running <= 10
+
+
+# %%
+async def async_batch_kwargs():
+    for i in range(50):
+        await asyncio.sleep(0)
+        yield {'y': i}
+
+results = [
+    r async for r in iter_batch_executor(
+        tracked_function,
+        batch_args=((i,) for i in range(50)),
+        batch_kwargs=async_batch_kwargs(),
+        concurrency_limit=5,
+        ordered=False,
+    )
+]
+assert sorted(results) == [(i, 2*i) for i in range(50)]
+assert [i for i, _ in results] != list(range(50)) # Yielded as completed
+
+
+# %%
+async def failing_function(x):
+    await asyncio.sleep(0.001 * x)
+    if x == 3: raise RuntimeError("Task failed")
+    return x
+
+n_started = 0
+def counted_args():
+    global n_started
+    for i in range(1000):
+        n_started += 1
+        yield (i,)
+
+try:
+    async for _ in iter_batch_executor(failing_function, batch_args=counted_args(), concurrency_limit=4):
+        pass
+    assert False
+except RuntimeError:
+    pass
+assert n_started < 10
+
+try:
+    async for _ in iter_batch_executor(failing_function, batch_args=[(1,), (2,)], batch_kwargs=[{}]):
+        pass
+    assert False
+except ValueError:
+    pass
+
+
+# %% [markdown]
+# With `on_error='return'`, failed tasks do not affect the rest of the batch:
+
+# %%
+async def flaky_function(x):
+    await asyncio.sleep(0.001)
+    if x % 10 == 3: raise RuntimeError(f"Task {x} failed")
+    return x
+
+batch_result = await batch_executor(
+    flaky_function,
+    batch_args=[(i,) for i in range(100)],
+    concurrency_limit=10,
+    on_error='return',
+    return_batch_result=True,
+    verbose=False,
+)
+assert sorted(batch_result.failures) == list(range(3, 100, 10))
+assert batch_result.successes == {i: i for i in range(100) if i % 10 != 3}
+assert not batch_result.aborted and batch_result.cancelled == []
+assert all(d is not None for d in batch_result.durations)
+failure = batch_result.failures[3]
+assert isinstance(failure.exception, RuntimeError) and failure.attempts == 1
+assert 'Task 3 failed' in failure.traceback
+
+results = await batch_executor(flaky_function, batch_args=[(i,) for i in range(10)], on_error='return', verbose=False)
+assert isinstance(results[3], TaskFailure) and results[:3] == [0, 1, 2]
+
+results = [r async for r in iter_batch_executor(flaky_function, batch_args=((i,) for i in range(10)), on_error='return')]
+assert isinstance(results[3][1], TaskFailure) and results[4] == (4, 4)
+
+# %% [markdown]
+# `max_failures` cancels the batch early once too many tasks have failed, keeping the results so far:
+
+# %%
+batch_result = await batch_executor(
+    flaky_function,
+    batch_args=[(i,) for i in range(1000)],
+    concurrency_limit=5,
+    on_error='return',
+    max_failures=2,
+    return_batch_result=True,
+    verbose=False,
+)
+assert batch_result.aborted
+assert sorted(batch_result.failures) == [3, 13, 23]
+assert len(batch_result.cancelled) > 900
+assert all(batch_result.successes[i] == i for i in range(3))
+
+try:
+    await batch_executor(flaky_function, batch_args=[(i,) for i in range(1000)], on_error='return', max_failures=0, verbose=False)
+    assert False
+except FailureBudgetExceeded as e:
+    assert e.batch_result.aborted and list(e.batch_result.failures) == [3]
+
+# %% [markdown]
+# Tasks can be retried with a `retry_policy`, such as `adulib.llm.RetryPolicy`:
+
+# %%
+from adulib.llm import RetryPolicy
+
+n_calls = {}
+async def unreliable_function(x):
+    n_calls[x] = n_calls.get(x, 0) + 1
+    if n_calls[x] < 3: raise ConnectionError("Try again")
+    return x
+
+results = await batch_executor(
+    unreliable_function,
+    batch_args=[(i,) for i in range(5)],
+    retry_policy=RetryPolicy(max_retries=3, base_delay=0.001, jitter='none'),
+    verbose=False,
+)
+assert results == list(range(5))
+
+n_calls = {}
+batch_result = await batch_executor(
+    unreliable_function,
+    batch_args=[(i,) for i in range(5)],
+    retry_policy=RetryPolicy(max_retries=3, base_delay=0.001, jitter='none'),
+    retry_on=(ValueError,),
+    on_error='return',
+    return_batch_result=True,
+    verbose=False,
+)
+assert len(batch_result.failures) == 5 and batch_result.failures[0].attempts == 1
+
+# %% [markdown]
+# ## Checkpoints
+#
+# With a `checkpoint`, the results are recorded as the tasks complete. If the batch is interrupted, re-running it with
+# the same checkpoint only runs the tasks that had not completed.
+
+# %%
+import tempfile
+
+checkpoint_path = Path(tempfile.mkdtemp()) / 'checkpoint'
+n_calls = 0
+
+async def preemptible_function(x, fail_at=None):
+    global n_calls
+    n_calls += 1
+    await asyncio.sleep(0.001)
+    if x == fail_at: raise RuntimeError("Preempted")
+    return x * 2
+
+try:
+    await batch_executor(
+        preemptible_function,
+        constant_kwargs={'fail_at': 60},
+        batch_args=[(i,) for i in range(100)],
+        concurrency_limit=5,
+        checkpoint=checkpoint_path,
+        verbose=False,
+    )
+    assert False
+except RuntimeError:
+    pass
+n_completed = len(get_cache(checkpoint_path))
+assert 55 <= n_completed < 100
+
+n_calls = 0
+batch_result = await batch_executor(
+    preemptible_function,
+    batch_args=[(i,) for i in range(100)],
+    concurrency_limit=5,
+    checkpoint=checkpoint_path,
+    return_batch_result=True,
+    verbose=False,
+)
+assert batch_result.results == [2*i for i in range(100)]
+assert n_calls == 100 - n_completed == 100 - len(batch_result.restored)
+
+# %% [markdown]
+# The tasks can be given ids with `item_ids`, so that the checkpoint remains valid if the order of the batch changes:
+
+# %%
+checkpoint = get_cache(Path(tempfile.mkdtemp()) / 'checkpoint')
+words = ['apple', 'banana', 'cherry', 'date']
+
+async def upper(word):
+    global n_calls
+    n_calls += 1
+    return word.upper()
+
+n_calls = 0
+results = [r async for r in iter_batch_executor(upper, batch_args=[(w,) for w in words], checkpoint=checkpoint, item_ids=words)]
+assert results == [(i, w.upper()) for i, w in enumerate(words)] and n_calls == 4
+
+words = ['elderberry'] + words[::-1]
+n_calls = 0
+results = [r async for r in iter_batch_executor(upper, batch_args=((w,) for w in words), checkpoint=checkpoint, item_ids=iter(words))]
+assert results == [(i, w.upper()) for i, w in enumerate(words)] and n_calls == 1
+
+
+# %% [markdown]
+# The checkpoint keys are namespaced by the qualified name of the function (or by `checkpoint_id`), so that batch jobs
+# can share a checkpoint without restoring each other's results:
+
+# %%
+async def lower(word):
+    return word.lower()
+
+results = [r async for r in iter_batch_executor(lower, batch_args=[(w,) for w in words], checkpoint=checkpoint, item_ids=words)]
+assert results == [(i, w.lower()) for i, w in enumerate(words)]
+
+results = [
+    r async for r in iter_batch_executor(
+        upper, batch_args=[(w,) for w in words], checkpoint=checkpoint, item_ids=words, checkpoint_id='upper-v2',
+    )
+]
+assert n_calls == 1 + len(words)
+
+# %% [markdown]
+# The checkpoint is read and written in batches in a worker thread, so that the database does not block the event loop:
+
+# %%
+import threading
+
+class ThreadRecordingCache(diskcache.Cache):
+    def get(self, *args, **kwargs):
+        io_threads.append(threading.get_ident())
+        return super().get(*args, **kwargs)
+
+    def set(self, *args, **kwargs):
+        io_threads.append(threading.get_ident())
+        return super().set(*args, **kwargs)
+
+io_threads = []
+with ThreadRecordingCache(tempfile.mkdtemp()) as recording_checkpoint:
+    await batch_executor(upper, batch_args=[(w,) for w in words], checkpoint=recording_checkpoint, verbose=False)
+    assert len(io_threads) == 2 * len(words) and threading.get_ident() not in io_threads
+    io_threads.clear()
+    await batch_executor(upper, batch_args=[(w,) for w in words], checkpoint=recording_checkpoint, verbose=False)
+    assert len(io_threads) == len(words) and threading.get_ident() not in io_threads # All restored
+
+# %% [markdown]
+# ## Backends
+#
+# Synchronous functions can be run in a thread pool (for blocking calls) or in a process pool (for CPU-bound work)
+# with `backend`. With a process pool, `chunk_size` tasks are submitted as one job, which amortizes the cost of
+# pickling the arguments and results.
+
+# %%
+# The barrier is only passed once 10 calls run at the same time, and raises `threading.BrokenBarrierError` otherwise
+barrier = threading.Barrier(10, timeout=10)
+
+def blocking_function(x):
+    barrier.wait()
+    return x * 2
+
+results = await batch_executor(
+    blocking_function, batch_args=[(i,) for i in range(20)], backend='thread', max_workers=10, verbose=False,
+)
+assert results == [2*i for i in range(20)]
+
+# %%
+import math
+
+# The functions are called through `this_module`, as the functions defined in this notebook cannot be pickled
+results = await this_module.batch_executor(
+    math.factorial,
+    batch_args=[(i,) for i in range(-5, 500)],
+    backend='process',
+    max_workers=2,
+    chunk_size=50,
+    on_error='return',
+    verbose=False,
+)
+assert results[5:] == [math.factorial(i) for i in range(500)]
+assert all(isinstance(r, this_module.TaskFailure) and isinstance(r.exception, ValueError) for r in results[:5])
+assert 'factorial() not defined for negative values' in results[0].traceback
+
+results = [
+    r async for r in this_module.iter_batch_executor(
+        math.factorial, batch_args=((i,) for i in range(100)), backend='process', chunk_size=7, concurrency_limit=3,
+    )
+]
+assert results == [(i, math.factorial(i)) for i in range(100)]
+
+# %%
+with concurrent.futures.ThreadPoolExecutor(4) as executor:
+    results = await batch_executor(str.upper, batch_args=[(w,) for w in words], backend=executor, verbose=False)
+    assert results == [w.upper() for w in words]
+
+# %% [markdown]
+# ## Metrics
+#
+# Passing a `BatchMetrics` collector records the queue wait, duration and outcome of each task, to find out where the
+# time of a slow batch goes.
+
+# %%
+metrics = BatchMetrics()
+running = peak_running = 0
+
+async def variable_function(x):
+    global running, peak_running
+    running += 1
+    peak_running = max(peak_running, running)
+    try:
+        await asyncio.sleep(0.01 if x % 10 else 0.05)
+    finally:
+        running -= 1
+    if x == 7: raise RuntimeError("Task failed")
+    return x
+
+await batch_executor(
+    variable_function,
+    batch_args=[(i,) for i in range(100)],
+    concurrency_limit=10,
+    on_error='return',
+    metrics=metrics,
+    verbose=False,
+)
+summary = metrics.summary()
+summary
+
+# %%
+assert summary['n_tasks'] == 100 and summary['n_failed'] == 1 and summary['n_restored'] == 0
+assert peak_running == metrics.capacity == 10 and 0 < summary['utilization'] <= 1
+# The bounds below follow from the sleeps, and only grow if the machine is slow
+assert 0.01 <= summary['duration']['p50'] <= summary['duration']['p99'] and summary['duration']['p99'] >= 0.05
+assert summary['queue_wait']['p99'] >= 0.08 # The last tasks start after at least 80 tasks of 10ms have run on 10 slots
+assert round(sum(rate for _, rate in metrics.throughput(interval=0.05)) * 0.05) == 100
+
+# %%
+df = metrics.to_dataframe()
+assert len(df) == 100 and (df['finished_at'] >= df['started_at']).all()
+assert df.set_index('index').loc[7, 'outcome'] == 'failure'
+
+metrics_path = Path(tempfile.mkdtemp()) / 'metrics.jsonl'
+metrics.to_jsonl(metrics_path)
+assert [json.loads(line) for line in metrics_path.read_text().splitlines()] == df.to_dict('records')
+
+# %% [markdown]
+# With a thread or process pool, the queue wait includes the time the tasks spend waiting for a worker:
+
+# %%
+metrics = BatchMetrics()
+running = peak_running = 0
+lock = threading.Lock()
+
+def sleep_function(seconds):
+    global running, peak_running
+    with lock:
+        running += 1
+        peak_running = max(peak_running, running)
+    time.sleep(seconds)
+    with lock:
+        running -= 1
+
+await batch_executor(
+    sleep_function, batch_args=[(0.02,)] * 20, backend='thread', max_workers=2, metrics=metrics, verbose=False,
+)
+assert peak_running == metrics.capacity == 2
+# The 10th task to start waits until at least 8 tasks of 20ms have run on the 2 workers
+assert metrics.percentiles('queue_wait')['p50'] >= 0.08
+assert list(metrics.percentiles('duration', percentiles=[90, 99.9])) == ['p90', 'p99.9']
+
+# %% [markdown]
+# As the tasks of a chunk run one after the other, the capacity is the number of chunks that can run at once. It is
+# `concurrency_limit` if the size of a given executor is unknown:
+
+# %%
+metrics = BatchMetrics()
+running = peak_running = 0
+await batch_executor(
+    variable_function, batch_args=[(i,) for i in range(20)], concurrency_limit=2, chunk_size=5, on_error='return', metrics=metrics, verbose=False,
+)
+assert peak_running == metrics.capacity == 2 and metrics.utilization <= 1
+# Waiting for the previous tasks of the chunk, or for a whole chunk to finish
+assert metrics.percentiles('queue_wait')['p50'] >= 0.07
+
+metrics = BatchMetrics()
+with concurrent.futures.ThreadPoolExecutor(2) as executor:
+    await batch_executor(time.sleep, batch_args=[(0.01,)] * 4, backend=executor, concurrency_limit=3, metrics=metrics, verbose=False)
+assert metrics.capacity == 3
@@ -14,10 +14,12 @@ import nblite; from nblite import show_doc; nblite.nbl_export()
 #|export
 import diskcache
 from pathlib import Path
-from diskcache.core import ENOVAL, args_to_key, full_name
+from diskcache.core import ENOVAL, UNKNOWN, MODE_RAW, MODE_BINARY, args_to_key, full_name
 import functools as ft
 import asyncio
-from typing import Union
+import pickle
+import warnings
+from typing import Literal, Union
 from adulib.utils import check_mutual_exclusivity
 
 # %%
@@ -83,9 +85,159 @@ def _create_cache(cache_path:Union[Path,None]=None, temp:bool=False):
             raise ValueError("The default cache path is not set. Please set it using `set_default_cache_path`.")
         cache_path = _default_cache_path
     
-    return diskcache.Cache(cache_path, eviction_policy="none", size_limit=2**40)
+    return diskcache.Cache(cache_path, eviction_policy="none", size_limit=2**40, disk=CompressedDisk)
 
 
+# %% [markdown]
+# ## Compression
+#
+# All caches created by `adulib` use `CompressedDisk`, which can compress the pickled values before they are written. Compression is off by default, and can be turned on per cache using `set_cache_compression`. Compressed and uncompressed values can be mixed in the same cache.
+
+# %%
+#|exporti
+_COMPRESSED_MAGIC = b'\x00adulib-z'
+_CODEC_IDS = {'zlib': 1, 'zstd': 2, 'lz4': 3}
+_CODEC_NAMES = {codec_id: name for name, codec_id in _CODEC_IDS.items()}
+
+@ft.lru_cache(maxsize=None)
+def _load_codec(name: str):
+    "Returns the functions `(compress(data, level), decompress(data))` of a codec. Raises `ImportError` if the codec is not installed."
+    if name == 'zlib':
+        import zlib
+        return (lambda data, level: zlib.compress(data, 6 if level is None else level)), zlib.decompress
+    elif name == 'zstd':
+        import zstandard
+        return (
+            (lambda data, level: zstandard.ZstdCompressor(level=3 if level is None else level).compress(data)),
+            (lambda data: zstandard.ZstdDecompressor().decompress(data)),
+        )
+    elif name == 'lz4':
+        import lz4.frame
+        return (lambda data, level: lz4.frame.compress(data, compression_level=0 if level is None else level)), lz4.frame.decompress
+    raise ValueError(f"Unknown compression '{name}'. Must be one of {list(_CODEC_IDS)}.")
+
+
+# %%
+#|hide
+show_doc(this_module.CompressedDisk)
+
+
+# %%
+#|export
+class CompressedDisk(diskcache.Disk):
+    """
+    A `diskcache.Disk` that compresses pickled values with `zstd`, `lz4` or `zlib`.
+
+    Values whose pickle is smaller than `min_compress_size` bytes are stored as usual. If the `zstandard` or `lz4`
+    package is not installed, `zlib` is used instead. Compressed values are always decompressed on read, regardless
+    of the current `compression`.
+    """
+    def __init__(
+        self,
+        directory,
+        compression: Literal['zstd', 'lz4', 'zlib', None] = None,
+        compression_level: Union[int, None] = None,
+        min_compress_size: int = 1024,
+        **kwargs,
+    ):
+        super().__init__(directory, **kwargs)
+        self.compression = compression
+        self.compression_level = compression_level
+        self.min_compress_size = min_compress_size
+
+    @property
+    def compression(self) -> Union[str, None]:
+        return self._compression
+
+    @compression.setter
+    def compression(self, compression: Union[str, None]):
+        if compression is not None and compression not in _CODEC_IDS:
+            raise ValueError(f"Unknown compression '{compression}'. Must be one of {list(_CODEC_IDS)} or None.")
+        self._compression = compression
+        self._codec_name = compression
+        if compression is not None:
+            try:
+                _load_codec(compression)
+            except ImportError:
+                warnings.warn(f"The package for '{compression}' compression is not installed. Using 'zlib' instead.")
+                self._codec_name = 'zlib'
+
+    def store(self, value, read, key=UNKNOWN):
+        if self._codec_name is None or read:
+            return super().store(value, read, key)
+        data = pickle.dumps(value, protocol=self.pickle_protocol)
+        if len(data) < self.min_compress_size:
+            return super().store(value, read, key)
+        compress, _ = _load_codec(self._codec_name)
+        header = _COMPRESSED_MAGIC + bytes([_CODEC_IDS[self._codec_name]])
+        return super().store(header + compress(data, self.compression_level), read, key)
+
+    def fetch(self, mode, filename, value, read):
+        value = super().fetch(mode, filename, value, read)
+        if mode in (MODE_RAW, MODE_BINARY) and type(value) is bytes and value.startswith(_COMPRESSED_MAGIC):
+            codec_name = _CODEC_NAMES[value[len(_COMPRESSED_MAGIC)]]
+            _, decompress = _load_codec(codec_name)
+            return pickle.loads(decompress(value[len(_COMPRESSED_MAGIC)+1:]))
+        return value
+
+
+# %%
+#|hide
+show_doc(this_module.set_cache_compression)
+
+
+# %%
+#|export
+def set_cache_compression(
+    compression: Literal['zstd', 'lz4', 'zlib', None],
+    level: Union[int, None] = None,
+    cache: Union[Path, diskcache.Cache, None] = None,
+):
+    """
+    Set the compression of the values written to a cache (the default cache if `cache` is `None`).
+    Pass `None` to turn compression off.
+
+    The setting is stored in the cache directory, so it persists across sessions. Values that are already in
+    the cache are not recompressed.
+    """
+    if cache is None:
+        cache = get_default_cache()
+    elif isinstance(cache, diskcache.Cache):
+        pass # do nothing
+    else:
+        cache_path = cache
+        cache = get_cache(cache_path)
+    if not isinstance(cache.disk, CompressedDisk):
+        raise ValueError("The cache does not use `CompressedDisk`.")
+    cache.disk.compression = compression # Validates the compression before it is persisted
+    for key, value in [('disk_compression', compression), ('disk_compression_level', level)]:
+        # `Cache.reset` only updates settings that already exist in the Settings table
+        cache._sql_retry('INSERT OR REPLACE INTO Settings VALUES (?, ?)', (key, value))
+        cache.reset(key, value, update=False)
+
+
+# %%
+_value = {'text': "lorem ipsum " * 10_000}
+_uncompressed_cache = _create_cache(temp=True)
+_uncompressed_cache['value'] = _value
+_tmp_cache = _create_cache(temp=True)
+set_cache_compression('zlib', level=9, cache=_tmp_cache)
+_tmp_cache['compressed'] = _value
+_tmp_cache['small'] = 'small value'
+assert _tmp_cache['compressed'] == _uncompressed_cache['value'] == _value
+assert _tmp_cache['small'] == 'small value'
+assert _tmp_cache.volume() < _uncompressed_cache.volume() - 100_000
+
+# Values written before compression was turned on can still be read
+set_cache_compression('lz4', cache=_uncompressed_cache)
+_uncompressed_cache['compressed'] = _value
+assert _uncompressed_cache['value'] == _uncompressed_cache['compressed'] == _value
+
+# The setting persists when the cache is reopened
+_reopened_cache = _create_cache(_tmp_cache.directory)
+assert _reopened_cache.disk.compression == 'zlib' and _reopened_cache.disk.compression_level == 9
+assert _reopened_cache['compressed'] == _value
+
 # %%
 show_doc(this_module.get_default_cache)
 
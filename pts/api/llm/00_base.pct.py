@@ -10,10 +10,8 @@ import nblite; from nblite import show_doc; nblite.nbl_export()
 
 # %%
 #|export
-try:
-    import litellm
-except ImportError as e:
-    raise ImportError(f"Install adulib[llm] to use this API.") from e
+import functools
+from adulib.reflection import cached_mod_property
 
 # %%
 #|hide
@@ -25,16 +23,38 @@ import adulib.llm.base as this_module
 repo_path = nblite.config.get_project_root_and_config()[0]
 set_default_cache_path(repo_path / '.tmp_cache')
 
+
+# %%
+#|exporti
+@functools.cache
+def _get_available_models() -> list[str]:
+    try:
+        import litellm
+    except ImportError as e:
+        raise ImportError(f"Install adulib[llm] to use this API.") from e
+    models = list(litellm.model_cost.keys())
+    models.remove("sample_spec")
+    return models
+
+
+# %% [markdown]
+# `available_models` is a lazily evaluated module property, so that `litellm` is only imported once the list of models is first needed.
+
 # %%
 #|export
-available_models = list(litellm.model_cost.keys())
-available_models.remove("sample_spec")
+@cached_mod_property
+def available_models():
+    return _get_available_models()
+
+
+# %%
+assert 'gpt-4o' in this_module.available_models
 
 
 # %%
 #|export
 def search_models(query: str):
-    return [model for model in available_models if query.lower() in model.lower()]
+    return [model for model in _get_available_models() if query.lower() in model.lower()]
 
 
 # %%
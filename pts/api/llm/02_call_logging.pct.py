@@ -16,8 +16,10 @@ try:
     from typing import List, Optional, Union
     from pathlib import Path
     import json
-    from adulib.llm.base import available_models
-    from adulib.caching import get_cache
+    from adulib.llm.base import _get_available_models
+    from diskcache import ENOVAL
+    from adulib.llm.caching import _run_cache_io, _get_cache_record
+    import threading
     import uuid
 except ImportError as e:
     raise ImportError(f"Install adulib[llm] to use this API.") from e
@@ -141,23 +143,44 @@ def set_call_log_save_path(path: Path):
 
 # %%
 #|exporti
-def _log_call(cache_key, cache_path, **log_kwargs):
+_call_log_file_lock = threading.Lock()
+
+def _save_call_log_entry(call_log: CallLog):
+    if _call_log_save_path is not None:
+        with _call_log_file_lock, open(_call_log_save_path, 'a') as f:
+            f.write('\n' + call_log.model_dump_json())
+
+
+# %%
+#|exporti
+def _log_call(cache_key, cache_path, **log_kwargs) -> dict:
+    """
+    Records a new call log and returns it as a dict. Storing the call log in the cache (together with the result
+    of the call) is the responsibility of the caller, see `adulib.llm.caching._set_cache_record`.
+    """
     log_kwargs = {**log_kwargs, 'call_cache_key': cache_key, 'cache_path': Path(cache_path).as_posix()}
     call_log = CallLog(**log_kwargs)
     _call_logs.append(call_log)
-    if _call_log_save_path is not None:
-        with open(_call_log_save_path, 'a') as f:
-            f.write('\n' + call_log.model_dump_json())
-    
-    cache = get_cache(cache_path)
-    cache[('call_log', cache_key)] = call_log.model_dump()
+    _save_call_log_entry(call_log)
+    return call_log.model_dump()
+
+
+# %%
+#|exporti
+async def _async_log_call(cache_key, cache_path, **log_kwargs) -> dict:
+    "Like `_log_call`, but appends to the call log file in the cache I/O thread pool."
+    log_kwargs = {**log_kwargs, 'call_cache_key': cache_key, 'cache_path': Path(cache_path).as_posix()}
+    call_log = CallLog(**log_kwargs)
+    _call_logs.append(call_log)
+    await _run_cache_io(_save_call_log_entry, call_log)
+    return call_log.model_dump()
 
 
 # %%
 #|export
 def get_cached_call_log(cache_key, cache_path):
-    cache = get_cache(cache_path)
-    return cache.get(('call_log', cache_key), None)
+    record = _get_cache_record(cache_key, cache_path)
+    return record[1] if record is not ENOVAL else None
 
 
 # %%
@@ -165,7 +188,7 @@ def get_cached_call_log(cache_key, cache_path):
 def get_call_logs(model: Optional[str]=None) -> List[CallLog]:
     _filtered_logs = _call_logs
     if model is not None:
-        if model not in available_models:
+        if model not in _get_available_models():
             raise ValueError(f"Model '{model}' not found in available models")
         _filtered_logs = [c for c in _filtered_logs if c.model == model]
     return _filtered_logs
@@ -12,10 +12,22 @@ import nblite; from nblite import show_doc; nblite.nbl_export()
 #|export
 try:
     from pathlib import Path
-    from typing import Dict, Union, Callable, Coroutine
+    from typing import Dict, Literal, Optional, Union, Callable, Coroutine
     from adulib.caching import get_cache, clear_cache_key, is_in_cache, get_default_cache
     from diskcache import ENOVAL
+    from litellm import EmbeddingResponse
+    from concurrent.futures import ThreadPoolExecutor
+    import functools
+    import asyncio
+    import ast
+    import hashlib
+    import itertools
+    import json
     import re
+    import threading
+    import warnings
+    import weakref
+    import numpy as np
 except ImportError as e:
     raise ImportError(f"Install adulib[llm] to use this API.") from e
 
@@ -46,54 +58,717 @@ assert _is_obj_str("  <Foo at 0x120f36b10> <pkg.subpkg.Mod.Class object at 0xDEA
 assert _is_obj_str("  <Foo at 0x120f36b10>  ")
 assert not _is_obj_str("<__main__.Foo at xyz>")                  
 
+# %% [markdown]
+# Cache keys are tuples of the form `('adulib.llm', func_name, key_prefix, model, content)`. By default, the content of the call (e.g. the messages and the response format) is serialized to a canonical form and hashed with BLAKE2b, so that the keys have a constant size (and the size of the cache index and the cost of lookups do not grow with the length of the prompt), and do not depend on the order of dict entries. The `'readable'` key format instead stores the `repr` of the content in the key, which was the only format in earlier versions of `adulib`.
+#
+# So that caches created with earlier versions of `adulib` keep working, the corresponding `'readable'` key is looked up when a key is not in the cache, and records found under it are moved to the hashed key. The keys of a cache are scanned for readable keys once per process, so that caches without them do not pay for building the readable key on every cache miss. If a cache contains readable keys, a warning recommends converting them once using `rekey_cache_records`. The lookup can be disabled using `set_cache_key_format('hashed', legacy_lookup=False)`.
+
+# %%
+#|export
+default_cache_key_format: Literal['hashed', 'readable'] = 'hashed'
+default_legacy_cache_key_lookup = True
+
+# %%
+#|hide
+show_doc(this_module.set_cache_key_format)
+
+
+# %%
+#|export
+def set_cache_key_format(key_format: Literal['hashed', 'readable'], legacy_lookup: bool = True):
+    """
+    Set the format of the cache keys of LLM calls. If `legacy_lookup` is True and the format is `'hashed'`,
+    cache misses fall back to looking up the `'readable'` key in caches that contain readable keys (i.e. that have
+    not been converted with `rekey_cache_records`).
+    """
+    global default_cache_key_format, default_legacy_cache_key_lookup
+    if key_format not in ('hashed', 'readable'):
+        raise ValueError(f"Invalid cache key format '{key_format}'. Must be 'hashed' or 'readable'.")
+    default_cache_key_format = key_format
+    default_legacy_cache_key_lookup = legacy_lookup
+
+
+# %%
+#|exporti
+def _canonical_json_default(obj):
+    if isinstance(obj, type) and hasattr(obj, 'model_json_schema'): # Pydantic models, e.g. as `response_format`
+        return {'pydantic_schema': obj.model_json_schema()}
+    if hasattr(obj, 'model_dump'): # Pydantic model instances
+        return obj.model_dump(mode='json')
+    obj_repr = repr(obj)
+    if _is_obj_str(obj_repr):
+        raise ValueError(f"Cache key contains object string: {obj_repr}")
+    return obj_repr
+
+def _dict_item_sort_key(item) -> tuple:
+    key = item[0]
+    return (type(key).__name__, key if isinstance(key, str) else repr(key))
+
+def _update_content_hash(h, obj):
+    """
+    Feeds a canonical serialization of `obj` to the hash `h`. Every value is tagged with its type, so that e.g. tuples
+    and lists, or `1` and `'1'` as dict keys, are kept apart. Strings are fed as is (prefixed with their length) rather
+    than escaped as in JSON, so that the cost of hashing a long prompt is dominated by the hash function itself.
+    """
+    if isinstance(obj, str):
+        data = obj.encode('utf-8', 'surrogatepass')
+        h.update(b's%d:' % len(data))
+        h.update(data)
+    elif obj is None or isinstance(obj, (bool, int, float)):
+        h.update(f"{type(obj).__name__}:{obj!r};".encode())
+    elif isinstance(obj, dict):
+        h.update(b'{')
+        for key, value in sorted(obj.items(), key=_dict_item_sort_key):
+            _update_content_hash(h, key)
+            _update_content_hash(h, value)
+        h.update(b'}')
+    elif isinstance(obj, (list, tuple)):
+        h.update(b'[' if isinstance(obj, list) else b'(')
+        for value in obj:
+            _update_content_hash(h, value)
+        h.update(b']' if isinstance(obj, list) else b')')
+    elif isinstance(obj, (set, frozenset)):
+        h.update(b'<')
+        for value in sorted(obj, key=lambda v: (type(v).__name__, repr(v))):
+            _update_content_hash(h, value)
+        h.update(b'>')
+    else: # e.g. pydantic models, which are hashed by their schema or contents
+        h.update(b'o')
+        _update_content_hash(h, _canonical_json_default(obj))
+
+def _hash_content(content) -> str:
+    "Hashes a canonical serialization of `content`, which does not depend on the order of dict entries."
+    h = hashlib.blake2b(digest_size=16)
+    _update_content_hash(h, content)
+    return 'blake2b:' + h.hexdigest()
+
 
 # %%
 #|export
 def get_cache_key(
-    model: str, func_name, content: any, key_prefix: Union[str, None]=None, include_model_in_cache_key: bool=True
+    model: str, func_name, content: any, key_prefix: Union[str, None]=None, include_model_in_cache_key: bool=True,
+    key_format: Optional[Literal['hashed', 'readable']]=None,
 ) -> tuple:
-    cache_key_tuple = ('adulib.llm', func_name, key_prefix, model if include_model_in_cache_key else '', content)
-    cache_key_tuple = tuple(
-        str(item) if isinstance(item, (str, int, float, bool)) else repr(item) for item in cache_key_tuple
-    )
-    if any(_is_obj_str(item) for item in cache_key_tuple):
-        raise ValueError(f"Cache key contains object string: {cache_key_tuple}")
+    """
+    Returns the cache key of an LLM call. `key_format` defaults to `default_cache_key_format` (see `set_cache_key_format`).
+    """
+    if key_format is None: key_format = default_cache_key_format
+    cache_key_tuple = ('adulib.llm', func_name, key_prefix, model if include_model_in_cache_key else '')
+    if key_format == 'hashed':
+        cache_key_tuple = tuple(
+            str(item) if isinstance(item, (str, int, float, bool)) else repr(item) for item in cache_key_tuple
+        ) + (_hash_content(content),)
+    elif key_format == 'readable':
+        cache_key_tuple = tuple(
+            str(item) if isinstance(item, (str, int, float, bool)) else repr(item) for item in cache_key_tuple + (content,)
+        )
+        if any(_is_obj_str(item) for item in cache_key_tuple):
+            raise ValueError(f"Cache key contains object string: {cache_key_tuple}")
+    else:
+        raise ValueError(f"Invalid cache key format '{key_format}'. Must be 'hashed' or 'readable'.")
     return cache_key_tuple
 
 
 # %%
 #|exporti
-def _cache_execute(
-    cache_key: tuple,
-    execute_func: Callable,
-    cache_enabled: bool=True,
-    cache_path: Union[str, Path, None]=None,
-):
-    if not cache_enabled: return execute_func()
-    cache = get_cache(cache_path) if cache_path is not None else get_default_cache()
-    result = cache.get(cache_key, default=ENOVAL, retry=True)
-    retrieved_from_cache = True
-    if result is ENOVAL:
-        result = execute_func()
-        cache.set(cache_key, result)
-        retrieved_from_cache = False
-    return retrieved_from_cache, result
+def _get_legacy_cache_key_func(
+    model: str, func_name, content: any, key_prefix: Union[str, None]=None, include_model_in_cache_key: bool=True,
+) -> Optional[Callable[[], tuple]]:
+    "Returns a function that builds the readable cache key to fall back on, or `None` if there is no fallback."
+    if default_cache_key_format != 'hashed' or not default_legacy_cache_key_lookup: return None
+    return lambda: get_cache_key(model, func_name, content, key_prefix, include_model_in_cache_key, key_format='readable')
+
+
+# %%
+from pydantic import BaseModel
+
+class Answer(BaseModel):
+    answer: str
+
+messages = [{'role': 'user', 'content': 'What is the capital of France?'}]
+key = get_cache_key('gpt-4o-mini', 'completion', {'messages': messages, 'response_format': Answer})
+assert key[:4] == ('adulib.llm', 'completion', 'None', 'gpt-4o-mini')
+assert key[4].startswith('blake2b:')
+
+# Keys do not depend on the order of dict entries
+assert key == get_cache_key('gpt-4o-mini', 'completion', {'response_format': Answer, 'messages': [{'content': messages[0]['content'], 'role': 'user'}]})
+assert key != get_cache_key('gpt-4o-mini', 'completion', {'messages': messages})
+
+assert get_cache_key('gpt-4o-mini', 'completion', {'messages': messages}, key_format='readable') == \
+    ('adulib.llm', 'completion', 'None', 'gpt-4o-mini', repr({'messages': messages}))
+
+try:
+    get_cache_key('gpt-4o-mini', 'completion', {'messages': messages, 'obj': object()})
+    assert False
+except ValueError:
+    pass
+
+# Values that JSON would conflate get different keys, and dicts with keys of mixed types can be hashed
+assert get_cache_key('m', 'f', {'stop': ('a', 'b')}) != get_cache_key('m', 'f', {'stop': ['a', 'b']})
+assert get_cache_key('m', 'f', {'logit_bias': {1: 2}}) != get_cache_key('m', 'f', {'logit_bias': {'1': 2}})
+assert get_cache_key('m', 'f', {'logit_bias': {1: 2, 'a': 3}}) == get_cache_key('m', 'f', {'logit_bias': {'a': 3, 1: 2}})
+assert get_cache_key('m', 'f', {'ids': {1, 'a'}}) == get_cache_key('m', 'f', {'ids': {'a', 1}}) != get_cache_key('m', 'f', {'ids': [1, 'a']})
+
+# %% [markdown]
+# The content of the cache key of an LLM call consists of all the arguments of the call except the model, which is part of the key itself, so that e.g. calls with different `tools`, `max_tokens` or `dimensions` do not share their results. The sync and async LLM functions use the same content, so that e.g. `completion` and `async_completion` share their cache entries.
+#
+# The parameters in `default_cache_key_exclude_params` are left out of the content: the sampling parameters `temperature` and `top_p`, and parameters that do not affect the result (e.g. `timeout` and `api_key`). The exclusions can be changed using `set_default_cache_key_exclude_params`, and excluded parameters can be added back per call using the `cache_key_params` argument of the LLM functions, or for all calls using `set_default_cache_key_params`.
+
+# %%
+#|export
+default_cache_key_exclude_params: list[str] = [
+    'temperature', 'top_p', 'timeout', 'num_retries', 'api_key', 'api_base', 'base_url', 'api_version', 'extra_headers', 'metadata',
+]
+default_cache_key_params: list[str] = []
+
+# %%
+#|hide
+show_doc(this_module.set_default_cache_key_exclude_params)
+
+
+# %%
+#|export
+def set_default_cache_key_exclude_params(params: list[str]):
+    """
+    Set the parameters of LLM calls that are left out of their cache keys (see `default_cache_key_exclude_params`).
+    """
+    global default_cache_key_exclude_params
+    default_cache_key_exclude_params = list(params)
+
+
+# %%
+#|hide
+show_doc(this_module.set_default_cache_key_params)
+
+
+# %%
+#|export
+def set_default_cache_key_params(params: list[str]):
+    """
+    Set the parameters of LLM calls (e.g. `['temperature']`) that are included in their cache keys, even though
+    they are in `default_cache_key_exclude_params`.
+    """
+    global default_cache_key_params
+    default_cache_key_params = list(params)
 
 
 # %%
 #|exporti
-async def _async_cache_execute(
-    cache_key: tuple,
-    execute_func: Callable,
-    cache_enabled: bool=True,
+_cache_key_content_args: Dict[str, list[str]] = {}
+
+def _register_cache_key_content_args(func_cache_name: str, cache_key_content_args: list[str]):
+    "Records the content args of the LLM function `func_cache_name`, so that `rekey_cache_records` can derive its cache keys."
+    _cache_key_content_args[func_cache_name] = list(cache_key_content_args)
+
+def _get_cache_key_content(func_args_and_kwargs: dict, cache_key_content_args: list[str], cache_key_params: Optional[list[str]]=None) -> dict:
+    "The content args come first, followed by the other arguments sorted by name, so that readable keys are stable."
+    if cache_key_params is None: cache_key_params = default_cache_key_params
+    excluded = set(default_cache_key_exclude_params).difference(cache_key_params)
+    content = {k: func_args_and_kwargs[k] for k in cache_key_content_args if k in func_args_and_kwargs}
+    for k in sorted(func_args_and_kwargs):
+        if k not in content and k != 'model' and k not in excluded:
+            content[k] = func_args_and_kwargs[k]
+    return content
+
+
+# %%
+func_args = {'model': 'gpt-4o-mini', 'messages': messages, 'temperature': 0.5}
+assert _get_cache_key_content(func_args, ['messages', 'response_format']) == {'messages': messages}
+assert _get_cache_key_content(func_args, ['messages', 'response_format'], ['temperature']) == {'messages': messages, 'temperature': 0.5}
+
+# All other arguments that change the result are part of the content
+tools = [{'type': 'function', 'function': {'name': 'get_weather', 'parameters': {'type': 'object', 'properties': {}}}}]
+for params in [{'max_tokens': 5}, {'max_tokens': 500}, {'tools': tools, 'tool_choice': 'auto'}, {'n': 3}, {'stop': ['\n']}, {'seed': 1}, {'logprobs': True}]:
+    content = _get_cache_key_content({**func_args, **params, 'timeout': 10}, ['messages', 'response_format'])
+    assert content == {'messages': messages, **params}
+keys = {
+    get_cache_key('gpt-4o-mini', 'completion', _get_cache_key_content({**func_args, **params}, ['messages', 'response_format']))
+    for params in [{}, {'max_tokens': 5}, {'max_tokens': 500}, {'max_tokens': 500, 'tools': tools, 'n': 3}, {'stop': ['\n']}, {'seed': 1}]
+}
+assert len(keys) == 6
+embedding_keys = {
+    get_cache_key('text-embedding-3-small', 'embedding', _get_cache_key_content({'input': ['hi'], **params}, ['input']))
+    for params in [{}, {'dimensions': 256}, {'encoding_format': 'base64'}]
+}
+assert len(embedding_keys) == 3
+
+# %% [markdown]
+# Both key formats are built in time linear in the length of the prompt, but only the readable keys grow with it. Hashed keys are also cheaper to build, as the strings of the content are fed to the hash function as is, without escaping or copying them:
+
+# %%
+#|hide
+import time
+
+long_messages = [{'role': 'user', 'content': "lorem ipsum dolor sit amet " * 20_000}] # About 500k characters
+for key_format in ['readable', 'hashed']:
+    t0 = time.perf_counter()
+    for _ in range(20):
+        key = get_cache_key('gpt-4o-mini', 'completion', {'messages': long_messages}, key_format=key_format)
+    elapsed = (time.perf_counter() - t0) / 20
+    print(f"{key_format}: {elapsed*1000:.2f}ms per key, {len(''.join(key))} characters")
+
+# %% [markdown]
+# The result of an LLM call and its call log are stored together as a single versioned record under the call's cache key, so that a cache hit costs a single cache read. Entries written by older versions of `adulib` (where the raw result is stored under the cache key and the call log under `('call_log', cache_key)`) are migrated to the new format when they are first read, or in bulk using `migrate_cache_records`.
+
+# %%
+#|exporti
+_CACHE_RECORD_VERSION = 2
+_CACHE_RECORD_MARKER = 'adulib.llm.cache_record'
+
+def _make_cache_record(result, call_log: Union[dict, None]) -> dict:
+    record = {_CACHE_RECORD_MARKER: _CACHE_RECORD_VERSION, 'result': result, 'call_log': call_log}
+    packed_embeddings = _pack_embeddings(result)
+    if packed_embeddings is not None:
+        record['result'], record['packed_embeddings'] = packed_embeddings
+    return record
+
+def _is_cache_record(value) -> bool:
+    return type(value) == dict and _CACHE_RECORD_MARKER in value
+
+def _read_cache_record(record: dict) -> tuple:
+    "Returns the tuple `(result, call_log)` of a cache record."
+    result = record['result']
+    if record.get('packed_embeddings') is not None:
+        result = _unpack_embeddings(result, record['packed_embeddings'])
+    return result, record['call_log']
+
+
+# %% [markdown]
+# Embeddings make up most of the size of an embedding cache. Pickled as lists of Python floats, they take up about 9 bytes per dimension, so the embeddings of an `EmbeddingResponse` are instead stored as a packed little-endian array of `default_embedding_cache_dtype` (4 bytes per dimension for `'float32'`, which is the precision the providers compute them in, and 2 bytes for `'float16'`). Records with list embeddings, e.g. those written by earlier versions of `adulib`, are read as usual.
+
+# %%
+#|export
+default_embedding_cache_dtype: Optional[Literal['float32', 'float16']] = 'float32'
+
+# %%
+#|hide
+show_doc(this_module.set_embedding_cache_dtype)
+
+
+# %%
+#|export
+def set_embedding_cache_dtype(dtype: Optional[Literal['float32', 'float16']]):
+    """
+    Set the dtype in which embeddings are stored in the cache. Pass `None` to store them as lists of Python floats.
+    """
+    global default_embedding_cache_dtype
+    if dtype is not None and dtype not in _EMBEDDING_DTYPES:
+        raise ValueError(f"Invalid dtype '{dtype}'. Must be one of {list(_EMBEDDING_DTYPES)} or None.")
+    default_embedding_cache_dtype = dtype
+
+
+# %%
+#|exporti
+_EMBEDDING_DTYPES = {'float32': np.dtype('<f4'), 'float16': np.dtype('<f2')}
+
+def _replace_embedding(item, embedding):
+    return {**item, 'embedding': embedding} if type(item) == dict else item.model_copy(update={'embedding': embedding})
+
+def _pack_embeddings(result):
+    """
+    Returns the tuple `(result, packed_embeddings)`, where the embeddings of `result` have been moved to `packed_embeddings`,
+    or `None` if `result` is not an `EmbeddingResponse` with list embeddings.
+    """
+    dtype = default_embedding_cache_dtype
+    if dtype is None or not isinstance(result, EmbeddingResponse) or not result.data: return None
+    embeddings = [item['embedding'] for item in result.data]
+    if any(type(embedding) != list for embedding in embeddings): return None # e.g. base64-encoded embeddings
+    dims = [len(embedding) for embedding in embeddings]
+    data = np.fromiter(itertools.chain.from_iterable(embeddings), dtype=_EMBEDDING_DTYPES[dtype], count=sum(dims)).tobytes()
+    packed_result = result.model_copy(update={'data': [_replace_embedding(item, None) for item in result.data]})
+    return packed_result, {'dtype': dtype, 'dims': dims, 'data': data}
+
+def _unpack_embeddings(result, packed_embeddings: dict):
+    dims = packed_embeddings['dims']
+    values = np.frombuffer(packed_embeddings['data'], dtype=_EMBEDDING_DTYPES[packed_embeddings['dtype']]).tolist()
+    offsets = list(itertools.accumulate(dims, initial=0))
+    data = [_replace_embedding(item, values[start:end]) for item, start, end in zip(result.data, offsets, offsets[1:])]
+    return result.model_copy(update={'data': data})
+
+
+# %%
+import litellm
+
+_embedding_response = litellm.embedding(model="text-embedding-3-small", input="foo", mock_response=[0.1, -0.25, 3.0])
+_record = _make_cache_record(_embedding_response, None)
+assert len(_record['packed_embeddings']['data']) == 3 * 4
+assert _record['result'].data[0]['embedding'] is None
+assert _embedding_response.data[0]['embedding'] == [0.1, -0.25, 3.0] # The response itself is not modified
+_result, _ = _read_cache_record(_record)
+assert _result.data[0]['embedding'] == np.array([0.1, -0.25, 3.0], dtype=np.float32).tolist()
+
+set_embedding_cache_dtype('float16')
+_record = _make_cache_record(_embedding_response, None)
+assert len(_record['packed_embeddings']['data']) == 3 * 2
+assert _read_cache_record(_record)[0].data[0]['embedding'] == [0.0999755859375, -0.25, 3.0]
+set_embedding_cache_dtype(None)
+assert 'packed_embeddings' not in _make_cache_record(_embedding_response, None)
+set_embedding_cache_dtype('float32')
+
+
+# %%
+#|exporti
+def _get_llm_cache(cache_path: Union[str, Path, None]=None):
+    return get_cache(cache_path) if cache_path is not None else get_default_cache()
+
+
+# %%
+#|exporti
+_readable_keys_in_cache: Dict[str, bool] = {} # Whether a cache (by directory) contains readable keys
+
+def _is_readable_key(key) -> bool:
+    return type(key) == tuple and len(key) == 5 and key[0] == 'adulib.llm' and not str(key[4]).startswith('blake2b:')
+
+def _has_readable_keys(cache) -> bool:
+    "Whether `cache` contains records under readable keys. The keys are scanned once per cache and process."
+    has_readable_keys = _readable_keys_in_cache.get(cache.directory)
+    if has_readable_keys is None:
+        has_readable_keys = any(_is_readable_key(key) for key in cache.iterkeys())
+        _readable_keys_in_cache[cache.directory] = has_readable_keys
+        if has_readable_keys:
+            warnings.warn(
+                f"The LLM cache at '{cache.directory}' contains records under readable cache keys, which are looked up "
+                "on every cache miss. Convert them once using `adulib.llm.rekey_cache_records`."
+            )
+    return has_readable_keys
+
+
+# %%
+#|exporti
+def _migrate_legacy_cache_entry(cache, cache_key: tuple, value) -> dict:
+    "Converts a legacy cache entry (the raw result, with the call log stored under a separate key) to a cache record."
+    call_log_key = ('call_log', cache_key)
+    record = _make_cache_record(value, cache.get(call_log_key, None, retry=True))
+    cache.set(cache_key, record, retry=True)
+    cache.delete(call_log_key, retry=True)
+    return record
+
+
+# %%
+#|exporti
+def _get_cache_record(cache_key: tuple, cache_path: Union[str, Path, None]=None, legacy_cache_key_func: Optional[Callable[[], tuple]]=None):
+    """
+    Returns the tuple `(result, call_log)` stored under `cache_key`, or `ENOVAL` if the key is not in the cache.
+
+    If the key is not in the cache and `legacy_cache_key_func` is given, the key it returns is looked up instead, and
+    a record found under it is moved to `cache_key`.
+    """
+    cache = _get_llm_cache(cache_path)
+    value = cache.get(cache_key, default=ENOVAL, retry=True)
+    if value is ENOVAL:
+        if legacy_cache_key_func is None or not _has_readable_keys(cache): return ENOVAL
+        legacy_cache_key = legacy_cache_key_func()
+        if legacy_cache_key == cache_key: return ENOVAL
+        value = cache.get(legacy_cache_key, default=ENOVAL, retry=True)
+        if value is ENOVAL: return ENOVAL
+        record = value if _is_cache_record(value) else _migrate_legacy_cache_entry(cache, legacy_cache_key, value)
+        if record['call_log'] is not None:
+            record['call_log'] = {**record['call_log'], 'call_cache_key': cache_key}
+        cache.set(cache_key, record, retry=True)
+        cache.delete(legacy_cache_key, retry=True)
+        return _read_cache_record(record)
+    record = value if _is_cache_record(value) else _migrate_legacy_cache_entry(cache, cache_key, value)
+    return _read_cache_record(record)
+
+
+# %%
+#|exporti
+def _set_cache_record(cache_key: tuple, result, call_log: Union[dict, None], cache_path: Union[str, Path, None]=None):
+    cache = _get_llm_cache(cache_path)
+    cache.set(cache_key, _make_cache_record(result, call_log), retry=True)
+
+
+# %%
+#|hide
+show_doc(this_module.migrate_cache_records)
+
+
+# %%
+#|export
+def migrate_cache_records(cache_path: Union[str, Path, None]=None) -> int:
+    """
+    Migrates all legacy `adulib.llm` cache entries in a cache to the current record format.
+    Returns the number of migrated entries.
+    """
+    cache = _get_llm_cache(cache_path)
+    num_migrated = 0
+    for key in list(cache.iterkeys()):
+        if not (type(key) == tuple and len(key) > 0 and key[0] == 'adulib.llm'): continue
+        value = cache.get(key, default=ENOVAL, retry=True)
+        if value is ENOVAL or _is_cache_record(value): continue
+        _migrate_legacy_cache_entry(cache, key, value)
+        num_migrated += 1
+    return num_migrated
+
+
+# %%
+#|hide
+import tempfile
+_tmp_cache_path = tempfile.mkdtemp()
+_legacy_key = get_cache_key('foo', 'completion', 'legacy')
+get_cache(_tmp_cache_path)[_legacy_key] = 'legacy result'
+get_cache(_tmp_cache_path)[('call_log', _legacy_key)] = {'cost': 0}
+
+assert migrate_cache_records(_tmp_cache_path) == 1
+assert migrate_cache_records(_tmp_cache_path) == 0
+assert _get_cache_record(_legacy_key, _tmp_cache_path) == ('legacy result', {'cost': 0})
+assert ('call_log', _legacy_key) not in get_cache(_tmp_cache_path)
+
+_set_cache_record(_legacy_key, 'new result', None, _tmp_cache_path)
+assert _get_cache_record(_legacy_key, _tmp_cache_path) == ('new result', None)
+assert _get_cache_record(get_cache_key('foo', 'completion', 'missing'), _tmp_cache_path) is ENOVAL
+
+# Caches without readable keys do not build the readable key on cache misses
+def _unexpected_legacy_cache_key_func():
+    raise AssertionError("The readable key should not be built.")
+assert _get_cache_record(get_cache_key('foo', 'completion', 'missing'), _tmp_cache_path, _unexpected_legacy_cache_key_func) is ENOVAL
+
+# Records stored under readable keys are found and moved to the hashed keys, with a warning to convert the cache
+_tmp_cache_path = tempfile.mkdtemp()
+_readable_key = get_cache_key('foo', 'completion', 'readable', key_format='readable')
+_set_cache_record(_readable_key, 'readable result', {'call_cache_key': _readable_key}, _tmp_cache_path)
+_hashed_key = get_cache_key('foo', 'completion', 'readable')
+assert _get_cache_record(_hashed_key, _tmp_cache_path) is ENOVAL
+with warnings.catch_warnings(record=True) as caught_warnings:
+    warnings.simplefilter("always")
+    assert _get_cache_record(_hashed_key, _tmp_cache_path, _get_legacy_cache_key_func('foo', 'completion', 'readable')) == ('readable result', {'call_cache_key': _hashed_key})
+assert len(caught_warnings) == 1 and 'rekey_cache_records' in str(caught_warnings[0].message)
+assert _readable_key not in get_cache(_tmp_cache_path)
+assert _get_cache_record(_hashed_key, _tmp_cache_path) == ('readable result', {'call_cache_key': _hashed_key})
+
+# %% [markdown]
+# The size and read latency of realistic cache records, depending on the compression of the cache (see `adulib.caching.set_cache_compression`) and on `default_embedding_cache_dtype`:
+
+# %%
+#|hide
+import random
+import time
+from adulib.caching import set_cache_compression
+from litellm import ModelResponse
+from litellm.types.utils import Embedding
+
+_completion_response = ModelResponse(
+    model="gpt-4o-mini",
+    choices=[{'message': {'role': 'assistant', 'content': " ".join(random.choice(["the", "cache", "model", "response", "of", "a"]) for _ in range(800))}}],
+    usage={'prompt_tokens': 1000, 'completion_tokens': 800, 'total_tokens': 1800},
+)
+_embedding_response = EmbeddingResponse(
+    model="text-embedding-3-small",
+    data=[Embedding(embedding=[random.gauss(0, 0.025) for _ in range(1536)], index=i, object='embedding') for i in range(100)],
+)
+
+def _benchmark_cache_record(result, compression, dtype, num_reads=10):
+    set_embedding_cache_dtype(dtype)
+    cache_path = tempfile.mkdtemp()
+    set_cache_compression(compression, cache=cache_path)
+    get_cache(cache_path).reset('disk_min_file_size', 0) # Store the value in a file, to measure its size
+    _set_cache_record(('benchmark',), result, None, cache_path)
+    size = sum(path.stat().st_size for path in Path(cache_path).rglob('*.val'))
+    t0 = time.perf_counter()
+    for _ in range(num_reads):
+        _get_cache_record(('benchmark',), cache_path)
+    return size, (time.perf_counter() - t0) / num_reads
+
+for name, result, dtypes in [('completion', _completion_response, [None]), ('embeddings', _embedding_response, [None, 'float32', 'float16'])]:
+    for compression in [None, 'zlib', 'zstd', 'lz4']:
+        for dtype in dtypes:
+            size, read_time = _benchmark_cache_record(result, compression, dtype)
+            print(f"{name}, compression={compression}, dtype={dtype}: {size/1024:.1f}KiB, {read_time*1000:.2f}ms per read")
+set_embedding_cache_dtype('float32')
+
+# %% [markdown]
+# Earlier versions of `adulib` used readable cache keys, and the sync LLM functions included all arguments of a call in their keys, so that e.g. `completion` and `async_completion` did not share their cache entries. `rekey_cache_records` moves all entries stored under readable keys to the current keys. Entries that end up under the same key are merged.
+
+# %%
+#|hide
+show_doc(this_module.rekey_cache_records)
+
+
+# %%
+#|export
+def rekey_cache_records(
     cache_path: Union[str, Path, None]=None,
-):
-    if not cache_enabled: return execute_func()
-    cache = get_cache(cache_path) if cache_path is not None else get_default_cache()
-    result = cache.get(cache_key, default=ENOVAL, retry=True)
-    retrieved_from_cache = True
-    if result is ENOVAL:
+    cache_key_params: Optional[list[str]]=None,
+    dry_run: bool=False,
+) -> Dict[str, int]:
+    """
+    Moves the LLM cache entries stored under readable cache keys to the keys that the LLM functions currently use.
+    Entries that map to the same key are merged, keeping the entry that is already stored under it. Entries whose
+    content can not be parsed (e.g. that of a call with a pydantic `response_format`), or that belong to an unknown
+    LLM function, are skipped.
+
+    Args:
+        cache_path: The path of the cache. Defaults to the default cache.
+        cache_key_params: The parameters to include in the new keys, see `set_default_cache_key_params`.
+        dry_run: If True, only counts the entries that would be rekeyed.
+
+    Returns:
+        dict: The number of `'rekeyed'`, `'merged'` and `'skipped'` entries.
+    """
+    # Imported here, as the LLM functions register their cache key content args when they are created
+    import adulib.llm.completions, adulib.llm.text_completions, adulib.llm.embeddings
+
+    cache = _get_llm_cache(cache_path)
+    counts = {'rekeyed': 0, 'merged': 0, 'skipped': 0}
+    new_keys = set()
+    for key in list(cache.iterkeys()):
+        if not (type(key) == tuple and len(key) == 5 and key[0] == 'adulib.llm'): continue
+        _, func_name, key_prefix, model, content_repr = key
+        if content_repr.startswith('blake2b:'): continue
+        try:
+            func_args_and_kwargs = ast.literal_eval(content_repr)
+        except (ValueError, SyntaxError):
+            func_args_and_kwargs = None
+        if type(func_args_and_kwargs) != dict or func_name not in _cache_key_content_args:
+            counts['skipped'] += 1
+            continue
+        variadic_kwargs = func_args_and_kwargs.pop('kwargs', {})
+        func_args_and_kwargs = {**func_args_and_kwargs, **variadic_kwargs}
+        content = _get_cache_key_content(func_args_and_kwargs, _cache_key_content_args[func_name], cache_key_params)
+        new_key = get_cache_key(
+            model, func_name, content, None if key_prefix == 'None' else key_prefix, include_model_in_cache_key=model != '',
+        )
+        if new_key == key: continue
+        merge = new_key in new_keys or new_key in cache
+        new_keys.add(new_key)
+        counts['merged' if merge else 'rekeyed'] += 1
+        if dry_run: continue
+        if not merge:
+            value = cache.get(key, default=ENOVAL, retry=True)
+            record = value if _is_cache_record(value) else _migrate_legacy_cache_entry(cache, key, value)
+            if record['call_log'] is not None:
+                record['call_log'] = {**record['call_log'], 'call_cache_key': new_key}
+            cache.set(new_key, record, retry=True)
+        cache.delete(key, retry=True)
+        cache.delete(('call_log', key), retry=True)
+    if not dry_run:
+        _readable_keys_in_cache.pop(cache.directory, None) # Rescanned on the next lookup
+    return counts
+
+
+# %% [markdown]
+# In the async API, cache I/O (synchronous SQLite reads and file writes in `diskcache`) is offloaded to a bounded thread pool, so that the event loop is not stalled under many concurrent calls.
+
+# %%
+#|export
+default_cache_io_max_workers = 8
+
+# %%
+#|exporti
+_cache_io_executor: Union[ThreadPoolExecutor, None] = None
+
+def _get_cache_io_executor() -> ThreadPoolExecutor:
+    global _cache_io_executor
+    if _cache_io_executor is None:
+        _cache_io_executor = ThreadPoolExecutor(max_workers=default_cache_io_max_workers, thread_name_prefix="adulib-cache-io")
+    return _cache_io_executor
+
+
+# %%
+#|export
+def set_cache_io_max_workers(max_workers: int):
+    """
+    Set the maximum number of threads used for cache I/O in the async API.
+    """
+    global default_cache_io_max_workers, _cache_io_executor
+    default_cache_io_max_workers = max_workers
+    if _cache_io_executor is not None:
+        _cache_io_executor.shutdown(wait=False)
+        _cache_io_executor = None
+
+
+# %%
+#|exporti
+async def _run_cache_io(func: Callable, *args, **kwargs):
+    "Runs a blocking cache operation in the cache I/O thread pool."
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_cache_io_executor(), functools.partial(func, *args, **kwargs))
+
+
+# %%
+#|exporti
+async def _async_get_cache_record(cache_key: tuple, cache_path: Union[str, Path, None]=None, legacy_cache_key_func: Optional[Callable[[], tuple]]=None):
+    return await _run_cache_io(_get_cache_record, cache_key, cache_path, legacy_cache_key_func)
+
+async def _async_set_cache_record(cache_key: tuple, result, call_log: Union[dict, None], cache_path: Union[str, Path, None]=None):
+    await _run_cache_io(_set_cache_record, cache_key, result, call_log, cache_path)
+
+
+# %%
+#|exporti
+# The in-flight calls of each event loop. The futures of a loop can only be awaited on that loop, so that calls on
+# different loops (e.g. in the worker threads of `batch_executor(..., backend='thread')`) are not coalesced.
+_in_flight_calls: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[tuple, asyncio.Future]]" = weakref.WeakKeyDictionary()
+_in_flight_calls_lock = threading.Lock()
+
+def _get_in_flight_calls() -> Dict[tuple, asyncio.Future]:
+    "Returns the in-flight calls of the running event loop."
+    loop = asyncio.get_running_loop()
+    with _in_flight_calls_lock:
+        return _in_flight_calls.setdefault(loop, {})
+
+
+# %%
+#|exporti
+async def _single_flight(key: tuple, execute_func: Callable[[], Coroutine]):
+    """
+    Coalesces concurrent calls with the same `key`, so that only the first caller (the leader) runs `execute_func`,
+    while the others (the followers) await the leader's result. Returns a tuple `(is_follower, result)`.
+
+    If the leader is cancelled, a waiting follower takes over and executes the call itself.
+    """
+    in_flight_calls = _get_in_flight_calls()
+    while key in in_flight_calls:
+        flight = in_flight_calls[key]
+        try:
+            return True, await asyncio.shield(flight)
+        except asyncio.CancelledError:
+            if not flight.cancelled(): raise # The follower itself was cancelled
+    
+    flight = asyncio.get_running_loop().create_future()
+    flight.add_done_callback(lambda f: f.cancelled() or f.exception()) # Avoids 'exception was never retrieved' warnings
+    in_flight_calls[key] = flight
+    try:
         result = await execute_func()
-        cache.set(cache_key, result)
-        retrieved_from_cache = False
-    return retrieved_from_cache, result
+        flight.set_result(result)
+        return False, result
+    except asyncio.CancelledError:
+        flight.cancel()
+        raise
+    except BaseException as e:
+        flight.set_exception(e)
+        raise
+    finally:
+        del in_flight_calls[key]
+
+
+# %%
+num_calls = 0
+async def slow_call():
+    global num_calls
+    num_calls += 1
+    await asyncio.sleep(0.1)
+    return "result"
+
+results = await asyncio.gather(*[_single_flight(('foo',), slow_call) for _ in range(10)])
+assert num_calls == 1
+assert results == [(False, "result")] + [(True, "result")] * 9
+assert not _get_in_flight_calls()
+
+# %%
+# Calls on different event loops (e.g. in different threads) are not coalesced, as their futures can not be shared
+import threading
+
+num_calls = 0
+start_barrier = threading.Barrier(2)
+def run_in_new_loop(results, i):
+    async def call():
+        start_barrier.wait() # Both calls are in flight at the same time
+        return await _single_flight(('bar',), slow_call)
+    results[i] = asyncio.run(call())
+
+thread_results = [None, None]
+threads = [threading.Thread(target=run_in_new_loop, args=(thread_results, i)) for i in range(2)]
+for thread in threads: thread.start()
+for thread in threads: thread.join(timeout=5)
+assert thread_results == [(False, "result")] * 2 and num_calls == 2
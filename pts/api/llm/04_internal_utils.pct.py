@@ -13,15 +13,17 @@ import nblite; from nblite import show_doc; nblite.nbl_export()
 try:
     import litellm
     import inspect
+    import functools
     import time
     import asyncio
     import warnings
-    from typing import Callable, Optional, Union
+    from typing import Any, AsyncIterable, Callable, Iterable, Optional, Union
     from pathlib import Path
     from adulib.caching import get_default_cache_path
-    from adulib.llm.caching import _cache_execute, _async_cache_execute, get_cache_key, is_in_cache
-    from adulib.llm.call_logging import _log_call, get_cached_call_log, _add_log_to_tracker, CallLog
-    from adulib.llm.rate_limits import _get_limiter, default_retry_on_exception, default_max_retries, default_retry_delay, default_timeout
+    from diskcache import ENOVAL
+    from adulib.llm.caching import _get_cache_record, _set_cache_record, _async_get_cache_record, _async_set_cache_record, _single_flight, _get_legacy_cache_key_func, _get_cache_key_content, _register_cache_key_content_args, get_cache_key
+    from adulib.llm.call_logging import _log_call, _async_log_call, _add_log_to_tracker, CallLog
+    from adulib.llm.rate_limits import _get_limiter, _get_token_limiter, _get_concurrency_limiter, _unlimited_concurrency, _record_call_outcome, _resolve_retry_policy, RetryPolicy, default_retry_on_exception, default_timeout
 except ImportError as e:
     raise ImportError(f"Install adulib[llm] to use this API.") from e
 
@@ -45,6 +47,44 @@ class MaximumRetriesException(Exception):
         super().__init__(f"Maximum retries ({len(retry_exceptions)}) reached. Exceptions:\n{self.retry_exceptions_str}")
 
 
+# %%
+#|exporti
+def _bind_func_args(func_sig: inspect.Signature, args: tuple, kwargs: dict) -> dict:
+    "Binds the arguments of a call to `func_sig`, with the variadic keyword arguments merged into the others."
+    func_args_and_kwargs = dict(func_sig.bind(*args, **kwargs).arguments)
+    for name, param in func_sig.parameters.items():
+        if param.kind == inspect.Parameter.VAR_KEYWORD and name in func_args_and_kwargs:
+            func_args_and_kwargs.update(func_args_and_kwargs.pop(name))
+    return func_args_and_kwargs
+
+
+# %%
+#|exporti
+def _derive_cache_key(
+    func_sig: inspect.Signature,
+    func_cache_name: str,
+    cache_key_content_args: list[str],
+    args: tuple,
+    kwargs: dict,
+    cache_key_params: Optional[list[str]],
+    cache_key_prefix: Optional[str],
+    include_model_in_cache_key: bool,
+):
+    """
+    Derives the cache key of a call. The sync and async factories share this function, so that e.g. `completion` and
+    `async_completion` use the same cache key for the same inputs.
+
+    Returns the tuple `(func_args_and_kwargs, model, cache_key_content, cache_key)`.
+    """
+    if not all(arg in func_sig.parameters for arg in cache_key_content_args):
+        raise ValueError(f"Invalid cache_key_content_args: {cache_key_content_args}.")
+    func_args_and_kwargs = _bind_func_args(func_sig, args, kwargs)
+    model = func_args_and_kwargs['model']
+    cache_key_content = _get_cache_key_content(func_args_and_kwargs, cache_key_content_args, cache_key_params)
+    cache_key = get_cache_key(model, func_cache_name, cache_key_content, cache_key_prefix, include_model_in_cache_key)
+    return func_args_and_kwargs, model, cache_key_content, cache_key
+
+
 # %%
 #|exporti
 def _llm_func_factory(
@@ -55,8 +95,11 @@ def _llm_func_factory(
     cache_key_content_args: list[str],
     retrieve_log_data: Optional[Callable] = None,
     default_return_info: bool = True,
+    estimate_input_tokens: Optional[Callable] = None,
+    rate_limited: bool = True,
 ):
     func_sig = inspect.signature(func)
+    _register_cache_key_content_args(func_cache_name, cache_key_content_args)
     def llm_func(
         *args,
         # Cache settings
@@ -64,73 +107,89 @@ def _llm_func_factory(
         cache_path: Optional[Union[str, Path]]=None,
         cache_key_prefix: Optional[str]=None,
         include_model_in_cache_key: bool=True,
+        cache_key_params: Optional[list[str]]=None,
         return_cache_key: bool=False,
         return_info: bool=default_return_info,
         # Retry settings
         enable_retries: bool=True,
         retry_on_exceptions: Optional[list[Exception]]=None,
         retry_on_all_exceptions: bool=False,
+        retry_policy: Optional[RetryPolicy]=None,
         max_retries: Optional[int]=None,
-        retry_delay: Optional[int]=None,
+        retry_delay: Optional[float]=None,
         **kwargs,
     ):
         if retry_on_exceptions is None: retry_on_exceptions = default_retry_on_exception
-        if max_retries is None: max_retries = default_max_retries
-        if retry_delay is None: retry_delay = default_retry_delay
-        
-        # Check that all args in cache_key_content are valid
-        if not all(arg in func_sig.parameters for arg in cache_key_content_args):
-            raise ValueError(f"Invalid cache_key_content_args: {cache_key_content_args}.")
+        retry_policy = _resolve_retry_policy(retry_policy, max_retries, retry_delay)
         
-        # Generate cache key
-        bound = func_sig.bind(*args, **kwargs)
-        func_args_and_kwargs = dict(bound.arguments)
-        cache_key_content = {k: func_args_and_kwargs[k] for k in cache_key_content_args if k in func_args_and_kwargs}
-        model = func_args_and_kwargs['model']
-        cache_key = get_cache_key(model, func_cache_name, func_args_and_kwargs, cache_key_prefix, include_model_in_cache_key)
+        func_args_and_kwargs, model, cache_key_content, cache_key = _derive_cache_key(
+            func_sig, func_cache_name, cache_key_content_args, args, kwargs, cache_key_params, cache_key_prefix, include_model_in_cache_key,
+        )
         if return_cache_key: return cache_key
         
         if cache_path is None:
             cache_path = get_default_cache_path()
         
-        # Execute with caching and retries
-        success = False
-        exceptions = []
-        for _ in range(max_retries):
-            try:
-                cache_hit, result = _cache_execute(
-                    cache_key=cache_key,
-                    execute_func=lambda: func(*args, **kwargs),
-                    cache_enabled=cache_enabled,
-                    cache_path=cache_path,
-                )
-                success = True
-                break
-            except BaseException as e:
-                if not enable_retries: raise e
-                if not (retry_on_all_exceptions or any([isinstance(e, exc) for exc in retry_on_exceptions])): raise e
-                exceptions.append(e)
-                time.sleep(retry_delay)
-                    
-        if not success:
-            raise MaximumRetriesException(exceptions)
-        
-        # Call logging
-        if retrieve_log_data is not None:
-            if not cache_hit:
+        # Cache lookup. The result and its call log are retrieved with a single cache read.
+        legacy_cache_key_func = _get_legacy_cache_key_func(model, func_cache_name, cache_key_content, cache_key_prefix, include_model_in_cache_key)
+        record = _get_cache_record(cache_key, cache_path, legacy_cache_key_func) if cache_enabled else ENOVAL
+        cache_hit = record is not ENOVAL
+        if cache_hit:
+            result, call_info = record
+        else:
+            # Execute with rate limiting and retries. The rate limiters are shared with the async functions, and are thread-safe.
+            api_key = kwargs.get("api_key", None)
+            limiter = _get_limiter(model, api_key) if rate_limited else None
+            token_limiter = _get_token_limiter(model, api_key) if rate_limited else None
+            estimated_tokens = 0
+            if token_limiter is not None and estimate_input_tokens is not None:
+                estimated_tokens = estimate_input_tokens(model, func_args_and_kwargs)
+            success = False
+            exceptions = []
+            delay = None
+            retries_start = time.monotonic()
+            for attempt in range(retry_policy.max_retries):
+                if limiter is not None: limiter.wait_sync()
+                if token_limiter is not None: token_limiter.acquire_sync(estimated_tokens)
+                try:
+                    result = func(*args, **kwargs)
+                    if limiter is not None: _record_call_outcome(limiter)
+                    success = True
+                    break
+                except BaseException as e:
+                    if limiter is not None: _record_call_outcome(limiter, e)
+                    if token_limiter is not None: token_limiter.reconcile(estimated_tokens, 0) # Failed calls are refunded
+                    if not enable_retries: raise e
+                    if not (retry_on_all_exceptions or any([isinstance(e, exc) for exc in retry_on_exceptions])): raise e
+                    exceptions.append(e)
+                    delay = retry_policy.get_retry_delay(attempt, delay, e, time.monotonic() - retries_start)
+                    if delay is None: break
+                    time.sleep(delay)
+                        
+            if not success:
+                raise MaximumRetriesException(exceptions)
+            
+            # Call logging
+            call_info = None
+            if retrieve_log_data is not None:
                 cache_args = {
                     "cache_path": cache_path,
                     "cache_key_prefix": cache_key_prefix,
                     "include_model_in_cache_key": include_model_in_cache_key,
                 }
                 log_data = retrieve_log_data(model, func_args_and_kwargs, result, cache_args)
-                _log_call(cache_key, cache_path, model=model, **log_data)
-
-            call_info = get_cached_call_log(cache_key, cache_path)
+                call_info = _log_call(cache_key, cache_path, model=model, **log_data)
+                if token_limiter is not None:
+                    token_limiter.reconcile(estimated_tokens, (log_data['input_tokens'] or 0) + (log_data['output_tokens'] or 0))
+            
+            if cache_enabled:
+                _set_cache_record(cache_key, result, call_info, cache_path)
+        
+        if retrieve_log_data is not None:
             if call_info is None:
                 warnings.warn(f"Call log for cache key '{cache_key}' not found in cache at '{cache_path}'. This may indicate a caching issue.")
-                
-            _add_log_to_tracker(call_info, cache_hit) # Track the call log if a tracker is set up
+            else:
+                _add_log_to_tracker(CallLog(**call_info), cache_hit) # Track the call log if a tracker is set up
         
         if return_info:
             if retrieve_log_data is not None:
@@ -195,8 +254,11 @@ def _llm_async_func_factory(
     cache_key_content_args: list[str],
     retrieve_log_data: Optional[Callable] = None,
     default_return_info: bool = True,
+    estimate_input_tokens: Optional[Callable] = None,
+    limit_concurrency: bool = True, # Disabled by callers that hold the concurrency slot themselves (e.g. streams)
 ):
     func_sig = inspect.signature(func)
+    _register_cache_key_content_args(func_cache_name, cache_key_content_args)
     async def llm_func(
         *args,
         # Cache settings
@@ -204,83 +266,108 @@ def _llm_async_func_factory(
         cache_path: Optional[Union[str, Path]]=None,
         cache_key_prefix: Optional[str]=None,
         include_model_in_cache_key: bool=True,
+        cache_key_params: Optional[list[str]]=None,
         return_cache_key: bool=False,
         return_info: bool=default_return_info,
         # Retry settings
         enable_retries: bool=True,
         retry_on_exceptions: Optional[list[Exception]]=None,
         retry_on_all_exceptions: bool=False,
+        retry_policy: Optional[RetryPolicy]=None,
         max_retries: Optional[int]=None,
-        retry_delay: Optional[int]=None,
+        retry_delay: Optional[float]=None,
         timeout: Optional[int]=None,
         **kwargs,
     ):
         if retry_on_exceptions is None: retry_on_exceptions = default_retry_on_exception
-        if max_retries is None: max_retries = default_max_retries
-        if retry_delay is None: retry_delay = default_retry_delay
+        retry_policy = _resolve_retry_policy(retry_policy, max_retries, retry_delay)
         if timeout is None: timeout = default_timeout
         
-        # Check that all args in cache_key_content are valid
-        if not all(arg in func_sig.parameters for arg in cache_key_content_args):
-            raise ValueError(f"Invalid cache_key_content_args: {cache_key_content_args}.")
-        
-        # Generate cache key
-        bound = func_sig.bind(*args, **kwargs)
-        func_args_and_kwargs = dict(bound.arguments)
-        cache_key_content = {k: func_args_and_kwargs[k] for k in cache_key_content_args if k in func_args_and_kwargs}
-        model = func_args_and_kwargs['model']
-        cache_key = get_cache_key(model, func_cache_name, cache_key_content, cache_key_prefix, include_model_in_cache_key)
+        func_args_and_kwargs, model, cache_key_content, cache_key = _derive_cache_key(
+            func_sig, func_cache_name, cache_key_content_args, args, kwargs, cache_key_params, cache_key_prefix, include_model_in_cache_key,
+        )
         if return_cache_key: return cache_key
         
         if cache_path is None:
             cache_path = get_default_cache_path()
         
-        # Rate limiting
-        key_in_cache = is_in_cache(cache_key, cache=cache_path)
-        if not key_in_cache:
+        async def execute_and_log():
+            # Cache lookup. The result and its call log are retrieved with a single cache read.
+            legacy_cache_key_func = _get_legacy_cache_key_func(model, func_cache_name, cache_key_content, cache_key_prefix, include_model_in_cache_key)
+            record = await _async_get_cache_record(cache_key, cache_path, legacy_cache_key_func) if cache_enabled else ENOVAL
+            if record is not ENOVAL:
+                result, call_info = record
+                return True, result, call_info
+            
+            # Execute with rate limiting and retries. Every attempt waits for the rate limiter, and adaptive
+            # rate limiters are informed of the outcome of every attempt. Every attempt also holds a slot of the
+            # concurrency limiter, which is released while waiting to retry.
             api_key = kwargs.get("api_key", None)
-            await _get_limiter(model, api_key).wait()
-        
-        # Execute with caching and retries
-        success = False
-        exceptions = []
-        async def run_with_timeout():
-            return await asyncio.wait_for(func(*args, **kwargs), timeout)
-        for _ in range(max_retries):
-            try:                
-                cache_hit, result = await _async_cache_execute(
-                    cache_key=cache_key,
-                    execute_func=run_with_timeout if timeout is not None else lambda: func(*args, **kwargs),
-                    cache_enabled=cache_enabled,
-                    cache_path=cache_path,
-                )
-                success = True
-                break
-            except BaseException as e:
-                if not enable_retries: raise e
-                if not (retry_on_all_exceptions or any([isinstance(e, exc) for exc in retry_on_exceptions])): raise e
-                exceptions.append(e)
-                await asyncio.sleep(retry_delay)
-                    
-        if not success:
-            raise MaximumRetriesException(exceptions)
-        
-        # Call logging
-        if retrieve_log_data is not None:
-            if not cache_hit:
+            limiter = _get_limiter(model, api_key)
+            token_limiter = _get_token_limiter(model, api_key)
+            concurrency_limiter = _get_concurrency_limiter(model, api_key) if limit_concurrency else _unlimited_concurrency
+            estimated_tokens = 0
+            if token_limiter is not None and estimate_input_tokens is not None:
+                estimated_tokens = estimate_input_tokens(model, func_args_and_kwargs)
+            success = False
+            exceptions = []
+            delay = None
+            retries_start = time.monotonic()
+            for attempt in range(retry_policy.max_retries):
+                async with concurrency_limiter:
+                    await limiter.wait()
+                    if token_limiter is not None: await token_limiter.acquire(estimated_tokens)
+                    try:
+                        if timeout is not None:
+                            result = await asyncio.wait_for(func(*args, **kwargs), timeout)
+                        else:
+                            result = await func(*args, **kwargs)
+                        _record_call_outcome(limiter)
+                        success = True
+                    except BaseException as e:
+                        _record_call_outcome(limiter, e)
+                        if token_limiter is not None: token_limiter.reconcile(estimated_tokens, 0) # Failed calls are refunded
+                        if not enable_retries: raise e
+                        if not (retry_on_all_exceptions or any([isinstance(e, exc) for exc in retry_on_exceptions])): raise e
+                        exceptions.append(e)
+                        delay = retry_policy.get_retry_delay(attempt, delay, e, time.monotonic() - retries_start)
+                if success or delay is None: break
+                await asyncio.sleep(delay)
+                        
+            if not success:
+                raise MaximumRetriesException(exceptions)
+            
+            # Call logging
+            call_info = None
+            if retrieve_log_data is not None:
                 cache_args = {
                     "cache_path": cache_path,
                     "cache_key_prefix": cache_key_prefix,
                     "include_model_in_cache_key": include_model_in_cache_key,
                 }
                 log_data = retrieve_log_data(model, func_args_and_kwargs, result, cache_args)
-                _log_call(cache_key, cache_path, model=model, **log_data)
-
-            call_info = get_cached_call_log(cache_key, cache_path)
+                call_info = await _async_log_call(cache_key, cache_path, model=model, **log_data)
+                if token_limiter is not None:
+                    token_limiter.reconcile(estimated_tokens, (log_data['input_tokens'] or 0) + (log_data['output_tokens'] or 0))
+            
+            if cache_enabled:
+                await _async_set_cache_record(cache_key, result, call_info, cache_path)
+            
+            return False, result, call_info
+        
+        # Concurrent calls with the same cache key are coalesced into a single call. The followers are reported as cache hits.
+        if cache_enabled:
+            flight_key = (Path(cache_path).as_posix() if cache_path is not None else None, cache_key)
+            is_follower, (cache_hit, result, call_info) = await _single_flight(flight_key, execute_and_log)
+            cache_hit = cache_hit or is_follower
+        else:
+            cache_hit, result, call_info = await execute_and_log()
+        
+        if retrieve_log_data is not None:
             if call_info is None:
                 warnings.warn(f"Call log for cache key '{cache_key}' not found in cache at '{cache_path}'. This may indicate a caching issue.")
-                
-            _add_log_to_tracker(CallLog(**call_info), cache_hit) # Track the call log if a tracker is set up
+            else:
+                _add_log_to_tracker(CallLog(**call_info), cache_hit) # Track the call log if a tracker is set up
         
         if return_info:
             if retrieve_log_data is not None:
@@ -332,3 +419,817 @@ try:
     await _foo(model="bar", retry_delay=0.01, timeout=0.01)
 except MaximumRetriesException as e:
     print(e)
+
+# %% [markdown]
+# Retries are governed by a `RetryPolicy` (see `adulib.llm.rate_limits`), which can be passed to any of the LLM functions. Below, a fake provider rate limits the first two calls and asks the client to retry after 0.2 seconds.
+
+# %%
+#|hide
+import uuid
+import httpx
+from adulib.llm.rate_limits import RetryPolicy
+
+class FakeProvider:
+    def __init__(self, num_failures: int, retry_after: str):
+        self.num_failures = num_failures
+        self.retry_after = retry_after
+        self.num_calls = 0
+        
+    async def __call__(self, model, arg):
+        self.num_calls += 1
+        if self.num_calls <= self.num_failures:
+            raise litellm.RateLimitError("Rate limited", "fake_provider", model, response=httpx.Response(429, headers={'retry-after': self.retry_after}))
+        return arg
+
+fake_provider = FakeProvider(num_failures=2, retry_after="0.2")
+_fake = _llm_async_func_factory(
+    func=fake_provider,
+    func_name="fake",
+    func_cache_name="fake",
+    module_name="fake_module",
+    cache_key_content_args=['arg'],
+)
+
+t0 = time.monotonic()
+result, cache_hit = await _fake(model="fake", arg=str(uuid.uuid4()), retry_policy=RetryPolicy(base_delay=0.01))
+assert fake_provider.num_calls == 3
+assert time.monotonic() - t0 >= 0.4
+
+# The deadline is exceeded by the requested `Retry-After`, so the call fails without further retries
+fake_provider = FakeProvider(num_failures=2, retry_after="10")
+_fake = _llm_async_func_factory(
+    func=fake_provider,
+    func_name="fake",
+    func_cache_name="fake",
+    module_name="fake_module",
+    cache_key_content_args=['arg'],
+)
+try:
+    await _fake(model="fake", arg=str(uuid.uuid4()), retry_policy=RetryPolicy(base_delay=0.01, deadline=1))
+    assert False
+except MaximumRetriesException as e:
+    assert len(e.retry_exceptions) == 1
+
+# %% [markdown]
+# Adaptive rate limiters (see `adulib.llm.rate_limits.AdaptiveLimiter`) back off when the provider responds with rate limit errors:
+
+# %%
+#|hide
+from adulib.llm.rate_limits import set_request_rate_limit, get_request_rate_limit
+
+set_request_rate_limit("fake_adaptive", None, 6000, adaptive=True)
+fake_provider = FakeProvider(num_failures=1, retry_after="0")
+_fake = _llm_async_func_factory(
+    func=fake_provider,
+    func_name="fake",
+    func_cache_name="fake",
+    module_name="fake_module",
+    cache_key_content_args=['arg'],
+)
+await _fake(model="fake_adaptive", arg=str(uuid.uuid4()), retry_policy=RetryPolicy(base_delay=0.01))
+assert get_request_rate_limit("fake_adaptive") == 3000 + 60 # Halved by the rate limit error, then increased by the successful call
+
+# %% [markdown]
+# If a token rate limit is set (see `adulib.llm.rate_limits.set_token_rate_limit`), the estimated number of input tokens is drawn from the model's token bucket before each call, and reconciled with the actual usage in the call log afterwards:
+
+# %%
+#|hide
+from adulib.llm.rate_limits import set_token_rate_limit, _get_token_limiter
+
+async def echo(model, prompt):
+    return prompt
+
+_echo = _llm_async_func_factory(
+    func=echo,
+    func_name="echo",
+    func_cache_name="echo",
+    module_name="echo_module",
+    cache_key_content_args=['prompt'],
+    retrieve_log_data=lambda model, func_kwargs, response, cache_args: { "method": "echo", "input_tokens": len(func_kwargs['prompt'].split()), "output_tokens": len(response.split()), "cost": 0 },
+    estimate_input_tokens=lambda model, func_kwargs: len(func_kwargs['prompt'].split()),
+)
+
+set_token_rate_limit("echo", None, 60) # 1 token per second
+await _echo(model="echo", prompt=" ".join(["word"] * 30) + f" {uuid.uuid4()}") # Charged 31 tokens, reconciled to 62
+assert _get_token_limiter("echo").available_tokens < 0
+t0 = time.monotonic()
+await _echo(model="echo", prompt=f"{uuid.uuid4()}") # Has to wait for the debt to be repaid
+assert time.monotonic() - t0 > 1
+set_token_rate_limit("echo", None, None)
+
+# %% [markdown]
+# If a concurrency limit is set (see `adulib.llm.rate_limits.set_max_concurrency`), at most that many calls are in flight at once. Cache hits do not count towards the limit:
+
+# %%
+#|hide
+from adulib.llm.rate_limits import set_max_concurrency, _get_concurrency_limiter
+
+in_flight, max_in_flight = 0, 0
+async def slow_echo(model, prompt):
+    global in_flight, max_in_flight
+    in_flight += 1
+    max_in_flight = max(max_in_flight, in_flight)
+    await asyncio.sleep(0.05)
+    in_flight -= 1
+    return prompt
+
+_slow_echo = _llm_async_func_factory(
+    func=slow_echo,
+    func_name="slow_echo",
+    func_cache_name="slow_echo",
+    module_name="slow_echo_module",
+    cache_key_content_args=['prompt'],
+)
+
+set_request_rate_limit("slow_echo", None, 1000, 'per-second')
+set_max_concurrency("slow_echo", None, 3)
+prompts = [str(uuid.uuid4()) for _ in range(10)]
+await asyncio.gather(*[_slow_echo(model="slow_echo", prompt=prompt) for prompt in prompts])
+assert max_in_flight == 3
+
+# While all slots are taken, cache hits are still served
+set_max_concurrency("slow_echo", None, 1)
+async with _get_concurrency_limiter("slow_echo"):
+    results = await asyncio.wait_for(asyncio.gather(*[_slow_echo(model="slow_echo", prompt=prompt) for prompt in prompts]), timeout=1)
+assert all(cache_hit for _, cache_hit in results)
+set_max_concurrency("slow_echo", None, None)
+
+# %% [markdown]
+# The rate limiters are thread-safe, and shared between the synchronous and asynchronous functions. Below, sync calls made from a thread pool and async calls made from the event loop draw from a single budget of 20 calls per second:
+
+# %%
+#|hide
+from concurrent.futures import ThreadPoolExecutor
+
+_sync_echo = _llm_func_factory(
+    func=lambda model, prompt: prompt,
+    func_name="echo",
+    func_cache_name="echo",
+    module_name="echo_module",
+    cache_key_content_args=['prompt'],
+)
+
+set_request_rate_limit("shared_echo", None, 20, 'per-second')
+t0 = time.monotonic()
+with ThreadPoolExecutor(max_workers=10) as executor:
+    sync_futures = [executor.submit(_sync_echo, model="shared_echo", prompt="hi", cache_enabled=False) for _ in range(10)]
+    await asyncio.gather(*[_echo(model="shared_echo", prompt="hi", cache_enabled=False) for _ in range(10)])
+    for future in sync_futures: future.result()
+assert time.monotonic() - t0 > 0.7 # 20 calls, of which the first 5 are let through at once
+
+# %% [markdown]
+# Concurrent calls with identical cache keys are coalesced, so that only one of them is executed. The rest await its result and are reported as cache hits.
+
+# %%
+#|hide
+from adulib.llm.call_logging import start_tracking, stop_tracking
+
+num_calls = 0
+async def baz(model, arg):
+    global num_calls
+    num_calls += 1
+    await asyncio.sleep(0.1)
+    return arg
+
+_baz = _llm_async_func_factory(
+    func=baz,
+    func_name="baz",
+    func_cache_name="baz",
+    module_name="baz_module",
+    cache_key_content_args=['arg'],
+    retrieve_log_data=lambda model, func_kwargs, response, cache_args: { "method": "baz", "input_tokens": None, "output_tokens": None, "cost": 0 },
+)
+
+start_tracking()
+arg = str(uuid.uuid4())
+results = await asyncio.gather(*[_baz(model="baz", arg=arg) for _ in range(10)])
+tracked_logs = stop_tracking()
+
+assert num_calls == 1
+assert [cache_hit for _, cache_hit, _ in results].count(False) == 1
+assert [cache_hit for _, cache_hit in tracked_logs].count(False) == 1
+assert len(set(call_log['id'] for _, _, call_log in results)) == 1
+
+# %% [markdown]
+# The result and the call log are stored together under the cache key, so a cache hit requires a single cache read.
+
+# %%
+#|hide
+from adulib.llm.call_logging import get_cached_call_log
+
+cache_key = await _baz(model="baz", arg=arg, return_cache_key=True)
+assert _get_cache_record(cache_key, get_default_cache_path()) == (arg, results[0][2])
+assert get_cached_call_log(cache_key, get_default_cache_path()) == results[0][2]
+
+# %% [markdown]
+# Cache I/O in the async API runs in a thread pool (see `adulib.llm.caching`), so the event loop stays responsive under many concurrent calls. The following benchmark measures the event loop latency (the lag of a 1ms heartbeat) during 1000 concurrent cache-hit calls.
+
+# %%
+#|hide
+import statistics
+
+async def measure_loop_latency(coro, interval=0.001):
+    lags = []
+    done = False
+    async def heartbeat():
+        loop = asyncio.get_running_loop()
+        while not done:
+            t = loop.time()
+            await asyncio.sleep(interval)
+            lags.append(loop.time() - t - interval)
+    heartbeat_task = asyncio.create_task(heartbeat())
+    t0 = time.perf_counter()
+    await coro
+    elapsed = time.perf_counter() - t0
+    done = True
+    await heartbeat_task
+    return elapsed, lags
+
+from adulib.llm.rate_limits import set_request_rate_limit
+set_request_rate_limit("baz", None, 10000, 'per-second')
+
+args = [str(uuid.uuid4()) for _ in range(1000)]
+await asyncio.gather(*[_baz(model="baz", arg=arg) for arg in args]) # Populate the cache
+elapsed, lags = await measure_loop_latency(asyncio.gather(*[_baz(model="baz", arg=arg) for arg in args]))
+
+print(f"1000 concurrent cache-hit calls: {elapsed:.2f}s")
+print(f"Event loop lag: p50={statistics.median(lags)*1000:.1f}ms, max={max(lags)*1000:.1f}ms")
+
+# %% [markdown]
+# The sync and async factories derive their cache keys in the same way, so that they share their cache entries. All arguments except those in `adulib.llm.caching.default_cache_key_exclude_params` are part of the cache key. The excluded sampling parameters (e.g. `temperature`) are only part of the cache key if requested using `cache_key_params` (see `adulib.llm.caching.set_default_cache_key_params`):
+
+# %%
+#|hide
+import tempfile
+from adulib.llm.caching import rekey_cache_records
+
+def sync_echo(model, prompt, temperature=None, **kwargs):
+    return prompt
+
+async def async_echo(model, prompt, temperature=None, **kwargs):
+    return prompt
+
+_sync_echo = _llm_func_factory(func=sync_echo, func_name="echo", func_cache_name="shared_echo", module_name="echo_module", cache_key_content_args=['prompt'])
+_async_echo = _llm_async_func_factory(func=async_echo, func_name="async_echo", func_cache_name="shared_echo", module_name="echo_module", cache_key_content_args=['prompt'])
+
+prompt = str(uuid.uuid4())
+assert _sync_echo(model="echo", prompt=prompt, temperature=0.5, return_cache_key=True) == await _async_echo(model="echo", prompt=prompt, return_cache_key=True)
+assert _sync_echo(model="echo", prompt=prompt, seed=1, return_cache_key=True) == await _async_echo(model="echo", prompt=prompt, seed=1, return_cache_key=True)
+assert _sync_echo(model="echo", prompt=prompt, seed=1, return_cache_key=True) != _sync_echo(model="echo", prompt=prompt, return_cache_key=True)
+assert _sync_echo(model="echo", prompt=prompt, max_tokens=5, return_cache_key=True) != \
+    _sync_echo(model="echo", prompt=prompt, max_tokens=500, tools=[{'type': 'function'}], n=3, return_cache_key=True)
+assert _sync_echo(model="echo", prompt=prompt) == (prompt, False)
+assert await _async_echo(model="echo", prompt=prompt) == (prompt, True)
+
+assert _sync_echo(model="echo", prompt=prompt, temperature=0.5, cache_key_params=['temperature'], return_cache_key=True) != \
+    _sync_echo(model="echo", prompt=prompt, cache_key_params=['temperature'], return_cache_key=True)
+assert await _async_echo(model="echo", prompt=prompt, temperature=0.5, seed=1, cache_key_params=['temperature', 'seed']) == (prompt, False)
+
+# %% [markdown]
+# Entries created by earlier versions of `adulib`, where the sync functions included all arguments in the cache key, are moved to the current keys using `rekey_cache_records`:
+
+# %%
+#|hide
+tmp_cache_path = tempfile.mkdtemp()
+old_sync_key = get_cache_key("echo", "shared_echo", {'model': "echo", 'prompt': "hi", 'temperature': 0.5, 'kwargs': {'timeout': 10}}, key_format='readable')
+old_async_key = get_cache_key("echo", "shared_echo", {'prompt': "hi"}, key_format='readable')
+unparseable_key = ('adulib.llm', 'shared_echo', 'None', 'echo', "{'prompt': <class 'Foo'>}")
+for key in [old_sync_key, old_async_key, unparseable_key]:
+    _set_cache_record(key, "hi", None, tmp_cache_path)
+
+assert rekey_cache_records(tmp_cache_path, dry_run=True) == {'rekeyed': 1, 'merged': 1, 'skipped': 1}
+assert rekey_cache_records(tmp_cache_path) == {'rekeyed': 1, 'merged': 1, 'skipped': 1}
+assert rekey_cache_records(tmp_cache_path) == {'rekeyed': 0, 'merged': 0, 'skipped': 1}
+assert _sync_echo(model="echo", prompt="hi", cache_path=tmp_cache_path) == ("hi", True)
+
+
+# %% [markdown]
+# ## Streaming
+#
+# The streaming LLM functions (e.g. `adulib.llm.completions.stream_completion`) return an `LLMStream` (async: `AsyncLLMStream`), which yields the chunks of the response as soon as they arrive. Once the stream has been consumed, the chunks are assembled into the full response, and the chunks and the call log are stored in the cache. Later calls with the same cache key replay the cached chunks.
+#
+# Opening the stream goes through the regular LLM function factories with caching disabled, so that it is subject to the same rate limits and retries as all other calls. Errors that occur once the stream has started are raised to the consumer.
+
+# %%
+#|export
+class LLMStream:
+    """
+    An iterator over the chunks of a streamed LLM call. Once it is exhausted, `response` holds the assembled response
+    and `call_log` the call log. Streams that are not consumed to the end are not cached.
+    """
+    def __init__(
+        self,
+        chunks: Iterable,
+        cache_key: Any,
+        cache_hit: bool,
+        on_complete: Optional[Callable] = None,
+        response: Any = None,
+        call_log: Optional[dict] = None,
+        on_close: Optional[Callable] = None,
+    ):
+        self.cache_key = cache_key
+        self.cache_hit = cache_hit
+        self.response = response
+        self.call_log = call_log
+        self._chunks = chunks
+        self._on_complete = on_complete
+        self._on_close = on_close
+        self._iterator = self._iterate()
+
+    def _iterate(self):
+        chunks = []
+        try:
+            for chunk in self._chunks:
+                chunks.append(chunk)
+                yield chunk
+            if self._on_complete is not None:
+                self.response, self.call_log = self._on_complete(chunks)
+        finally:
+            self._close(chunks)
+
+    def _close(self, chunks: list):
+        "Called with the chunks received so far once the stream is exhausted or closed."
+        if self._on_close is not None:
+            on_close, self._on_close = self._on_close, None
+            on_close(chunks)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._iterator)
+
+    def close(self):
+        "Closes the stream without consuming the remaining chunks."
+        self._iterator.close()
+        if hasattr(self._chunks, 'close'):
+            self._chunks.close()
+        self._close([])
+
+
+# %%
+#|export
+class AsyncLLMStream:
+    """
+    The asynchronous counterpart of `LLMStream`. A stream that is not replayed from the cache holds a slot of the
+    model's concurrency limiter until it is exhausted or closed, so streams that are abandoned early should be closed
+    with `aclose` (or used as an async context manager).
+    """
+    def __init__(
+        self,
+        chunks: Union[Iterable, AsyncIterable],
+        cache_key: Any,
+        cache_hit: bool,
+        on_complete: Optional[Callable] = None,
+        response: Any = None,
+        call_log: Optional[dict] = None,
+        on_close: Optional[Callable] = None,
+    ):
+        self.cache_key = cache_key
+        self.cache_hit = cache_hit
+        self.response = response
+        self.call_log = call_log
+        self._chunks = chunks
+        self._on_complete = on_complete
+        self._on_close = on_close
+        self._iterator = self._iterate()
+
+    async def _iterate(self):
+        chunks = []
+        try:
+            if hasattr(self._chunks, '__aiter__'):
+                async for chunk in self._chunks:
+                    chunks.append(chunk)
+                    yield chunk
+            else: # Replayed from the cache
+                for chunk in self._chunks:
+                    chunks.append(chunk)
+                    yield chunk
+            if self._on_complete is not None:
+                self.response, self.call_log = await self._on_complete(chunks)
+        finally:
+            await self._close(chunks)
+
+    async def _close(self, chunks: list):
+        if self._on_close is not None:
+            on_close, self._on_close = self._on_close, None
+            await on_close(chunks)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self._iterator.__anext__()
+
+    async def aclose(self):
+        "Closes the stream without consuming the remaining chunks."
+        await self._iterator.aclose()
+        if hasattr(self._chunks, 'aclose'):
+            await self._chunks.aclose()
+        await self._close([])
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+
+# %%
+#|exporti
+def _get_used_tokens(log_data: dict) -> int:
+    return (log_data['input_tokens'] or 0) + (log_data['output_tokens'] or 0)
+
+def _get_partial_stream_tokens(
+    model: str, func_args_and_kwargs: dict, chunks: list, build_response: Callable, retrieve_log_data: Optional[Callable],
+) -> Optional[int]:
+    "Returns the tokens used by a stream that was closed early, from the chunks received so far, or None if unknown."
+    if retrieve_log_data is None or not chunks: return None
+    try:
+        return _get_used_tokens(retrieve_log_data(model, func_args_and_kwargs, build_response(chunks, func_args_and_kwargs), {}))
+    except Exception: # e.g. if the chunks can not be assembled
+        return None
+
+
+# %%
+#|exporti
+def _llm_stream_func_factory(
+    func: Callable,
+    func_name: str,
+    func_cache_name: str,
+    module_name: str,
+    cache_key_content_args: list[str],
+    build_response: Callable,
+    retrieve_log_data: Optional[Callable] = None,
+    estimate_input_tokens: Optional[Callable] = None,
+):
+    @functools.wraps(func)
+    def _open_stream(*args, **kwargs):
+        return func(*args, stream=True, **kwargs)
+    
+    open_stream = _llm_func_factory(
+        func=_open_stream,
+        func_name=func_name,
+        func_cache_name=func_cache_name,
+        module_name=module_name,
+        cache_key_content_args=cache_key_content_args,
+        default_return_info=False,
+        estimate_input_tokens=estimate_input_tokens,
+    )
+    
+    func_sig = inspect.signature(func)
+    def llm_func(
+        *args,
+        # Cache settings
+        cache_enabled: bool=True,
+        cache_path: Optional[Union[str, Path]]=None,
+        cache_key_prefix: Optional[str]=None,
+        include_model_in_cache_key: bool=True,
+        cache_key_params: Optional[list[str]]=None,
+        return_cache_key: bool=False,
+        # Retry settings
+        enable_retries: bool=True,
+        retry_on_exceptions: Optional[list[Exception]]=None,
+        retry_on_all_exceptions: bool=False,
+        retry_policy: Optional[RetryPolicy]=None,
+        max_retries: Optional[int]=None,
+        retry_delay: Optional[float]=None,
+        **kwargs,
+    ):
+        cache_key = open_stream(
+            *args, cache_key_prefix=cache_key_prefix, include_model_in_cache_key=include_model_in_cache_key, cache_key_params=cache_key_params,
+            return_cache_key=True, **kwargs,
+        )
+        if return_cache_key: return cache_key
+        
+        if cache_path is None:
+            cache_path = get_default_cache_path()
+        func_args_and_kwargs = _bind_func_args(func_sig, args, kwargs)
+        model = func_args_and_kwargs['model']
+        
+        # Cached streams are replayed
+        record = _get_cache_record(cache_key, cache_path) if cache_enabled else ENOVAL
+        if record is not ENOVAL:
+            chunks, call_info = record
+            if call_info is not None:
+                _add_log_to_tracker(CallLog(**call_info), True)
+            return LLMStream(chunks, cache_key, cache_hit=True, response=build_response(chunks, func_args_and_kwargs), call_log=call_info)
+        
+        stream = open_stream(
+            *args,
+            cache_enabled=False,
+            enable_retries=enable_retries,
+            retry_on_exceptions=retry_on_exceptions,
+            retry_on_all_exceptions=retry_on_all_exceptions,
+            retry_policy=retry_policy,
+            max_retries=max_retries,
+            retry_delay=retry_delay,
+            **kwargs,
+        )
+        
+        # Opening the stream charged the estimated input tokens to the token rate limiter. The charge is reconciled
+        # with the actual usage once the stream is exhausted, or from the chunks received so far if it is closed early.
+        token_limiter = _get_token_limiter(model, kwargs.get("api_key", None))
+        estimated_tokens = 0
+        if token_limiter is not None and estimate_input_tokens is not None:
+            estimated_tokens = estimate_input_tokens(model, func_args_and_kwargs)
+        tokens_reconciled = False
+        
+        def on_complete(chunks):
+            nonlocal tokens_reconciled
+            response = build_response(chunks, func_args_and_kwargs)
+            call_info = None
+            if retrieve_log_data is not None:
+                cache_args = {
+                    "cache_path": cache_path,
+                    "cache_key_prefix": cache_key_prefix,
+                    "include_model_in_cache_key": include_model_in_cache_key,
+                }
+                log_data = retrieve_log_data(model, func_args_and_kwargs, response, cache_args)
+                if token_limiter is not None:
+                    token_limiter.reconcile(estimated_tokens, _get_used_tokens(log_data))
+                    tokens_reconciled = True
+                call_info = _log_call(cache_key, cache_path, model=model, **log_data)
+                _add_log_to_tracker(CallLog(**call_info), False)
+            if cache_enabled:
+                _set_cache_record(cache_key, chunks, call_info, cache_path)
+            return response, call_info
+        
+        def on_close(chunks):
+            if token_limiter is None or tokens_reconciled: return
+            used_tokens = _get_partial_stream_tokens(model, func_args_and_kwargs, chunks, build_response, retrieve_log_data)
+            if used_tokens is not None:
+                token_limiter.reconcile(estimated_tokens, used_tokens)
+        
+        return LLMStream(stream, cache_key, cache_hit=False, on_complete=on_complete, on_close=on_close)
+    
+    llm_func.__name__ = func_name
+    llm_func.__module__ = module_name
+    llm_func.__qualname__ = func_name
+    return llm_func
+
+
+# %%
+#|exporti
+def _llm_async_stream_func_factory(
+    func: Callable,
+    func_name: str,
+    func_cache_name: str,
+    module_name: str,
+    cache_key_content_args: list[str],
+    build_response: Callable,
+    retrieve_log_data: Optional[Callable] = None,
+    estimate_input_tokens: Optional[Callable] = None,
+):
+    @functools.wraps(func)
+    async def _open_stream(*args, **kwargs):
+        return await func(*args, stream=True, **kwargs)
+    
+    open_stream = _llm_async_func_factory(
+        func=_open_stream,
+        func_name=func_name,
+        func_cache_name=func_cache_name,
+        module_name=module_name,
+        cache_key_content_args=cache_key_content_args,
+        default_return_info=False,
+        estimate_input_tokens=estimate_input_tokens,
+        limit_concurrency=False,
+    )
+    
+    func_sig = inspect.signature(func)
+    async def llm_func(
+        *args,
+        # Cache settings
+        cache_enabled: bool=True,
+        cache_path: Optional[Union[str, Path]]=None,
+        cache_key_prefix: Optional[str]=None,
+        include_model_in_cache_key: bool=True,
+        cache_key_params: Optional[list[str]]=None,
+        return_cache_key: bool=False,
+        # Retry settings
+        enable_retries: bool=True,
+        retry_on_exceptions: Optional[list[Exception]]=None,
+        retry_on_all_exceptions: bool=False,
+        retry_policy: Optional[RetryPolicy]=None,
+        max_retries: Optional[int]=None,
+        retry_delay: Optional[float]=None,
+        timeout: Optional[int]=None,
+        **kwargs,
+    ):
+        cache_key = await open_stream(
+            *args, cache_key_prefix=cache_key_prefix, include_model_in_cache_key=include_model_in_cache_key, cache_key_params=cache_key_params,
+            return_cache_key=True, **kwargs,
+        )
+        if return_cache_key: return cache_key
+        
+        if cache_path is None:
+            cache_path = get_default_cache_path()
+        func_args_and_kwargs = _bind_func_args(func_sig, args, kwargs)
+        model = func_args_and_kwargs['model']
+        
+        # Cached streams are replayed
+        record = await _async_get_cache_record(cache_key, cache_path) if cache_enabled else ENOVAL
+        if record is not ENOVAL:
+            chunks, call_info = record
+            if call_info is not None:
+                _add_log_to_tracker(CallLog(**call_info), True)
+            return AsyncLLMStream(chunks, cache_key, cache_hit=True, response=build_response(chunks, func_args_and_kwargs), call_log=call_info)
+        
+        # The concurrency slot is held until the stream is exhausted or closed, rather than only while it is opened
+        concurrency_limiter = _get_concurrency_limiter(model, kwargs.get("api_key", None))
+        await concurrency_limiter.__aenter__()
+        try:
+            stream = await open_stream(
+                *args,
+                cache_enabled=False,
+                enable_retries=enable_retries,
+                retry_on_exceptions=retry_on_exceptions,
+                retry_on_all_exceptions=retry_on_all_exceptions,
+                retry_policy=retry_policy,
+                max_retries=max_retries,
+                retry_delay=retry_delay,
+                timeout=timeout, # Only applies to opening the stream
+                **kwargs,
+            )
+        except BaseException:
+            await concurrency_limiter.__aexit__(None, None, None)
+            raise
+        
+        # Opening the stream charged the estimated input tokens to the token rate limiter. The charge is reconciled
+        # with the actual usage once the stream is exhausted, or from the chunks received so far if it is closed early.
+        token_limiter = _get_token_limiter(model, kwargs.get("api_key", None))
+        estimated_tokens = 0
+        if token_limiter is not None and estimate_input_tokens is not None:
+            estimated_tokens = estimate_input_tokens(model, func_args_and_kwargs)
+        tokens_reconciled = False
+        
+        async def on_close(chunks):
+            await concurrency_limiter.__aexit__(None, None, None)
+            if token_limiter is None or tokens_reconciled: return
+            used_tokens = _get_partial_stream_tokens(model, func_args_and_kwargs, chunks, build_response, retrieve_log_data)
+            if used_tokens is not None:
+                token_limiter.reconcile(estimated_tokens, used_tokens)
+        
+        async def on_complete(chunks):
+            nonlocal tokens_reconciled
+            response = build_response(chunks, func_args_and_kwargs)
+            call_info = None
+            if retrieve_log_data is not None:
+                cache_args = {
+                    "cache_path": cache_path,
+                    "cache_key_prefix": cache_key_prefix,
+                    "include_model_in_cache_key": include_model_in_cache_key,
+                }
+                log_data = retrieve_log_data(model, func_args_and_kwargs, response, cache_args)
+                if token_limiter is not None:
+                    token_limiter.reconcile(estimated_tokens, _get_used_tokens(log_data))
+                    tokens_reconciled = True
+                call_info = await _async_log_call(cache_key, cache_path, model=model, **log_data)
+                _add_log_to_tracker(CallLog(**call_info), False)
+            if cache_enabled:
+                await _async_set_cache_record(cache_key, chunks, call_info, cache_path)
+            return response, call_info
+        
+        return AsyncLLMStream(stream, cache_key, cache_hit=False, on_complete=on_complete, on_close=on_close)
+    
+    llm_func.__name__ = func_name
+    llm_func.__module__ = module_name
+    llm_func.__qualname__ = func_name
+    return llm_func
+
+
+# %%
+#|hide
+def word_stream(model, prompt, stream=False):
+    assert stream
+    for word in prompt.split():
+        yield word
+
+_stream_words = _llm_stream_func_factory(
+    func=word_stream,
+    func_name="stream_words",
+    func_cache_name="stream_words",
+    module_name="stream_words_module",
+    cache_key_content_args=['prompt'],
+    build_response=lambda chunks, func_kwargs: " ".join(chunks),
+    retrieve_log_data=lambda model, func_kwargs, response, cache_args: { "method": "stream_words", "input_tokens": len(func_kwargs['prompt'].split()), "output_tokens": len(response.split()), "cost": 0 },
+)
+
+prompt = f"one two three {uuid.uuid4()}"
+stream = _stream_words(model="stream_words", prompt=prompt)
+assert not stream.cache_hit and stream.response is None
+assert list(stream) == prompt.split()
+assert stream.response == prompt and stream.call_log['output_tokens'] == 4
+
+stream = _stream_words(model="stream_words", prompt=prompt)
+assert stream.cache_hit and stream.response == prompt
+assert list(stream) == prompt.split()
+
+# Streams that are not consumed to the end are not cached
+prompt = f"one two three {uuid.uuid4()}"
+next(_stream_words(model="stream_words", prompt=prompt))
+assert not _stream_words(model="stream_words", prompt=prompt).cache_hit
+
+
+# %%
+#|hide
+async def async_word_stream(model, prompt, stream=False):
+    async def words():
+        for word in prompt.split():
+            await asyncio.sleep(0)
+            yield word
+    return words()
+
+_async_stream_words = _llm_async_stream_func_factory(
+    func=async_word_stream,
+    func_name="async_stream_words",
+    func_cache_name="stream_words",
+    module_name="stream_words_module",
+    cache_key_content_args=['prompt'],
+    build_response=lambda chunks, func_kwargs: " ".join(chunks),
+    retrieve_log_data=lambda model, func_kwargs, response, cache_args: { "method": "stream_words", "input_tokens": len(func_kwargs['prompt'].split()), "output_tokens": len(response.split()), "cost": 0 },
+)
+
+prompt = f"one two three {uuid.uuid4()}"
+stream = await _async_stream_words(model="stream_words", prompt=prompt)
+assert [chunk async for chunk in stream] == prompt.split()
+assert not stream.cache_hit and stream.response == prompt
+
+stream = await _async_stream_words(model="stream_words", prompt=prompt)
+assert [chunk async for chunk in stream] == prompt.split()
+assert stream.cache_hit and stream.call_log['output_tokens'] == 4
+
+# %% [markdown]
+# An async stream holds a slot of the concurrency limiter until it is exhausted or closed, as the connection stays open while the chunks arrive:
+
+# %%
+#|hide
+set_max_concurrency("stream_words", None, 1)
+limiter = _get_concurrency_limiter("stream_words")
+
+stream = await _async_stream_words(model="stream_words", prompt=f"one two three {uuid.uuid4()}")
+assert await stream.__anext__() == "one"
+try: # The slot is still taken
+    await asyncio.wait_for(_async_stream_words(model="stream_words", prompt=f"one two {uuid.uuid4()}"), timeout=0.1)
+    assert False
+except asyncio.TimeoutError:
+    pass
+assert [chunk async for chunk in stream] == ["two", "three", stream.response.split()[-1]]
+
+# Exhausting the stream releases the slot, as does closing it early
+stream = await asyncio.wait_for(_async_stream_words(model="stream_words", prompt=f"one two {uuid.uuid4()}"), timeout=0.1)
+await stream.aclose()
+async with await asyncio.wait_for(_async_stream_words(model="stream_words", prompt=f"one two {uuid.uuid4()}"), timeout=0.1) as stream:
+    assert await stream.__anext__() == "one"
+await asyncio.wait_for(limiter.__aenter__(), timeout=0.1)
+await limiter.__aexit__(None, None, None)
+set_max_concurrency("stream_words", None, None)
+
+# %% [markdown]
+# The estimated input tokens charged to the token rate limiter when a stream is opened are reconciled with the actual usage once the stream is exhausted. Streams that are closed early are reconciled from the chunks received so far:
+
+# %%
+#|hide
+_estimate_40 = lambda model, func_kwargs: 40 # Deliberately off, so that the reconciliation shows
+_token_stream_words = _llm_stream_func_factory(
+    func=word_stream,
+    func_name="stream_words",
+    func_cache_name="stream_words",
+    module_name="stream_words_module",
+    cache_key_content_args=['prompt'],
+    build_response=lambda chunks, func_kwargs: " ".join(chunks),
+    retrieve_log_data=lambda model, func_kwargs, response, cache_args: { "method": "stream_words", "input_tokens": len(func_kwargs['prompt'].split()), "output_tokens": len(response.split()), "cost": 0 },
+    estimate_input_tokens=_estimate_40,
+)
+_async_token_stream_words = _llm_async_stream_func_factory(
+    func=async_word_stream,
+    func_name="async_stream_words",
+    func_cache_name="stream_words",
+    module_name="stream_words_module",
+    cache_key_content_args=['prompt'],
+    build_response=lambda chunks, func_kwargs: " ".join(chunks),
+    retrieve_log_data=lambda model, func_kwargs, response, cache_args: { "method": "stream_words", "input_tokens": len(func_kwargs['prompt'].split()), "output_tokens": len(response.split()), "cost": 0 },
+    estimate_input_tokens=_estimate_40,
+)
+prompt_words = " ".join(["word"] * 10)
+
+# Exhausted streams: 40 tokens are charged, and reconciled to 11 input and 11 output tokens. The bucket refills at 1 token per second.
+set_token_rate_limit("stream_words", None, 60)
+list(_token_stream_words(model="stream_words", prompt=f"{prompt_words} {uuid.uuid4()}"))
+assert 38 <= _get_token_limiter("stream_words").available_tokens < 48
+set_token_rate_limit("stream_words", None, 60)
+stream = await _async_token_stream_words(model="stream_words", prompt=f"{prompt_words} {uuid.uuid4()}")
+[chunk async for chunk in stream]
+assert 38 <= _get_token_limiter("stream_words").available_tokens < 48
+
+# Streams closed after two chunks are reconciled to 11 input and 2 output tokens
+set_token_rate_limit("stream_words", None, 60)
+stream = _token_stream_words(model="stream_words", prompt=f"{prompt_words} {uuid.uuid4()}")
+next(stream), next(stream)
+stream.close()
+assert 47 <= _get_token_limiter("stream_words").available_tokens < 57
+set_token_rate_limit("stream_words", None, 60)
+async with await _async_token_stream_words(model="stream_words", prompt=f"{prompt_words} {uuid.uuid4()}") as stream:
+    await stream.__anext__(), await stream.__anext__()
+assert 47 <= _get_token_limiter("stream_words").available_tokens < 57
+set_token_rate_limit("stream_words", None, None)
@@ -12,6 +12,11 @@ import nblite; from nblite import show_doc; nblite.nbl_export()
 #|export
 try:
     import litellm
+    import functools
+    import threading
+    import numpy as np
+    from collections import OrderedDict
+    from typing import Union
     from adulib.llm._utils import _llm_func_factory
 except ImportError as e:
     raise ImportError(f"Install adulib[llm] to use this API.") from e
@@ -40,6 +45,7 @@ token_counter = _llm_func_factory(
     module_name=__name__,
     cache_key_content_args=['messages', 'text'],
     default_return_info=False,
+    rate_limited=False, # Token counting is done locally
 )
 
 # %%
@@ -81,3 +87,157 @@ assert cache_hit
 
 assert is_in_cache(cache_key)
 clear_cache_key(cache_key)
+
+# %% [markdown]
+# ## Fast token counting
+#
+# `token_counter` caches its results in the disk cache like the other LLM functions, which costs more than counting the tokens of a short text. `count_tokens` counts the tokens of a batch of texts locally, reusing the tokenizer of the model across calls, and keeps the counts in an in-memory LRU cache of `default_token_count_cache_size` entries. `count_message_tokens` counts the tokens of a list of chat messages (including the tokens added by the chat format) without caching. These are used to fill in the token counts of the call logs of the LLM functions.
+
+# %%
+#|export
+default_token_count_cache_size = 100_000
+
+# %%
+#|hide
+show_doc(this_module.set_token_count_cache_size)
+
+
+# %%
+#|export
+def set_token_count_cache_size(size: int):
+    """
+    Set the maximum number of token counts kept in the in-memory cache of `count_tokens`.
+    """
+    global default_token_count_cache_size
+    default_token_count_cache_size = size
+    with _token_count_cache_lock:
+        while len(_token_count_cache) > default_token_count_cache_size:
+            _token_count_cache.popitem(last=False)
+
+
+# %%
+#|exporti
+_token_count_cache: OrderedDict = OrderedDict() # (model, text) -> number of tokens
+_token_count_cache_lock = threading.Lock()
+_MAX_CACHED_TEXT_LENGTH = 10_000 # Longer texts are not cached, so that the cache does not hold on to large strings
+
+@functools.lru_cache(maxsize=None)
+def _get_tokenizer(model: str):
+    """
+    Returns the tokenizer of `model`, as selected by `litellm.encode`, or None if it can not be retrieved.
+    `_select_tokenizer` is private to litellm, so the texts are counted with `litellm.encode` if it is unavailable.
+    """
+    try:
+        from litellm.utils import _select_tokenizer
+        return _select_tokenizer(model=model)['tokenizer']
+    except Exception:
+        return None
+
+def _count_tokens_uncached(model: str, texts: list[str]) -> list[int]:
+    tokenizer = _get_tokenizer(model)
+    if hasattr(tokenizer, 'encode_ordinary_batch'): # tiktoken
+        return [len(tokens) for tokens in tokenizer.encode_batch(texts, disallowed_special=())]
+    if hasattr(tokenizer, 'encode_batch'): # Hugging Face tokenizers
+        return [len(encoding.ids) for encoding in tokenizer.encode_batch(texts)]
+    return [len(litellm.encode(model=model, text=text)) for text in texts]
+
+
+# %%
+#|hide
+show_doc(this_module.count_tokens)
+
+
+# %%
+#|export
+def count_tokens(model: str, texts: Union[str, list[str]]) -> np.ndarray:
+    """
+    Count the tokens of each of `texts` with the tokenizer of `model`. Returns an integer array with one count per text.
+    """
+    if isinstance(texts, str): texts = [texts]
+    counts = np.empty(len(texts), dtype=np.int64)
+    missing = []
+    with _token_count_cache_lock:
+        for i, text in enumerate(texts):
+            count = _token_count_cache.get((model, text))
+            if count is None:
+                missing.append(i)
+            else:
+                counts[i] = count
+                _token_count_cache.move_to_end((model, text))
+    if not missing: return counts
+    
+    missing_counts = _count_tokens_uncached(model, [texts[i] for i in missing])
+    with _token_count_cache_lock:
+        for i, count in zip(missing, missing_counts):
+            counts[i] = count
+            if len(texts[i]) <= _MAX_CACHED_TEXT_LENGTH:
+                _token_count_cache[(model, texts[i])] = count
+        while len(_token_count_cache) > default_token_count_cache_size:
+            _token_count_cache.popitem(last=False)
+    return counts
+
+
+# %%
+texts = ["Hello, how are you?", "Fine, thanks!", "Hello, how are you?"]
+count_tokens("gpt-4o", texts)
+
+# %%
+#|hide
+# If litellm's tokenizer selection is unavailable, the texts are counted with `litellm.encode`, with the same result
+_get_tokenizer_orig, _get_tokenizer = _get_tokenizer, lambda model: None
+assert _count_tokens_uncached("gpt-4o", texts) == list(count_tokens("gpt-4o", texts))
+_get_tokenizer = _get_tokenizer_orig
+
+# %%
+#|hide
+assert count_tokens("gpt-4o", texts).tolist() == [token_counter(model="gpt-4o", text=text, cache_enabled=False) for text in texts]
+assert count_tokens("text-embedding-3-small", "Hello, how are you?").tolist() == [6]
+assert count_tokens("gpt-4o", []).shape == (0,)
+
+set_token_count_cache_size(2)
+count_tokens("gpt-4o", ["a", "b", "c"])
+assert list(_token_count_cache) == [("gpt-4o", "b"), ("gpt-4o", "c")]
+set_token_count_cache_size(100_000)
+
+# %%
+#|hide
+show_doc(this_module.count_message_tokens)
+
+
+# %%
+#|export
+def count_message_tokens(model: str, messages: list[dict]) -> int:
+    """
+    Count the tokens of a list of chat messages with the tokenizer of `model`, including the tokens added by the chat format.
+    """
+    return litellm.token_counter(model=model, messages=messages)
+
+
+# %%
+#|hide
+_messages = [{"role": "user", "content": "Hello, how are you?"}]
+assert count_message_tokens("gpt-4o", _messages) == token_counter(model="gpt-4o", messages=_messages, cache_enabled=False)
+
+# %% [markdown]
+# The overhead of counting the input tokens of an embedding call with 1000 inputs, for its call log:
+
+# %%
+#|hide
+import tempfile
+import time
+
+_inputs = [f"This is input text number {i} of the batch, about the length of a short paragraph." for i in range(1000)]
+_tmp_cache_path = tempfile.mkdtemp()
+
+t0 = time.perf_counter()
+sum(token_counter(model="text-embedding-3-small", text=text, cache_path=_tmp_cache_path) for text in _inputs)
+print(f"token_counter (first call): {(time.perf_counter() - t0)*1000:.1f}ms")
+t0 = time.perf_counter()
+sum(token_counter(model="text-embedding-3-small", text=text, cache_path=_tmp_cache_path) for text in _inputs)
+print(f"token_counter (cached): {(time.perf_counter() - t0)*1000:.1f}ms")
+t0 = time.perf_counter()
+count_tokens("text-embedding-3-small", _inputs).sum()
+print(f"count_tokens (first call): {(time.perf_counter() - t0)*1000:.1f}ms")
+t0 = time.perf_counter()
+count_tokens("text-embedding-3-small", _inputs).sum()
+print(f"count_tokens (cached): {(time.perf_counter() - t0)*1000:.1f}ms")
@@ -18,8 +18,8 @@ try:
     from inspect import Parameter
     import functools
     from typing import List, Dict
-    from adulib.llm._utils import _llm_func_factory, _llm_async_func_factory
-    from adulib.llm.tokens import token_counter
+    from adulib.llm._utils import _llm_func_factory, _llm_async_func_factory, _llm_stream_func_factory, _llm_async_stream_func_factory
+    from adulib.llm.tokens import count_message_tokens
 except ImportError as e:
     raise ImportError(f"Install adulib[llm] to use this API.") from e
 
@@ -78,10 +78,11 @@ completion = _llm_func_factory(
     cache_key_content_args=['messages', 'response_format'],
     retrieve_log_data=lambda model, func_kwargs, response, cache_args: {
         "method": "completion",
-        "input_tokens": token_counter(model=model, messages=func_kwargs['messages'], **cache_args),
-        "output_tokens": sum([token_counter(model=model, messages=[{'role': c.message.role, 'content': c.message.content}], **cache_args) for c in response.choices]),
+        "input_tokens": count_message_tokens(model, func_kwargs['messages']),
+        "output_tokens": sum([count_message_tokens(model, [{'role': c.message.role, 'content': c.message.content}]) for c in response.choices]),
         "cost": response._hidden_params['response_cost'],
-    }
+    },
+    estimate_input_tokens=lambda model, func_kwargs: count_message_tokens(model, func_kwargs['messages']),
 )
 
 completion.__doc__ = """
@@ -169,10 +170,11 @@ async_completion = _llm_async_func_factory(
     cache_key_content_args=['messages', 'response_format'],
     retrieve_log_data=lambda model, func_kwargs, response, cache_args: {
         "method": "completion",
-        "input_tokens": token_counter(model=model, messages=func_kwargs['messages'], **cache_args),
-        "output_tokens": sum([token_counter(model=model, messages=[{'role': c.message.role, 'content': c.message.content}], **cache_args) for c in response.choices]),
+        "input_tokens": count_message_tokens(model, func_kwargs['messages']),
+        "output_tokens": sum([count_message_tokens(model, [{'role': c.message.role, 'content': c.message.content}]) for c in response.choices]),
         "cost": response._hidden_params['response_cost'],
-    }
+    },
+    estimate_input_tokens=lambda model, func_kwargs: count_message_tokens(model, func_kwargs['messages']),
 )
 
 completion.__doc__ = """
@@ -197,6 +199,134 @@ response, cache_hit, call_log = await async_completion(
 )
 response.choices[0].message.content
 
+
+# %% [markdown]
+# ## Streaming
+#
+# `stream_completion` (async: `async_stream_completion`) yields the chunks of the response as soon as they arrive. Once the stream has been consumed, the full response is available as `stream.response` and the call log as `stream.call_log`, and both are stored in the cache. Later calls replay the cached chunks. See `adulib.llm._utils.LLMStream` for details.
+
+# %%
+#|exporti
+def _build_completion_response(chunks, func_kwargs):
+    return litellm.stream_chunk_builder(chunks, messages=func_kwargs['messages'])
+
+def _get_completion_cost(response) -> float:
+    try:
+        return litellm.completion_cost(completion_response=response)
+    except Exception: # The cost is unknown for some models
+        return 0.0
+
+def _retrieve_stream_completion_log_data(model, func_kwargs, response, cache_args):
+    return {
+        "method": "stream_completion",
+        "input_tokens": count_message_tokens(model, func_kwargs['messages']),
+        "output_tokens": sum([count_message_tokens(model, [{'role': c.message.role, 'content': c.message.content}]) for c in response.choices]),
+        "cost": _get_completion_cost(response),
+    }
+
+
+# %%
+#|echo: false
+show_doc(this_module.stream_completion)
+
+# %%
+#|export
+stream_completion = _llm_stream_func_factory(
+    func=litellm.completion,
+    func_name="stream_completion",
+    func_cache_name="stream_completion",
+    module_name=__name__,
+    cache_key_content_args=['messages', 'response_format'],
+    build_response=_build_completion_response,
+    retrieve_log_data=_retrieve_stream_completion_log_data,
+    estimate_input_tokens=lambda model, func_kwargs: count_message_tokens(model, func_kwargs['messages']),
+)
+
+stream_completion.__doc__ = """
+Streaming version of `completion`, which returns an `LLMStream` of response chunks. This function is a wrapper around a corresponding function in the `litellm` library, see [this](https://docs.litellm.ai/docs/completion/stream) for details.
+""".strip()
+
+sig = inspect.signature(stream_completion)
+sig = sig.replace(parameters=[
+    Parameter("model", Parameter.POSITIONAL_OR_KEYWORD, annotation=str),
+    Parameter("messages", Parameter.POSITIONAL_OR_KEYWORD, annotation=List[Dict[str, str]]),
+    *sig.parameters.values()
+])
+stream_completion.__signature__ = sig
+
+# %%
+stream = stream_completion(
+    model="gpt-4o-mini",
+    messages=[
+        {"role": "system", "content": "You are a helpful assistant."},
+        {"role": "user", "content": "What is the capital of Norway?"}
+    ],
+    mock_response="The capital of Norway is Oslo.",
+)
+for chunk in stream:
+    print(chunk.choices[0].delta.content or "", end="")
+print()
+print(f"Cache hit: {stream.cache_hit}")
+stream.response.choices[0].message.content
+
+# %%
+#|hide
+stream = stream_completion(
+    model="gpt-4o-mini",
+    messages=[
+        {"role": "system", "content": "You are a helpful assistant."},
+        {"role": "user", "content": "What is the capital of Norway?"}
+    ],
+    mock_response="The capital of Norway is Oslo.",
+)
+assert stream.cache_hit
+assert "".join(chunk.choices[0].delta.content or "" for chunk in stream) == "The capital of Norway is Oslo."
+assert stream.call_log['method'] == "stream_completion"
+
+# %%
+#|echo: false
+show_doc(this_module.async_stream_completion)
+
+# %%
+#|export
+async_stream_completion = _llm_async_stream_func_factory(
+    func=litellm.acompletion,
+    func_name="async_stream_completion",
+    func_cache_name="stream_completion",
+    module_name=__name__,
+    cache_key_content_args=['messages', 'response_format'],
+    build_response=_build_completion_response,
+    retrieve_log_data=_retrieve_stream_completion_log_data,
+    estimate_input_tokens=lambda model, func_kwargs: count_message_tokens(model, func_kwargs['messages']),
+)
+
+async_stream_completion.__doc__ = """
+Streaming version of `async_completion`, which returns an `AsyncLLMStream` of response chunks. This function is a wrapper around a corresponding function in the `litellm` library, see [this](https://docs.litellm.ai/docs/completion/stream) for details.
+""".strip()
+
+sig = inspect.signature(async_stream_completion)
+sig = sig.replace(parameters=[
+    Parameter("model", Parameter.POSITIONAL_OR_KEYWORD, annotation=str),
+    Parameter("messages", Parameter.POSITIONAL_OR_KEYWORD, annotation=List[Dict[str, str]]),
+    *sig.parameters.values()
+])
+async_stream_completion.__signature__ = sig
+
+# %%
+stream = await async_stream_completion(
+    model="gpt-4o-mini",
+    messages=[
+        {"role": "system", "content": "You are a helpful assistant."},
+        {"role": "user", "content": "What is the capital of Denmark?"}
+    ],
+    mock_response="The capital of Denmark is Copenhagen.",
+)
+async for chunk in stream:
+    print(chunk.choices[0].delta.content or "", end="")
+print()
+print(f"Cache hit: {stream.cache_hit}")
+stream.response.choices[0].message.content
+
 # %%
 #|hide
 show_doc(this_module.single)
@@ -18,7 +18,7 @@ try:
     import litellm
     import functools
     from adulib.llm._utils import _llm_func_factory, _llm_async_func_factory
-    from adulib.llm.tokens import token_counter
+    from adulib.llm.tokens import count_tokens
 except ImportError as e:
     raise ImportError(f"Install adulib[llm] to use this API.") from e
 
@@ -49,10 +49,11 @@ text_completion = _llm_func_factory(
     cache_key_content_args=['prompt'],
     retrieve_log_data=lambda model, func_kwargs, response, cache_args: {
         "method": "text_completion",
-        "input_tokens": token_counter(model=model, text=func_kwargs['prompt'], **cache_args),
-        "output_tokens": sum([token_counter(model=model, text=c.text, **cache_args) for c in response.choices]),
+        "input_tokens": int(count_tokens(model, func_kwargs['prompt']).sum()),
+        "output_tokens": int(count_tokens(model, [c.text for c in response.choices]).sum()),
         "cost": response._hidden_params['response_cost'],
-    }
+    },
+    estimate_input_tokens=lambda model, func_kwargs: int(count_tokens(model, func_kwargs['prompt']).sum()),
 )
 
 text_completion.__doc__ = """
@@ -88,10 +89,11 @@ async_text_completion = _llm_async_func_factory(
     cache_key_content_args=['prompt'],
     retrieve_log_data=lambda model, func_kwargs, response, cache_args: {
         "method": "text_completion",
-        "input_tokens": token_counter(model=model, text=func_kwargs['prompt'], **cache_args),
-        "output_tokens": sum([token_counter(model=model, text=c.text, **cache_args) for c in response.choices]),
+        "input_tokens": int(count_tokens(model, func_kwargs['prompt']).sum()),
+        "output_tokens": int(count_tokens(model, [c.text for c in response.choices]).sum()),
         "cost": response._hidden_params['response_cost'],
-    }
+    },
+    estimate_input_tokens=lambda model, func_kwargs: int(count_tokens(model, func_kwargs['prompt']).sum()),
 )
 
 async_text_completion.__doc__ = """
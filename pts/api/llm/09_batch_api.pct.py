@@ -0,0 +1,503 @@
+# %% [markdown]
+# # batch_api
+#
+# > Bulk completions and embeddings through the discounted asynchronous batch APIs of the providers. See the [`litellm` documentation](https://docs.litellm.ai/docs/batches).
+#
+# A batch job takes a list of requests to a single model. Requests that are already in the cache are skipped, and the rest are submitted as a batch job through the `litellm` file and batch APIs. Once the job has completed, the results are written to the cache together with their call logs, under the same cache keys as used by `completion`/`async_completion` (or `embedding`/`async_embedding`). Subsequent calls to these functions are thereby cache hits.
+
+# %%
+#|default_exp llm.batch_api
+
+# %%
+#|hide
+import nblite; from nblite import show_doc; nblite.nbl_export()
+
+# %%
+#|export
+try:
+    import litellm
+    import asyncio
+    import dataclasses
+    import hashlib
+    import json
+    import time
+    import warnings
+    from pathlib import Path
+    from typing import Any, Dict, List, Literal, Optional, Union
+    from pydantic import BaseModel
+    from diskcache import ENOVAL
+    from litellm.cost_calculator import batch_cost_calculator
+    from adulib.caching import get_default_cache_path
+    from adulib.llm.caching import _async_get_cache_record, _async_set_cache_record
+    from adulib.llm.call_logging import _async_log_call, _add_log_to_tracker, CallLog
+    from adulib.llm.completions import async_completion
+    from adulib.llm.embeddings import async_embedding
+except ImportError as e:
+    raise ImportError(f"Install adulib[llm] to use this API.") from e
+
+# %%
+#|hide
+from adulib.caching import set_default_cache_path
+import adulib.llm.batch_api as this_module
+
+# %%
+#|hide
+from adulib.llm import set_call_log_save_path
+repo_path = nblite.config.get_project_root_and_config()[0]
+set_default_cache_path(repo_path / '.tmp_cache')
+set_call_log_save_path(repo_path / '.call_logs.jsonl')
+
+# %%
+#|exporti
+_batch_methods = {
+    'completion': {
+        'endpoint': '/v1/chat/completions',
+        'cache_key_func': async_completion,
+        'response_type': litellm.ModelResponse,
+    },
+    'embedding': {
+        'endpoint': '/v1/embeddings',
+        'cache_key_func': async_embedding,
+        'response_type': litellm.EmbeddingResponse,
+    },
+}
+
+# %% [markdown]
+# ## Batch providers
+#
+# A `BatchProvider` submits the requests of a batch job to a provider, and retrieves its status and results. The requests and results are given as the lines of the JSONL files of the [OpenAI batch API](https://platform.openai.com/docs/guides/batch), which `litellm` uses for all providers.
+
+# %%
+#|hide
+show_doc(this_module.BatchProvider)
+
+
+# %%
+#|export
+class BatchProvider:
+    """
+    Interface of a provider of a batch API.
+    """
+    async def submit(self, requests: List[dict], endpoint: str) -> str:
+        "Submits the requests (lines of the batch input file) as a batch job, and returns the id of the job."
+        raise NotImplementedError
+
+    async def get_status(self, batch_id: str) -> str:
+        "Returns the status of a batch job, e.g. 'in_progress', 'completed', 'failed', 'expired' or 'cancelled'."
+        raise NotImplementedError
+
+    async def get_results(self, batch_id: str) -> List[dict]:
+        "Returns the results (lines of the batch output and error files) of a completed or expired batch job."
+        raise NotImplementedError
+
+
+# %%
+#|hide
+show_doc(this_module.LiteLLMBatchProvider)
+
+
+# %%
+#|export
+class LiteLLMBatchProvider(BatchProvider):
+    """
+    Submits batch jobs using the file and batch APIs of `litellm`.
+
+    Args:
+        custom_llm_provider (str): The provider of the batch API, e.g. 'openai', 'azure' or 'vertex_ai'.
+        **litellm_kwargs: Additional keyword arguments (e.g. `api_key`) passed to the `litellm` file and batch functions.
+    """
+    def __init__(self, custom_llm_provider: str = 'openai', **litellm_kwargs):
+        self.custom_llm_provider = custom_llm_provider
+        self.litellm_kwargs = litellm_kwargs
+
+    async def submit(self, requests: List[dict], endpoint: str) -> str:
+        content = "\n".join(json.dumps(request) for request in requests).encode()
+        input_file = await litellm.acreate_file(
+            file=("batch_input.jsonl", content), purpose="batch", custom_llm_provider=self.custom_llm_provider, **self.litellm_kwargs,
+        )
+        batch = await litellm.acreate_batch(
+            completion_window="24h", endpoint=endpoint, input_file_id=input_file.id, custom_llm_provider=self.custom_llm_provider, **self.litellm_kwargs,
+        )
+        return batch.id
+
+    async def _retrieve_batch(self, batch_id: str):
+        return await litellm.aretrieve_batch(batch_id=batch_id, custom_llm_provider=self.custom_llm_provider, **self.litellm_kwargs)
+
+    async def get_status(self, batch_id: str) -> str:
+        return (await self._retrieve_batch(batch_id)).status
+
+    async def get_results(self, batch_id: str) -> List[dict]:
+        batch = await self._retrieve_batch(batch_id)
+        results = []
+        for file_id in [batch.output_file_id, batch.error_file_id]:
+            if file_id is None: continue
+            content = await litellm.afile_content(file_id=file_id, custom_llm_provider=self.custom_llm_provider, **self.litellm_kwargs)
+            results.extend(json.loads(line) for line in content.text.splitlines() if line.strip())
+        return results
+
+
+# %%
+#|hide
+show_doc(this_module.FakeBatchProvider)
+
+
+# %%
+#|export
+class FakeBatchProvider(BatchProvider):
+    """
+    A local batch provider for testing, which completes a batch job after it has been polled `num_polls` times.
+
+    Completions respond with the `mock_response` of the request if given, and otherwise echo the last message.
+    Embeddings are pseudo-random vectors of dimension `embedding_dim` derived from the input. Requests whose
+    `custom_id` is in `failing_custom_ids` fail.
+    """
+    def __init__(self, num_polls: int = 1, embedding_dim: int = 8, failing_custom_ids: Optional[List[str]] = None):
+        self.num_polls = num_polls
+        self.embedding_dim = embedding_dim
+        self.failing_custom_ids = set(failing_custom_ids or [])
+        self.batches: Dict[str, dict] = {}
+
+    async def submit(self, requests: List[dict], endpoint: str) -> str:
+        batch_id = f"fake_batch_{len(self.batches)}"
+        self.batches[batch_id] = {'requests': requests, 'endpoint': endpoint, 'num_polls': 0}
+        return batch_id
+
+    async def get_status(self, batch_id: str) -> str:
+        batch = self.batches[batch_id]
+        batch['num_polls'] += 1
+        return 'completed' if batch['num_polls'] >= self.num_polls else 'in_progress'
+
+    def _embed(self, text: str) -> List[float]:
+        digest = hashlib.blake2b(text.encode(), digest_size=self.embedding_dim).digest()
+        return [b / 255 for b in digest]
+
+    def _get_response_body(self, body: dict, endpoint: str) -> dict:
+        if endpoint == '/v1/embeddings':
+            inputs = body['input'] if isinstance(body['input'], list) else [body['input']]
+            num_tokens = sum(len(text.split()) for text in inputs)
+            return {
+                'object': 'list',
+                'model': body['model'],
+                'data': [{'object': 'embedding', 'index': i, 'embedding': self._embed(text)} for i, text in enumerate(inputs)],
+                'usage': {'prompt_tokens': num_tokens, 'total_tokens': num_tokens},
+            }
+        content = body.get('mock_response', body['messages'][-1]['content'])
+        input_tokens = sum(len(str(message['content']).split()) for message in body['messages'])
+        output_tokens = len(content.split())
+        return {
+            'id': f"chatcmpl-{hashlib.blake2b(json.dumps(body).encode(), digest_size=8).hexdigest()}",
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body['model'],
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': input_tokens, 'completion_tokens': output_tokens, 'total_tokens': input_tokens + output_tokens},
+        }
+
+    async def get_results(self, batch_id: str) -> List[dict]:
+        batch = self.batches[batch_id]
+        results = []
+        for request in batch['requests']:
+            if request['custom_id'] in self.failing_custom_ids:
+                response = {'status_code': 400, 'body': {'error': {'message': "Fake failure"}}}
+            else:
+                response = {'status_code': 200, 'body': self._get_response_body(request['body'], batch['endpoint'])}
+            results.append({'custom_id': request['custom_id'], 'response': response, 'error': None})
+        return results
+
+
+# %% [markdown]
+# ## Batch jobs
+
+# %%
+#|hide
+show_doc(this_module.BatchJob)
+
+
+# %%
+#|export
+@dataclasses.dataclass
+class BatchJob:
+    """
+    A batch job, as returned by `async_submit_batch`.
+
+    Attributes:
+        method: The LLM function of the requests ('completion' or 'embedding').
+        model: The model of the requests.
+        requests: The requests (keyword arguments of the LLM function).
+        results: The results of the requests, in order. Results of pending and failed requests are `None`.
+        call_logs: The call logs of the results, in order.
+        cache_hits: Whether each result was retrieved from the cache.
+        errors: The errors of the failed requests, by index.
+        batch_id: The id of the batch job at the provider, or `None` if all requests were cache hits.
+        status: The status of the batch job.
+    """
+    method: str
+    model: str
+    requests: List[dict]
+    provider: BatchProvider
+    cache_path: Path
+    cache_keys: List[Any]
+    results: List[Any]
+    call_logs: List[Optional[dict]]
+    cache_hits: List[bool]
+    errors: Dict[int, Any] = dataclasses.field(default_factory=dict)
+    batch_id: Optional[str] = None
+    status: Optional[str] = None
+
+    @property
+    def pending(self) -> List[int]:
+        "Indices of the requests that were submitted and have not been retrieved yet."
+        return [i for i, result in enumerate(self.results) if result is None and i not in self.errors and not self.cache_hits[i]]
+
+
+# %%
+#|exporti
+def _to_batch_body(model: str, request: dict) -> dict:
+    body = {'model': litellm.get_llm_provider(model)[0], **request}
+    response_format = body.get('response_format')
+    if isinstance(response_format, type) and issubclass(response_format, BaseModel):
+        body['response_format'] = litellm.utils.type_to_response_format_param(response_format)
+    return body
+
+
+# %%
+#|hide
+show_doc(this_module.async_submit_batch)
+
+
+# %%
+#|export
+async def async_submit_batch(
+    method: Literal['completion', 'embedding'],
+    model: str,
+    requests: List[dict],
+    provider: Optional[BatchProvider] = None,
+    cache_path: Optional[Union[str, Path]] = None,
+    cache_key_prefix: Optional[str] = None,
+    include_model_in_cache_key: bool = True,
+    cache_key_params: Optional[List[str]] = None,
+) -> BatchJob:
+    """
+    Submits a list of requests to a model as a batch job. Requests that are already in the cache are not submitted.
+
+    Args:
+        method: The LLM function of the requests ('completion' or 'embedding').
+        model: The model of the requests.
+        requests: The requests, given as the keyword arguments of the LLM function (e.g. `{'messages': [...]}`).
+        provider: The batch provider. Defaults to `LiteLLMBatchProvider()`, which uses the OpenAI batch API.
+        cache_path, cache_key_prefix, include_model_in_cache_key, cache_key_params: The cache settings, as for the LLM function.
+
+    Returns:
+        BatchJob: The submitted batch job. Use `async_collect_batch` to wait for its results.
+    """
+    if method not in _batch_methods:
+        raise ValueError(f"Unsupported batch method '{method}'. Must be one of {list(_batch_methods)}.")
+    if provider is None: provider = LiteLLMBatchProvider()
+    if cache_path is None: cache_path = get_default_cache_path()
+    batch_method = _batch_methods[method]
+
+    cache_keys = [
+        await batch_method['cache_key_func'](
+            model=model, **request, cache_key_prefix=cache_key_prefix, include_model_in_cache_key=include_model_in_cache_key,
+            cache_key_params=cache_key_params, return_cache_key=True,
+        )
+        for request in requests
+    ]
+
+    job = BatchJob(
+        method=method, model=model, requests=requests, provider=provider, cache_path=Path(cache_path), cache_keys=cache_keys,
+        results=[None] * len(requests), call_logs=[None] * len(requests), cache_hits=[False] * len(requests),
+    )
+
+    batch_requests = []
+    for i, (request, key) in enumerate(zip(requests, cache_keys)):
+        record = await _async_get_cache_record(key, cache_path)
+        if record is not ENOVAL:
+            job.results[i], job.call_logs[i] = record
+            job.cache_hits[i] = True
+            if job.call_logs[i] is not None:
+                _add_log_to_tracker(CallLog(**job.call_logs[i]), True)
+        else:
+            batch_requests.append({'custom_id': str(i), 'method': 'POST', 'url': batch_method['endpoint'], 'body': _to_batch_body(model, request)})
+
+    if batch_requests:
+        job.batch_id = await provider.submit(batch_requests, batch_method['endpoint'])
+        job.status = 'submitted'
+    else:
+        job.status = 'completed'
+    return job
+
+
+# %%
+#|exporti
+def _get_batch_cost(model: str, usage) -> float:
+    try:
+        return sum(batch_cost_calculator(usage, model))
+    except Exception: # The cost is unknown for some models
+        return 0.0
+
+async def _backfill_result(job: BatchJob, index: int, body: dict):
+    "Stores a result of a batch job in the cache, together with its call log."
+    response = _batch_methods[job.method]['response_type'](**body)
+    cache_key = job.cache_keys[index]
+    call_log = await _async_log_call(
+        cache_key, job.cache_path, model=job.model, method=f"batch_{job.method}",
+        input_tokens=response.usage.prompt_tokens,
+        output_tokens=response.usage.completion_tokens if job.method == 'completion' else None,
+        cost=_get_batch_cost(job.model, response.usage),
+    )
+    _add_log_to_tracker(CallLog(**call_log), False)
+    await _async_set_cache_record(cache_key, response, call_log, job.cache_path)
+    job.results[index], job.call_logs[index] = response, call_log
+
+
+# %%
+#|hide
+show_doc(this_module.async_collect_batch)
+
+
+# %%
+#|export
+async def async_collect_batch(
+    job: BatchJob,
+    poll_interval: float = 60,
+    timeout: Optional[float] = None,
+) -> BatchJob:
+    """
+    Waits for a batch job to finish, and stores its results in the cache together with their call logs.
+
+    Args:
+        job: The batch job, as returned by `async_submit_batch`.
+        poll_interval: The time (in seconds) between two status checks.
+        timeout: The maximum time (in seconds) to wait. Defaults to no limit.
+
+    Returns:
+        BatchJob: The batch job, with its results, call logs and errors filled in.
+    """
+    if job.batch_id is None or not job.pending: return job
+
+    start = time.monotonic()
+    while True:
+        job.status = await job.provider.get_status(job.batch_id)
+        if job.status in ('completed', 'expired'): break # Expired jobs may have partial results
+        if job.status in ('failed', 'cancelled'):
+            raise RuntimeError(f"Batch job '{job.batch_id}' {job.status}.")
+        if timeout is not None and time.monotonic() - start > timeout:
+            raise TimeoutError(f"Batch job '{job.batch_id}' did not finish within {timeout} seconds (status: '{job.status}').")
+        await asyncio.sleep(poll_interval)
+
+    for result in await job.provider.get_results(job.batch_id):
+        index = int(result['custom_id'])
+        response = result.get('response') or {}
+        if response.get('status_code') == 200:
+            await _backfill_result(job, index, response['body'])
+        else:
+            job.errors[index] = result.get('error') or response.get('body')
+
+    for index in job.pending: # Requests that are missing from the results
+        job.errors[index] = f"No result returned for batch job '{job.batch_id}' (status: '{job.status}')."
+    if job.errors:
+        warnings.warn(f"{len(job.errors)} of {len(job.requests)} requests of batch job '{job.batch_id}' failed. See `BatchJob.errors`.")
+    return job
+
+
+# %%
+#|hide
+show_doc(this_module.async_run_batch)
+
+
+# %%
+#|export
+async def async_run_batch(
+    method: Literal['completion', 'embedding'],
+    model: str,
+    requests: List[dict],
+    provider: Optional[BatchProvider] = None,
+    poll_interval: float = 60,
+    timeout: Optional[float] = None,
+    **cache_kwargs,
+) -> BatchJob:
+    """
+    Submits a list of requests as a batch job (see `async_submit_batch`), and waits for its results (see `async_collect_batch`).
+    """
+    job = await async_submit_batch(method, model, requests, provider=provider, **cache_kwargs)
+    return await async_collect_batch(job, poll_interval=poll_interval, timeout=timeout)
+
+
+# %% [markdown]
+# ## Examples
+#
+# The examples below use the `FakeBatchProvider`. To use the OpenAI batch API, omit the `provider` argument.
+
+# %%
+import uuid
+from adulib.llm.completions import completion
+
+provider = FakeBatchProvider(num_polls=2)
+questions = [f"What is {i} + {i}? ({uuid.uuid4()})" for i in range(3)]
+job = await async_run_batch(
+    'completion',
+    model="gpt-4o-mini",
+    requests=[{'messages': [{'role': 'user', 'content': question}]} for question in questions],
+    provider=provider,
+    poll_interval=0,
+)
+[response.choices[0].message.content for response in job.results]
+
+# %% [markdown]
+# The results are now in the cache, so the corresponding calls to `completion` are cache hits:
+
+# %%
+response, cache_hit, call_log = completion(model="gpt-4o-mini", messages=[{'role': 'user', 'content': questions[0]}])
+assert cache_hit and call_log['method'] == "batch_completion"
+response.choices[0].message.content
+
+# %%
+#|hide
+response, cache_hit, call_log = await async_completion(model="gpt-4o-mini", messages=[{'role': 'user', 'content': questions[1]}])
+assert cache_hit and response.choices[0].message.content == questions[1]
+
+# Cached requests are not submitted again
+questions.append(f"What is 3 + 3? ({uuid.uuid4()})")
+job = await async_run_batch(
+    'completion',
+    model="gpt-4o-mini",
+    requests=[{'messages': [{'role': 'user', 'content': question}]} for question in questions],
+    provider=provider,
+    poll_interval=0,
+)
+assert job.cache_hits == [True, True, True, False]
+assert len(provider.batches[job.batch_id]['requests']) == 1
+assert [response.choices[0].message.content for response in job.results] == questions
+
+# %%
+#|hide
+# Failed requests are reported in `BatchJob.errors`, and are not cached
+provider = FakeBatchProvider(failing_custom_ids=["1"])
+questions = [f"What is {i} + {i}? ({uuid.uuid4()})" for i in range(2)]
+with warnings.catch_warnings(record=True) as caught_warnings:
+    warnings.simplefilter("always")
+    job = await async_run_batch(
+        'completion',
+        model="gpt-4o-mini",
+        requests=[{'messages': [{'role': 'user', 'content': question}]} for question in questions],
+        provider=provider,
+        poll_interval=0,
+    )
+assert len(caught_warnings) == 1
+assert job.results[1] is None and list(job.errors) == [1]
+assert not (await async_completion(model="gpt-4o-mini", messages=[{'role': 'user', 'content': questions[1]}], mock_response="Not cached"))[1]
+
+# %%
+texts = [f"Text to embed {uuid.uuid4()}" for _ in range(2)]
+job = await async_run_batch(
+    'embedding',
+    model="text-embedding-3-small",
+    requests=[{'input': [text]} for text in texts],
+    provider=FakeBatchProvider(),
+    poll_interval=0,
+)
+response, cache_hit, call_log = await async_embedding(model="text-embedding-3-small", input=[texts[0]])
+assert cache_hit
+# Embeddings are stored in the cache as float32
+assert all(abs(a - b) < 1e-6 for a, b in zip(response.data[0]['embedding'], job.results[0].data[0]['embedding']))
@@ -380,6 +380,111 @@ def my_prop():
     return 42
 
 
+# %%
+#|hide
+show_doc(adulib.reflection.lazy_module_attrs)
+
+
+# %%
+#|export
+def lazy_module_attrs(package_name: str, submodule_attrs: dict[str, list[str]]):
+    """
+    Create module-level `__getattr__` and `__dir__` functions that defer the import
+    of a package's submodules until one of their attributes is first accessed.
+
+    Intended to be used in a package `__init__.py` in place of `from .submodule import *`,
+    so that heavy dependencies are only imported on first use.
+
+    Example:
+    ```python
+    __getattr__, __dir__ = lazy_module_attrs(__name__, {
+        'wrangle': ['df_to_tsv', 'flatten_dict'],
+    })
+    ```
+
+    Parameters:
+    package_name (str): The `__name__` of the package.
+    submodule_attrs (dict[str, list[str]]): Maps relative submodule names (e.g. `'utils.wrangle'`)
+        to the attribute names that should be lazily loaded from them.
+
+    Returns:
+    tuple: The `(__getattr__, __dir__)` functions to set on the package.
+    """
+    attr_to_submodule = {attr: submod for submod, attrs in submodule_attrs.items() for attr in attrs}
+    lazy_submodules = {submod.split('.')[0] for submod in submodule_attrs}
+
+    def __getattr__(name):
+        if name in attr_to_submodule:
+            submod = importlib.import_module(f".{attr_to_submodule[name]}", package_name)
+            value = getattr(submod, name)
+            setattr(sys.modules[package_name], name, value)
+            return value
+        if name in lazy_submodules:
+            return importlib.import_module(f".{name}", package_name)
+        raise AttributeError(f"module '{package_name}' has no attribute '{name}'")
+
+    def __dir__():
+        return sorted(set(vars(sys.modules[package_name])) | set(attr_to_submodule) | lazy_submodules)
+
+    return __getattr__, __dir__
+
+
+# %% [markdown]
+# `adulib` uses `lazy_module_attrs` so that `import adulib` does not import `litellm`, `pandas`, `sklearn`, `rapidfuzz` or `aiohttp`. The following checks that this stays true and that the import time of `adulib` stays within budget.
+
+# %%
+import subprocess
+
+import_time_budget = 0.5 # seconds
+heavy_modules = ['litellm', 'pandas', 'sklearn', 'rapidfuzz', 'aiohttp']
+
+res = subprocess.run(
+    [sys.executable, '-X', 'importtime', '-c', 'import adulib, sys; print(",".join(sys.modules))'],
+    capture_output=True, text=True, check=True,
+)
+imported_modules = res.stdout.strip().split(',')
+adulib_import_time = max(
+    int(line.split('|')[1]) for line in res.stderr.splitlines()
+    if line.startswith('import time:') and line.split('|')[2].strip() == 'adulib'
+) / 1e6
+
+assert not [m for m in heavy_modules if m in imported_modules], [m for m in heavy_modules if m in imported_modules]
+assert adulib_import_time < import_time_budget, f"`import adulib` took {adulib_import_time:.2f}s (budget: {import_time_budget}s)"
+print(f"`import adulib` took {adulib_import_time:.3f}s")
+
+# %% [markdown]
+# The lazily loaded names of each package are listed by hand, so the following checks that they match the `__all__` of the submodules they are loaded from. The submodules' `__all__` are read from their source, so that the heavy dependencies are not imported.
+
+# %%
+import ast
+import importlib
+from pathlib import Path
+
+not_reexported = {'sig'} # Used to build the signatures of the LLM functions
+
+def _read_module_all(module_path: Path) -> list | None:
+    for node in ast.parse(module_path.read_text()).body:
+        if isinstance(node, ast.Assign) and any(isinstance(t, ast.Name) and t.id == '__all__' for t in node.targets):
+            return ast.literal_eval(node.value)
+    return None
+
+for package_name in ['adulib', 'adulib.cli', 'adulib.utils', 'adulib.llm', 'adulib.algos']:
+    package_dir = Path(importlib.util.find_spec(package_name).origin).parent
+    for submod, attrs in vars(importlib.import_module(package_name))['_submodule_attrs'].items():
+        if not attrs: continue # Only the submodule itself is loaded lazily
+        module_all = _read_module_all(package_dir.joinpath(*submod.split('.')).with_suffix('.py'))
+        if module_all is None: continue # Private modules that do not define `__all__`
+        assert set(attrs) == set(module_all) - not_reexported, (
+            f"{package_name}: the lazy names of '{submod}' do not match its `__all__`: {set(attrs) ^ (set(module_all) - not_reexported)}"
+        )
+
+res = subprocess.run(
+    [sys.executable, '-c', 'from adulib import *; print(AsyncAPIHandler.__name__, df_to_tsv.__name__, run_fzf.__name__)'],
+    capture_output=True, text=True, check=True,
+)
+assert res.stdout.split() == ['AsyncAPIHandler', 'df_to_tsv', 'run_fzf']
+
+
 # %%
 def add_method(cls):
     def decorator(func):